@@ -0,0 +1,135 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import subprocess
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from ..utils.doc_converter import (
+    LIBREOFFICE_WORKERS,
+    ConvertingError,
+    OfficeConverterPool,
+)
+from ..utils.files import read_binary_file, write_binary_file
+
+# Office to PDF conversion throughput, a soffice process per document against
+# the pool of long-lived LibreOffice workers. The first pool job of each worker
+# includes its start, run with --warm-up to leave it out.
+#
+#   python -m src.bench.office_conversion docs/*.pptx --repeat 5 --concurrency 4
+
+
+def percentile_ms(timings: List[float], q: float) -> float:
+    return float(np.percentile(timings, q)) * 1000
+
+
+# baseline, a cold soffice process per document
+def convert_to(source: bytes, from_format: str, to_format: str, timeout: int) -> bytes:
+
+    with NamedTemporaryFile(
+        suffix=f".{from_format}"
+    ) as src_file, TemporaryDirectory() as out_dir:
+
+        write_binary_file(src_file.name, source)
+
+        args = [
+            "libreoffice",
+            "--headless",
+            "--convert-to",
+            to_format,
+            "--outdir",
+            out_dir,
+            src_file.name,
+        ]
+        process = subprocess.run(
+            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout
+        )
+        out_file_gr = re.search("-> (.*?) using filter", process.stdout.decode())
+
+        if out_file_gr is None:
+            raise ConvertingError(process.stdout.decode())
+        else:
+            return read_binary_file(out_file_gr.group(1))
+
+
+def run(
+    name: str,
+    convert: Callable[[bytes, str], bytes],
+    docs: List[Tuple[bytes, str]],
+    concurrency: int,
+):
+    timings = []
+    errors = 0
+
+    def job(doc: Tuple[bytes, str]):
+        nonlocal errors
+        started_at = time.perf_counter()
+        try:
+            convert(*doc)
+        except (ConvertingError, subprocess.TimeoutExpired):
+            errors += 1
+        timings.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(job, docs))
+    elapsed = time.perf_counter() - started_at
+    print(
+        f"{name:<16}{len(docs) / elapsed:>10.2f}"
+        f"{percentile_ms(timings, 50):>10.0f}{percentile_ms(timings, 95):>10.0f}"
+        f"{errors:>8}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+", help="docx, pptx or xlsx files")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=LIBREOFFICE_WORKERS)
+    parser.add_argument("--workers", type=int, default=LIBREOFFICE_WORKERS)
+    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument("--warm-up", action="store_true")
+    parser.add_argument(
+        "--skip-baseline", action="store_true", help="only measure the pool"
+    )
+    args = parser.parse_args()
+
+    docs = [
+        (read_binary_file(file), os.path.splitext(file)[1][1:].lower())
+        for file in args.files
+    ] * args.repeat
+
+    print(f"docs={len(docs)} concurrency={args.concurrency} workers={args.workers}")
+    print(f"{'converter':<16}{'docs/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+
+    if not args.skip_baseline:
+        run(
+            "soffice/doc",
+            lambda source, format: convert_to(
+                source=source, from_format=format, to_format="pdf", timeout=args.timeout
+            ),
+            docs,
+            args.concurrency,
+        )
+
+    pool = OfficeConverterPool(workers=args.workers)
+    try:
+
+        def pool_convert(source: bytes, format: str) -> bytes:
+            return pool.convert(
+                source=source, from_format=format, to_format="pdf", timeout=args.timeout
+            )
+
+        if args.warm_up:
+            run("pool warm-up", pool_convert, docs[: args.workers], args.workers)
+        run("pool", pool_convert, docs, args.concurrency)
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
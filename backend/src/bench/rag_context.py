@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import base64
+import io
+import time
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+from ..classifier.classifier_service import MAX_IMAGES, ClassifierService
+from ..classifier.rag_context import RagContextBuilder, estimate_image_tokens
+from ..classifier.renditions import Rendition
+from ..colpali.colpali_service import ColpaliService
+from ..database import SessionLocal
+from ..rag.rag_service import RagService
+
+# Prompt size of the RAG images sent for the top search results of each query:
+# model input renditions as they were sent before, downscaled to the token
+# budget only, and cropped by the similarity map then downscaled.
+# With --llm also the time to first token and the total answer time of each.
+#
+#   python -m src.bench.rag_context queries.txt --llm
+
+
+def percentile_ms(timings: List[float], q: float) -> float:
+    return float(np.percentile(timings, q)) * 1000
+
+
+def image_tokens(image: bytes) -> int:
+    with Image.open(io.BytesIO(image)) as img:
+        return estimate_image_tokens(img.width, img.height)
+
+
+async def run(queries: List[str], llm: bool):
+    service = ClassifierService()
+    doc_indexer = ColpaliService()
+    await doc_indexer.init()
+    rag = RagService()
+    variants = {
+        "downscaled": RagContextBuilder(crop=False),
+        "cropped": RagContextBuilder(crop=True),
+    }
+    # variant -> per query values
+    prompt_bytes: Dict[str, List[int]] = {name: [] for name in ["original", *variants]}
+    tokens: Dict[str, List[int]] = {name: [] for name in prompt_bytes}
+    first_token: Dict[str, List[float]] = {name: [] for name in prompt_bytes}
+    total: Dict[str, List[float]] = {name: [] for name in prompt_bytes}
+    try:
+        with SessionLocal() as db:
+            for query in queries:
+                results = await service.find_documents_by_query(db, query, doc_indexer)
+                chunk_ids = [result.chunk_id for result in results[:MAX_IMAGES]]
+                if not chunk_ids:
+                    continue
+                chunks = await run_in_threadpool(service.get_rag_images, db, chunk_ids)
+                full_chunks = await run_in_threadpool(
+                    service.get_rag_images, db, chunk_ids, Rendition.FULL
+                )
+                sim_maps = await doc_indexer.similarity_maps(
+                    query, [image_hash for image_hash, _ in chunks]
+                )
+                contexts = {"original": [image for _, image in chunks]}
+                for name, builder in variants.items():
+                    # as build_rag_context does, crops come from the original
+                    source = full_chunks if builder.crop else chunks
+                    contexts[name] = await run_in_threadpool(
+                        builder.build, [image for _, image in source], sim_maps
+                    )
+
+                for name, images in contexts.items():
+                    prompt_bytes[name].append(
+                        sum(len(base64.b64encode(image)) for image in images)
+                    )
+                    tokens[name].append(sum(image_tokens(image) for image in images))
+                    if not llm:
+                        continue
+                    started_at = time.perf_counter()
+                    first_token_at = None
+                    async for _ in rag.question_stream(query, images=images):
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                    finished_at = time.perf_counter()
+                    first_token[name].append(
+                        (first_token_at or finished_at) - started_at
+                    )
+                    total[name].append(finished_at - started_at)
+    finally:
+        await rag.close()
+        await doc_indexer.close()
+
+    print(f"queries={len(tokens['original'])} images_per_query<={MAX_IMAGES}")
+    header = f"{'context':<12}{'KiB':>10}{'tokens':>10}"
+    if llm:
+        header += f"{'ttft p50':>10}{'ttft p95':>10}{'total p50':>11}{'total p95':>11}"
+    print(header)
+    for name in prompt_bytes:
+        if not tokens[name]:
+            continue
+        line = (
+            f"{name:<12}{np.mean(prompt_bytes[name]) / 1024:>10.1f}"
+            f"{np.mean(tokens[name]):>10.0f}"
+        )
+        if llm and total[name]:
+            line += (
+                f"{percentile_ms(first_token[name], 50):>10.0f}"
+                f"{percentile_ms(first_token[name], 95):>10.0f}"
+                f"{percentile_ms(total[name], 50):>11.0f}"
+                f"{percentile_ms(total[name], 95):>11.0f}"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", help="text file, one query per line")
+    parser.add_argument(
+        "--llm", action="store_true", help="also ask the LLM with every context"
+    )
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+    asyncio.run(run(queries, args.llm))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import json
+import math
+from typing import Dict, List, Set
+
+import numpy as np
+
+from ..colpali.colpali_collection import point_multivector
+from ..colpali.colpali_service import ColpaliService
+from ..colpali.maxsim import maxsim_scores
+from ..colpali.pooling import normalize_rows, pool_tokens_batch
+
+# Storage and retrieval quality of index time token pooling, scored locally
+# with exact MaxSim over the vectors stored in Qdrant.
+# Labels file is JSONL: {"query": "...", "relevant": [chunk_id, ...]}
+#
+#   python -m src.bench.token_pooling labels.jsonl --pool-factor 2 3 4
+
+
+def ndcg_at_k(ranking: List[int], relevant: Set[int], k: int) -> float:
+    dcg = sum(
+        1 / math.log2(rank + 2)
+        for rank, chunk_id in enumerate(ranking[:k])
+        if chunk_id in relevant
+    )
+    ideal = sum(1 / math.log2(rank + 2) for rank in range(min(len(relevant), k)))
+    return dcg / ideal if ideal else 0.0
+
+
+async def load_corpus(service: ColpaliService) -> Dict[int, np.ndarray]:
+    collection_name = await service.resolve_collection()
+    assert collection_name is not None
+    ret = {}
+    offset = None
+    while True:
+        points, offset = await service.qdrant.scroll(
+            collection_name=collection_name,
+            limit=64,
+            offset=offset,
+            with_vectors=True,
+        )
+        for point in points:
+            ret[int(point.id)] = normalize_rows(
+                point_multivector(service.layout, point.vector)
+            )
+        if offset is None:
+            return ret
+
+
+def evaluate(
+    corpus: Dict[int, np.ndarray],
+    queries: List[np.ndarray],
+    labels: List[Set[int]],
+    k: int,
+) -> float:
+    chunk_ids = list(corpus.keys())
+    multivectors = list(corpus.values())
+    ret = []
+    for query, relevant in zip(queries, labels):
+        scores = maxsim_scores(query, multivectors)
+        ranking = [chunk_ids[i] for i in np.argsort(-scores)]
+        ret.append(ndcg_at_k(ranking, relevant, k))
+    return float(np.mean(ret))
+
+
+async def run(labels_path: str, pool_factors: List[float], k: int):
+    with open(labels_path) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+
+    service = ColpaliService()
+    await service.init()
+    try:
+        corpus = await load_corpus(service)
+        queries = [
+            normalize_rows(await service.embed_query(sample["query"]))
+            for sample in samples
+        ]
+    finally:
+        await service.close()
+    labels = [set(sample["relevant"]) for sample in samples]
+
+    def storage(c: Dict[int, np.ndarray]):
+        return sum(mv.shape[0] for mv in c.values())
+
+    base_tokens = storage(corpus)
+    base_ndcg = evaluate(corpus, queries, labels, k)
+    print(f"points={len(corpus)} queries={len(queries)} k={k}")
+    print(f"{'factor':<8}{'tokens':>12}{'size':>10}{f'nDCG@{k}':>10}{'delta':>10}")
+    print(f"{'stored':<8}{base_tokens:>12}{1.0:>10.2f}{base_ndcg:>10.4f}{0.0:>10.4f}")
+
+    for pool_factor in pool_factors:
+        ids = list(corpus.keys())
+        pooled = dict(zip(ids, pool_tokens_batch(list(corpus.values()), pool_factor)))
+        tokens = storage(pooled)
+        ndcg = evaluate(pooled, queries, labels, k)
+        print(
+            f"{pool_factor:<8g}{tokens:>12}{tokens / base_tokens:>10.2f}"
+            f"{ndcg:>10.4f}{ndcg - base_ndcg:>10.4f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("labels", help="JSONL with query and relevant chunk ids")
+    parser.add_argument("--pool-factor", type=float, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.labels, args.pool_factor, args.k))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import time
+from typing import List
+
+import numpy as np
+
+from ..colpali.colpali_service import (
+    SEARCH_LIMIT,
+    SEARCH_MODE_EXHAUSTIVE,
+    SEARCH_MODE_TWO_STAGE,
+    ColpaliService,
+)
+
+# Recall of two stage search against exhaustive MaxSim and latency of both.
+# Query embeddings are computed once up front, so timings cover Qdrant only.
+#
+#   python -m src.bench.two_stage_recall queries.txt --shortlist 50 100 200 400
+
+
+def percentile_ms(timings: List[float], q: float) -> float:
+    return float(np.percentile(timings, q)) * 1000
+
+
+async def run(queries: List[str], shortlists: List[int], limit: int):
+    service = ColpaliService()
+    await service.init()
+    try:
+        exact = {}
+        timings = []
+        for query in queries:
+            await service.search(query, limit=limit)  # warm up query cache
+            started_at = time.perf_counter()
+            exact[query] = await service.search(
+                query, mode=SEARCH_MODE_EXHAUSTIVE, limit=limit
+            )
+            timings.append(time.perf_counter() - started_at)
+
+        print(f"queries={len(queries)} k={limit}")
+        print(f"{'mode':<24}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        print(
+            f"{'exhaustive':<24}{1.0:>10.3f}"
+            f"{percentile_ms(timings, 50):>10.1f}{percentile_ms(timings, 95):>10.1f}"
+        )
+
+        for shortlist in shortlists:
+            recalls = []
+            timings = []
+            for query in queries:
+                started_at = time.perf_counter()
+                found = await service.search(
+                    query, mode=SEARCH_MODE_TWO_STAGE, limit=limit, shortlist=shortlist
+                )
+                timings.append(time.perf_counter() - started_at)
+                expected = set(exact[query])
+                if expected:
+                    recalls.append(len(expected & set(found)) / len(expected))
+            print(
+                f"{f'two_stage/{shortlist}':<24}{np.mean(recalls):>10.3f}"
+                f"{percentile_ms(timings, 50):>10.1f}{percentile_ms(timings, 95):>10.1f}"
+            )
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", help="text file, one query per line")
+    parser.add_argument("--shortlist", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+    asyncio.run(run(queries, args.shortlist, args.limit))
+
+
+if __name__ == "__main__":
+    main()
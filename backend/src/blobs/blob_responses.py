@@ -0,0 +1,105 @@
+from typing import Callable, Dict, Iterator, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+import httpx
+
+from ..utils.http_cache import (
+    ByteRange,
+    RangeNotSatisfiable,
+    etag_matches,
+    requested_range,
+)
+from .blob_store import BlobStore
+
+
+# streams the blob without reading it into memory,
+# local blobs are sent as files so the server can use sendfile
+def blob_response(
+    blob_store: BlobStore,
+    hash: str,
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    request: Optional[Request] = None,
+) -> Response:
+    headers = {"Accept-Ranges": "bytes", **(headers or {})}
+    etag = headers.get("ETag")
+    if request is not None and etag is not None and etag_matches(request, etag):
+        return not_modified_response(headers)
+    if request is not None and request.headers.get("Range"):
+        res = range_response(
+            request,
+            blob_store.size(hash),
+            media_type,
+            headers,
+            lambda byte_range: blob_store.iter_range(
+                hash, byte_range.start, byte_range.length
+            ),
+        )
+        if res is not None:
+            return res
+
+    path = blob_store.path(hash)
+    if path is not None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return StreamingResponse(
+        blob_store.iter_chunks(hash), media_type=media_type, headers=headers
+    )
+
+
+def bytes_response(
+    content: bytes,
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    request: Optional[Request] = None,
+) -> Response:
+    headers = {"Accept-Ranges": "bytes", **(headers or {})}
+    etag = headers.get("ETag")
+    if request is not None and etag is not None and etag_matches(request, etag):
+        return not_modified_response(headers)
+    if request is not None and request.headers.get("Range"):
+        res = range_response(
+            request,
+            len(content),
+            media_type,
+            headers,
+            lambda byte_range: iter([content[byte_range.start : byte_range.end + 1]]),
+        )
+        if res is not None:
+            return res
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+# sent when If-None-Match matches the ETag, which takes precedence over Range
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=httpx.codes.NOT_MODIFIED, headers=headers)
+
+
+# 206 with the requested part, 416 for ranges past the end,
+# None when the whole content should be sent
+def range_response(
+    request: Request,
+    size: int,
+    media_type: str,
+    headers: Dict[str, str],
+    read_range: Callable[[ByteRange], Iterator[bytes]],
+) -> Optional[Response]:
+    try:
+        byte_range = requested_range(request, size, headers.get("ETag"))
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={**headers, "Content-Range": f"bytes */{size}"},
+        )
+    if byte_range is None:
+        return None
+    return StreamingResponse(
+        read_range(byte_range),
+        status_code=httpx.codes.PARTIAL_CONTENT,
+        media_type=media_type,
+        headers={
+            **headers,
+            "Content-Range": f"bytes {byte_range.start}-{byte_range.end}/{size}",
+            "Content-Length": str(byte_range.length),
+        },
+    )
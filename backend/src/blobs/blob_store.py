@@ -0,0 +1,145 @@
+from abc import ABC, abstractmethod
+import hashlib
+import os
+from pathlib import Path
+import threading
+from typing import BinaryIO, Iterator, Optional
+
+BLOB_STORE_LOCAL = "local"
+BLOB_STORE_S3 = "s3"
+BLOB_STORE = os.environ.get("BLOB_STORE", BLOB_STORE_LOCAL)
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "data/blobs")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobNotFoundError(Exception):
+    pass
+
+
+def blob_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# hash based path, two levels of fan-out keep directories small
+def blob_key(hash: str) -> str:
+    return f"{hash[:2]}/{hash[2:4]}/{hash}"
+
+
+# Content-addressed storage of immutable blobs, addressed by their sha256.
+# Putting the same bytes twice stores them once.
+class BlobStore(ABC):
+    @abstractmethod
+    def put(self, data: bytes) -> str: ...
+
+    @abstractmethod
+    def get(self, hash: str) -> bytes: ...
+
+    @abstractmethod
+    def exists(self, hash: str) -> bool: ...
+
+    @abstractmethod
+    def delete(self, hash: str): ...
+
+    # fails right away for missing blobs, before a response is started
+    def iter_chunks(self, hash: str) -> Iterator[bytes]:
+        return iter([self.get(hash)])
+
+    def size(self, hash: str) -> int:
+        return len(self.get(hash))
+
+    # length bytes from start, for Range requests
+    def iter_range(self, hash: str, start: int, length: int) -> Iterator[bytes]:
+        return iter([self.get(hash)[start : start + length]])
+
+    # local file with the blob content, lets responses use sendfile
+    def path(self, hash: str) -> Optional[Path]:
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def put(self, data: bytes) -> str:
+        hash = blob_hash(data)
+        file = self.root / blob_key(hash)
+        if file.is_file():
+            return hash
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # atomic replace, concurrent writers of the same blob write the same bytes
+        tmp_file = file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_file.write_bytes(data)
+        os.replace(tmp_file, file)
+        return hash
+
+    def get(self, hash: str) -> bytes:
+        try:
+            return (self.root / blob_key(hash)).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Blob {hash} not found")
+
+    def exists(self, hash: str) -> bool:
+        return (self.root / blob_key(hash)).is_file()
+
+    def delete(self, hash: str):
+        (self.root / blob_key(hash)).unlink(missing_ok=True)
+
+    def iter_chunks(self, hash: str) -> Iterator[bytes]:
+        try:
+            f = open(self.root / blob_key(hash), "rb")
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Blob {hash} not found")
+        return read_chunks(f)
+
+    def size(self, hash: str) -> int:
+        try:
+            return (self.root / blob_key(hash)).stat().st_size
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Blob {hash} not found")
+
+    def iter_range(self, hash: str, start: int, length: int) -> Iterator[bytes]:
+        try:
+            f = open(self.root / blob_key(hash), "rb")
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Blob {hash} not found")
+        f.seek(start)
+        return read_chunks(f, length)
+
+    def path(self, hash: str) -> Optional[Path]:
+        file = self.root / blob_key(hash)
+        return file if file.is_file() else None
+
+
+def read_chunks(f: BinaryIO, length: Optional[int] = None) -> Iterator[bytes]:
+    with f:
+        while length is None or length > 0:
+            chunk = f.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+
+
+# rows not moved by migrate_blobs yet still hold the blob inline
+def load_blob(
+    blob_store: BlobStore, hash: Optional[str], inline: Optional[bytes]
+) -> bytes:
+    if hash is not None:
+        return blob_store.get(hash)
+    if inline is None:
+        raise BlobNotFoundError("Row references no blob")
+    return inline
+
+
+def create_blob_store() -> BlobStore:
+    if BLOB_STORE == BLOB_STORE_LOCAL:
+        return LocalBlobStore(BLOB_STORE_DIR)
+    if BLOB_STORE == BLOB_STORE_S3:
+        # imported here, s3_blob_store depends on this module
+        from .s3_blob_store import S3BlobStore
+
+        return S3BlobStore.from_env()
+    raise ValueError(f"Unknown {BLOB_STORE=}")
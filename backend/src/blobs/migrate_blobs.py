@@ -0,0 +1,191 @@
+import argparse
+import logging
+import os
+
+from sqlalchemy import exists, func, select, update
+
+from ..classifier.classifier_models import (
+    ChunkEmbedding,
+    Document,
+    DocumentChunk,
+    DocumentContent,
+    DocumentPage,
+)
+from ..database import SessionLocal
+from .blob_store import BlobStore, create_blob_store
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 64
+
+# (model, hash column, inline blob column)
+BLOB_COLUMNS = [
+    (DocumentContent, DocumentContent.content_hash, DocumentContent.content),
+    (DocumentPage, DocumentPage.image_hash, DocumentPage.image),
+    (DocumentChunk, DocumentChunk.image_hash, DocumentChunk.image),
+]
+
+
+# Moves inline BYTEA blobs into the blob store, one committed batch at a time,
+# so it can be interrupted and restarted. Safe to run while the backend is up,
+# rows are readable both before and after the move.
+# Run VACUUM FULL on the tables afterwards to give the space back.
+def migrate_blobs(blob_store: BlobStore, keep_inline: bool):
+    for model, hash_column, blob_column in BLOB_COLUMNS:
+        moved = 0
+        last_id = 0
+        while True:
+            with SessionLocal() as db:
+                rows = (
+                    db.query(model.id, blob_column)
+                    .filter(
+                        model.id > last_id,
+                        hash_column.is_(None),
+                        blob_column.is_not(None),
+                    )
+                    .order_by(model.id.asc())
+                    .limit(BATCH_SIZE)
+                    .all()
+                )
+                if not rows:
+                    break
+                for entity_id, data in rows:
+                    values = {hash_column: blob_store.put(data)}
+                    if not keep_inline:
+                        values[blob_column] = None
+                    db.execute(
+                        update(model).where(model.id == entity_id).values(values)
+                    )
+                db.commit()
+            moved += len(rows)
+            last_id = rows[-1][0]
+            logger.info(f"Moved {moved} blobs of {model.__tablename__}")
+
+
+# The dedup migration runs before the hashes exist, legacy documents and
+# embeddings get them here, by its rule: only the oldest document or chunk
+# embedding with a hash takes it and is shared from now on.
+# Idempotent, rows already holding a hash are left as they are.
+def backfill_dedup():
+    with SessionLocal() as db:
+        first_content = (
+            select(
+                DocumentContent.doc_id,
+                DocumentContent.content_hash,
+                func.row_number()
+                .over(
+                    partition_by=DocumentContent.content_hash,
+                    order_by=DocumentContent.doc_id,
+                )
+                .label("n"),
+            )
+            .where(DocumentContent.content_hash.is_not(None))
+            .subquery()
+        )
+        doc_table = Document.__table__
+        taken_docs = doc_table.alias("taken")
+        documents = db.execute(
+            update(doc_table)
+            .where(
+                doc_table.c.id == first_content.c.doc_id,
+                first_content.c.n == 1,
+                doc_table.c.content_hash.is_(None),
+                ~exists().where(
+                    taken_docs.c.content_hash == first_content.c.content_hash
+                ),
+            )
+            .values(content_hash=first_content.c.content_hash)
+        ).rowcount
+
+        # legacy embeddings belong to one chunk each
+        first_chunk = (
+            select(
+                DocumentChunk.embedding_id,
+                DocumentChunk.image_hash,
+                func.row_number()
+                .over(
+                    partition_by=DocumentChunk.image_hash,
+                    order_by=DocumentChunk.embedding_id,
+                )
+                .label("n"),
+            )
+            .join(ChunkEmbedding, ChunkEmbedding.id == DocumentChunk.embedding_id)
+            .where(
+                DocumentChunk.image_hash.is_not(None),
+                ChunkEmbedding.image_hash.is_(None),
+            )
+            .subquery()
+        )
+        embedding_table = ChunkEmbedding.__table__
+        taken_embeddings = embedding_table.alias("taken")
+        embeddings = db.execute(
+            update(embedding_table)
+            .where(
+                embedding_table.c.id == first_chunk.c.embedding_id,
+                first_chunk.c.n == 1,
+                ~exists().where(
+                    taken_embeddings.c.image_hash == first_chunk.c.image_hash
+                ),
+            )
+            .values(image_hash=first_chunk.c.image_hash)
+        ).rowcount
+        db.commit()
+    logger.info(f"Backfilled hashes of {documents=} {embeddings=}")
+
+
+# Copies blobs back into the BYTEA columns, needed before migrating the schema down
+def restore_blobs(blob_store: BlobStore):
+    for model, hash_column, blob_column in BLOB_COLUMNS:
+        restored = 0
+        while True:
+            with SessionLocal() as db:
+                rows = (
+                    db.query(model.id, hash_column)
+                    .filter(hash_column.is_not(None))
+                    .order_by(model.id.asc())
+                    .limit(BATCH_SIZE)
+                    .all()
+                )
+                if not rows:
+                    break
+                for entity_id, blob_hash in rows:
+                    db.execute(
+                        update(model)
+                        .where(model.id == entity_id)
+                        .values(
+                            {blob_column: blob_store.get(blob_hash), hash_column: None}
+                        )
+                    )
+                db.commit()
+            restored += len(rows)
+            logger.info(f"Restored {restored} blobs of {model.__tablename__}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move document blobs between Postgres and the blob store"
+    )
+    parser.add_argument(
+        "--keep-inline",
+        action="store_true",
+        help="keep the BYTEA copies, e.g. for a trial run",
+    )
+    parser.add_argument(
+        "--restore",
+        action="store_true",
+        help="copy blobs back into Postgres",
+    )
+    args = parser.parse_args()
+
+    blob_store = create_blob_store()
+    if args.restore:
+        restore_blobs(blob_store)
+    else:
+        migrate_blobs(blob_store, keep_inline=args.keep_inline)
+        backfill_dedup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+from typing import Iterator, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .blob_store import (
+    BlobNotFoundError,
+    BlobStore,
+    blob_hash,
+    blob_key,
+    read_chunks,
+)
+
+
+# S3 compatible backend, works with MinIO or any other stand-in via endpoint_url.
+# Credentials come from the usual AWS_* environment variables.
+class S3BlobStore(BlobStore):
+    def __init__(
+        self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None
+    ) -> None:
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url)
+
+    @classmethod
+    def from_env(cls) -> "S3BlobStore":
+        return cls(
+            bucket=os.environ["BLOB_S3_BUCKET"],
+            prefix=os.environ.get("BLOB_S3_PREFIX", ""),
+            endpoint_url=os.environ.get("BLOB_S3_ENDPOINT_URL"),
+        )
+
+    def put(self, data: bytes) -> str:
+        hash = blob_hash(data)
+        if not self.exists(hash):
+            self.s3.put_object(Bucket=self.bucket, Key=self.__key(hash), Body=data)
+        return hash
+
+    def get(self, hash: str) -> bytes:
+        return self.__get_object(hash)["Body"].read()
+
+    def exists(self, hash: str) -> bool:
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.__key(hash))
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def delete(self, hash: str):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.__key(hash))
+
+    def iter_chunks(self, hash: str) -> Iterator[bytes]:
+        return read_chunks(self.__get_object(hash)["Body"])
+
+    def size(self, hash: str) -> int:
+        try:
+            res = self.s3.head_object(Bucket=self.bucket, Key=self.__key(hash))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                raise BlobNotFoundError(f"Blob {hash} not found")
+            raise
+        return res["ContentLength"]
+
+    def iter_range(self, hash: str, start: int, length: int) -> Iterator[bytes]:
+        return read_chunks(
+            self.__get_object(hash, Range=f"bytes={start}-{start + length - 1}")["Body"]
+        )
+
+    def __get_object(self, hash: str, **kwargs):
+        try:
+            return self.s3.get_object(
+                Bucket=self.bucket, Key=self.__key(hash), **kwargs
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                raise BlobNotFoundError(f"Blob {hash} not found")
+            raise
+
+    def __key(self, hash: str) -> str:
+        return f"{self.prefix}{blob_key(hash)}"
@@ -0,0 +1,49 @@
+import argparse
+import logging
+import os
+from typing import List
+
+from ..database import SessionLocal
+from ..utils.archives import iter_path_files
+from .classifier_service import BulkUploadResult, ClassifierService
+from .default_doc_processor import DefaultDocProcessor
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+logger = logging.getLogger(__name__)
+
+
+# Uploads every supported file of the given directories and zip or tar archives.
+# Documents are queued for indexing, the indexer packs their pages into shared
+# ColPali batches. Files identical to uploaded documents are reported as duplicates.
+def bulk_upload(paths: List[str]) -> BulkUploadResult:
+    service = ClassifierService()
+    doc_processor = DefaultDocProcessor()
+    ret = BulkUploadResult()
+    try:
+        with SessionLocal() as db:
+            for path in paths:
+                ret.merge(
+                    service.create_documents(db, iter_path_files(path), doc_processor)
+                )
+    finally:
+        doc_processor.close()
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="directories or zip/tar archives")
+    args = parser.parse_args()
+    result = bulk_upload(args.paths)
+    logger.info(
+        f"Bulk upload done created={len(result.created)} "
+        f"duplicates={len(result.duplicates)} skipped={len(result.skipped)} "
+        f"failed={len(result.failed)}"
+    )
+    for name in result.failed:
+        logger.error(f"Failed to upload {name=}")
+
+
+if __name__ == "__main__":
+    main()
@@ -51,6 +51,21 @@ class RagResponseDto(BaseDtoModel):
     answer: str
 
 
+class RagDeltaDto(BaseDtoModel):
+    delta: str
+
+
+class ErrorDto(BaseDtoModel):
+    detail: str
+
+
+class BulkUploadResponseDto(BaseDtoModel):
+    created: List[int]
+    duplicates: List[int]
+    skipped: List[str]
+    failed: List[str]
+
+
 class DocPreviewDto(BaseDtoModel):
     id: int
     name: str
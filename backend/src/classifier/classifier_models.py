@@ -1,4 +1,5 @@
-from typing import List
+from enum import StrEnum
+from typing import List, Optional
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy import (
     BigInteger,
@@ -19,6 +20,8 @@ class Document(BaseOrmModel):
     mime: Mapped[str] = mapped_column()
     created_at: Mapped[int] = mapped_column(BigInteger)
     indexed: Mapped[bool] = mapped_column()
+    # sha256 of the uploaded bytes, unique, identical uploads are not stored twice
+    content_hash: Mapped[Optional[str]] = mapped_column()
     content: Mapped["DocumentContent"] = relationship(back_populates="document")
     chunks: Mapped[List["DocumentChunk"]] = relationship(back_populates="document")
     pages: Mapped[List["DocumentPage"]] = relationship(back_populates="document")
@@ -28,7 +31,11 @@ class DocumentContent(BaseOrmModel):
     __tablename__ = "document_content"
 
     doc_id: Mapped[int] = mapped_column(ForeignKey("document.id"))
-    content: Mapped[bytes] = mapped_column(BYTEA)
+    # sha256 of the blob in the blob store
+    content_hash: Mapped[Optional[str]] = mapped_column()
+    # legacy inline blob, moved to the blob store by migrate_blobs.
+    # Deferred, only loaded when accessed or queried explicitly
+    content: Mapped[Optional[bytes]] = mapped_column(BYTEA, deferred=True)
     document: Mapped["Document"] = relationship(back_populates="content")
 
 
@@ -37,7 +44,8 @@ class DocumentPage(BaseOrmModel):
 
     doc_id: Mapped[int] = mapped_column(ForeignKey("document.id"))
     number: Mapped[int] = mapped_column()
-    image: Mapped[bytes] = mapped_column(BYTEA)
+    image_hash: Mapped[Optional[str]] = mapped_column()
+    image: Mapped[Optional[bytes]] = mapped_column(BYTEA, deferred=True)
     document: Mapped["Document"] = relationship(back_populates="pages")
 
 
@@ -46,10 +54,71 @@ class DocumentChunk(BaseOrmModel):
 
     doc_id: Mapped[int] = mapped_column(ForeignKey("document.id"))
     page_id: Mapped[int] = mapped_column(ForeignKey("document_page.id"))
-    image: Mapped[bytes] = mapped_column(BYTEA)
+    image_hash: Mapped[Optional[str]] = mapped_column()
+    image: Mapped[Optional[bytes]] = mapped_column(BYTEA, deferred=True)
+    # assigned when the document is indexed
+    embedding_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("chunk_embedding.id")
+    )
     page: Mapped["DocumentPage"] = relationship()
     document: Mapped["Document"] = relationship(back_populates="chunks")
 
 
+# Vector index point of a distinct chunk image, the point id is the row id.
+# Chunks with the same image share it, ref_count counts them.
+class ChunkEmbedding(BaseOrmModel):
+    __tablename__ = "chunk_embedding"
+
+    # unique, NULL for chunks indexed before deduplication
+    image_hash: Mapped[Optional[str]] = mapped_column()
+    ref_count: Mapped[int] = mapped_column()
+    # the vector is in the index
+    stored: Mapped[bool] = mapped_column()
+
+
+# cached ColPali output for a chunk image, see embedding_cache.py
+class ImageEmbedding(BaseOrmModel):
+    __tablename__ = "image_embedding"
+
+    image_hash: Mapped[str] = mapped_column()
+    model_id: Mapped[str] = mapped_column()
+    blob_hash: Mapped[str] = mapped_column()
+    # patch token layout, see PatchGrid, NULL for the configured one
+    patch_rows: Mapped[Optional[int]] = mapped_column()
+    patch_cols: Mapped[Optional[int]] = mapped_column()
+    patch_offset: Mapped[Optional[int]] = mapped_column()
+
+
+# resized / re-encoded variant of a page or chunk image, see renditions.py
+class ImageRendition(BaseOrmModel):
+    __tablename__ = "image_rendition"
+
+    source_hash: Mapped[str] = mapped_column()
+    variant: Mapped[str] = mapped_column()
+    blob_hash: Mapped[str] = mapped_column()
+    mime: Mapped[str] = mapped_column()
+
+
+class IndexJobStatus(StrEnum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class IndexJob(BaseOrmModel):
+    __tablename__ = "index_job"
+
+    doc_id: Mapped[int] = mapped_column(ForeignKey("document.id"))
+    status: Mapped[str] = mapped_column()
+    attempts: Mapped[int] = mapped_column()
+    run_after: Mapped[int] = mapped_column(BigInteger)
+    lease_owner: Mapped[Optional[str]] = mapped_column()
+    lease_expires_at: Mapped[Optional[int]] = mapped_column(BigInteger)
+    last_error: Mapped[Optional[str]] = mapped_column()
+    created_at: Mapped[int] = mapped_column(BigInteger)
+    updated_at: Mapped[int] = mapped_column(BigInteger)
+
+
 def create_all_tables():
     BaseOrmModel.metadata.create_all(bind=database.engine)
@@ -1,8 +1,9 @@
+from contextlib import contextmanager
 import logging
 from typing import Annotated, List
+from fastapi.responses import StreamingResponse
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
     HTTPException,
     Path,
@@ -12,20 +13,33 @@ from fastapi import (
 )
 import httpx
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from ..utils.data_table import (
     apply_filtering_result_to_response,
     create_filter_from_request,
 )
+from ..utils.archives import ArchiveFormatError, iter_archive_files
+from ..blobs.blob_responses import blob_response, bytes_response
+from ..blobs.blob_store import BlobNotFoundError
+from ..utils.http_cache import IMMUTABLE_CACHE_CONTROL, etag_matches
 from ..database import get_db
 from .classifier_service import (
+    ClassifierService,
+    EntityNotFoundError,
+    RenderImageInfo,
     get_classifier_service,
     get_doc_indexer_service,
     get_doc_processor_service,
     get_rag_service,
 )
+from .renditions import Rendition
 from .classifier_dto import (
+    BaseDtoModel,
+    BulkUploadResponseDto,
     DocPreviewDto,
     DocumentDto,
+    ErrorDto,
+    RagDeltaDto,
     RagRequestDto,
     RagResponseDto,
     SearchDocumentDto,
@@ -36,9 +50,20 @@ from urllib.parse import quote
 
 logger = logging.getLogger(__name__)
 
+INTERPRET_CACHE_CONTROL = "private, max-age=86400"
+
 router = APIRouter(prefix="/documents")
 
 
+# documents, pages and chunks deleted meanwhile, or their blobs
+@contextmanager
+def not_found_as_404():
+    try:
+        yield
+    except (EntityNotFoundError, BlobNotFoundError) as e:
+        raise HTTPException(httpx.codes.NOT_FOUND, detail=str(e))
+
+
 @router.post("/search", response_model=SearchResponseDto)
 async def search(
     request: Request, body: SearchRequestDto, db: Session = Depends(get_db)
@@ -46,7 +71,7 @@ async def search(
     service = get_classifier_service(request.state)
     doc_indexer = get_doc_indexer_service(request.state)
 
-    results = service.find_documents_by_query(db, body.query, doc_indexer)
+    results = await service.find_documents_by_query(db, body.query, doc_indexer)
 
     return SearchResponseDto(
         documents=[SearchDocumentDto(**res.model_dump()) for res in results],
@@ -59,14 +84,54 @@ async def rag_request(
 ):
     service = get_classifier_service(request.state)
     rag = get_rag_service(request.state)
+    doc_indexer = get_doc_indexer_service(request.state)
 
-    answer = service.rag_query(db, body.query, body.chunks, rag)
+    answer = await service.rag_query(db, body.query, body.chunks, rag, doc_indexer)
 
     return RagResponseDto(answer=answer, request_id=body.request_id)
 
 
+# server-sent events: "delta" events with parts of the answer as the LLM writes
+# them, then "done" with the whole answer, or "error" when the LLM fails midway
+@router.post("/rag/stream")
+async def rag_stream(
+    request: Request, body: RagRequestDto, db: Session = Depends(get_db)
+):
+    service = get_classifier_service(request.state)
+    rag = get_rag_service(request.state)
+    doc_indexer = get_doc_indexer_service(request.state)
+
+    deltas = await service.rag_query_stream(
+        db, body.query, body.chunks, rag, doc_indexer
+    )
+
+    async def events():
+        answer = []
+        try:
+            async for delta in deltas:
+                answer.append(delta)
+                yield sse_event("delta", RagDeltaDto(delta=delta))
+        except Exception:
+            logger.exception(f"RAG stream of {body.request_id=} failed")
+            yield sse_event("error", ErrorDto(detail="LLM request failed"))
+            return
+        yield sse_event(
+            "done", RagResponseDto(answer="".join(answer), request_id=body.request_id)
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def sse_event(event: str, data: BaseDtoModel) -> str:
+    return f"event: {event}\ndata: {data.model_dump_json(by_alias=True)}\n\n"
+
+
 @router.get("", response_model=List[DocumentDto])
-async def get_all(request: Request, response: Response, db: Session = Depends(get_db)):
+def get_all(request: Request, response: Response, db: Session = Depends(get_db)):
     filtering_query = create_filter_from_request(request)
     service = get_classifier_service(request.state)
     return apply_filtering_result_to_response(
@@ -82,7 +147,7 @@ async def delete(
 ):
     service = get_classifier_service(request.state)
     doc_indexer = get_doc_indexer_service(request.state)
-    service.delete_document(db, entity_id, doc_indexer)
+    await service.delete_document(db, entity_id, doc_indexer)
 
 
 @router.get("/chunk/{entityId}/interpret")
@@ -94,74 +159,91 @@ async def chunk_interpret(
 ):
     service = get_classifier_service(request.state)
     doc_indexer = get_doc_indexer_service(request.state)
-    info = service.get_chunk_interpret_info(
-        db, entity_id, query=q, doc_indexer=doc_indexer
-    )
-    return Response(content=info.image, media_type=info.mime)
+    with not_found_as_404():
+        etag = await run_in_threadpool(
+            service.get_chunk_interpret_etag,
+            db,
+            entity_id,
+            query=q,
+            doc_indexer=doc_indexer,
+        )
+        headers = {"ETag": etag, "Cache-Control": INTERPRET_CACHE_CONTROL}
+        if etag_matches(request, etag):
+            return Response(status_code=httpx.codes.NOT_MODIFIED, headers=headers)
+
+        info = await service.get_chunk_interpret_info(
+            db, entity_id, query=q, doc_indexer=doc_indexer
+        )
+    return Response(content=info.image, media_type=info.mime, headers=headers)
 
 
 @router.get("/chunk/{entityId}/image")
-async def chunk_image(
+def chunk_image(
     request: Request,
     entity_id: Annotated[int, Path(alias="entityId")],
+    rendition: Rendition = Rendition.FULL,
     db: Session = Depends(get_db),
 ):
     service = get_classifier_service(request.state)
-    info = service.get_chunk_render_info(db, entity_id)
-
-    return Response(content=info.image, media_type=info.mime)
+    with not_found_as_404():
+        info = service.get_chunk_render_info(db, entity_id, rendition)
+        return render_image_response(request, service, info)
 
 
 @router.get("/page/{entityId}/image")
-async def page_image(
+def page_image(
     request: Request,
     entity_id: Annotated[int, Path(alias="entityId")],
+    rendition: Rendition = Rendition.FULL,
     db: Session = Depends(get_db),
 ):
     service = get_classifier_service(request.state)
-    info = service.get_page_render_info(db, entity_id)
-
-    return Response(content=info.image, media_type=info.mime)
+    with not_found_as_404():
+        info = service.get_page_render_info(db, entity_id, rendition)
+        return render_image_response(request, service, info)
 
 
 @router.get("/{entityId}/preview", response_model=DocPreviewDto)
-async def preview_document(
+def preview_document(
     request: Request,
     entity_id: Annotated[int, Path(alias="entityId")],
     db: Session = Depends(get_db),
 ):
     service = get_classifier_service(request.state)
-    return service.get_doc_preview_info(db, entity_id)
+    with not_found_as_404():
+        return service.get_doc_preview_info(db, entity_id)
 
 
 @router.get("/{entityId}/download")
-async def download_document(
+def download_document(
     request: Request,
     entity_id: Annotated[int, Path(alias="entityId")],
     db: Session = Depends(get_db),
 ):
     service = get_classifier_service(request.state)
-    info = service.get_doc_download_info(db, entity_id)
-
-    return Response(
-        content=info.content,
-        media_type=info.mime,
-        headers={
-            "Content-Disposition": f'''attachment; filename*=UTF-8''"{quote(info.name)}"'''
-        },
-    )
+    with not_found_as_404():
+        info = service.get_doc_download_info(db, entity_id)
+    headers = {
+        "Content-Disposition": f'''attachment; filename*=UTF-8''"{quote(info.name)}"''',
+        "ETag": info.etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+    }
+    if info.blob_hash:
+        with not_found_as_404():
+            return blob_response(
+                service.blob_store, info.blob_hash, info.mime, headers, request
+            )
+    return bytes_response(info.content, info.mime, headers, request)
 
 
 @router.post("/upload", response_model=bool)
 async def upload(
     request: Request,
     file: UploadFile,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     service = get_classifier_service(request.state)
     doc_processor = get_doc_processor_service(request.state)
-    doc_indexer = get_doc_indexer_service(request.state)
 
     if not file.content_type:
         raise HTTPException(httpx.codes.BAD_REQUEST, detail="Unknown content type")
@@ -170,18 +252,52 @@ async def upload(
 
     if not service.is_mime_supported(file.content_type):
         raise HTTPException(httpx.codes.BAD_REQUEST, detail="Invalid file format")
-    service.create_document(
+    # rasterization is CPU bound, keep it off the event loop
+    await run_in_threadpool(
+        service.create_document,
         db,
         name=file.filename,
         mime=file.content_type,
         content=await file.read(),
         doc_processor=doc_processor,
     )
-    background_tasks.add_task(service.index_documents, db, doc_indexer=doc_indexer)
-
     return True
 
 
+# zip or tar archive of documents, processed one file at a time
+@router.post("/bulk", response_model=BulkUploadResponseDto)
+async def bulk_upload(
+    request: Request,
+    file: UploadFile,
+    db: Session = Depends(get_db),
+):
+    service = get_classifier_service(request.state)
+    doc_processor = get_doc_processor_service(request.state)
+
+    def create_documents():
+        return service.create_documents(
+            db, iter_archive_files(file.file), doc_processor
+        )
+
+    try:
+        result = await run_in_threadpool(create_documents)
+    except ArchiveFormatError as e:
+        raise HTTPException(httpx.codes.BAD_REQUEST, detail=str(e))
+    return BulkUploadResponseDto(**result.model_dump())
+
+
+# page and chunk images never change, the blob is not touched on a 304
+def render_image_response(
+    request: Request, service: ClassifierService, info: RenderImageInfo
+):
+    headers = {"ETag": info.etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if info.blob_hash:
+        return blob_response(
+            service.blob_store, info.blob_hash, info.mime, headers, request
+        )
+    return bytes_response(info.image, info.mime, headers, request)
+
+
 # @router.get("/wip")
 # async def wip(request: Request, db: Session = Depends(get_db)):
 #     service = get_classifier_service(request.state)
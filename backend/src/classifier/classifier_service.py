@@ -1,29 +1,78 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 import logging
-from typing import Any, List, Optional, Tuple
-
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import numpy as np
 import pydantic
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
 
+from ..blobs.blob_store import blob_hash as compute_blob_hash
+from ..blobs.blob_store import create_blob_store, load_blob
+from ..utils.archives import ArchiveFile
+from ..utils.cache import DiskCache, LruCache
 from ..utils.dates import timestamp_ms
+from ..utils.http_cache import content_etag, make_etag
 from .mime_types import MimeType
 
-from ..utils.strings import to_snake_case
+from ..utils.strings import normalize_query, to_snake_case
 
 from ..utils.data_table import FilteringQuery, FilteringResult, apply_filter_to_db_query
 
+from .index_queue import IndexQueue
+from .rag_context import RagContextBuilder
+from .renditions import Rendition, RenditionService
 from .classifier_models import Document, DocumentChunk, DocumentContent, DocumentPage
 from sqlalchemy.orm import Query, Session
+import os
 
 logger = logging.getLogger(__name__)
 
+BLOB_HASH_COLUMNS = [
+    (DocumentContent, DocumentContent.content_hash),
+    (DocumentPage, DocumentPage.image_hash),
+    (DocumentChunk, DocumentChunk.image_hash),
+]
+
 CLASSIFIER_SERVICE_NAME = "classifier_service"
 DOC_INDEXER_SERVICE_NAME = "doc_indexer_service"
 RAG_SERVICE_NAME = "rag_service"
 DOC_PROCESSOR_SERVICE_NAME = "doc_processor_service"
 MAX_IMAGES = 2
 
+INTERPRET_CACHE_MAX_BYTES = int(
+    os.environ.get("INTERPRET_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+INTERPRET_CACHE_DIR = os.environ.get("INTERPRET_CACHE_DIR")
+INTERPRET_CACHE_DISK_MAX_BYTES = int(
+    os.environ.get("INTERPRET_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+RAG_CACHE_SIZE = int(os.environ.get("RAG_CACHE_SIZE", "1024"))
+RAG_CACHE_TTL = float(os.environ.get("RAG_CACHE_TTL", "86400")) or None
+SEARCH_RESULT_CACHE_SIZE = int(os.environ.get("SEARCH_RESULT_CACHE_SIZE", "10000"))
+# other processes delete documents and the worker attaches chunks of new ones
+# to shared embeddings, entries only see that once they expire
+SEARCH_RESULT_CACHE_TTL = float(os.environ.get("SEARCH_RESULT_CACHE_TTL", "60")) or None
+
+
+RagCacheKey = Tuple[str, Tuple[int, ...], str, str, str]
+
+
+class EntityNotFoundError(RuntimeError):
+    pass
+
 
 class DocInfo(pydantic.BaseModel):
     id: int
@@ -44,15 +93,35 @@ class SearchResult(pydantic.BaseModel):
     chunk_id: int
 
 
+# either inline bytes or a reference into the blob store
 class RenderImageInfo(pydantic.BaseModel):
     mime: str
-    image: bytes
+    image: Optional[bytes] = None
+    blob_hash: Optional[str] = None
+    etag: Optional[str] = None
+
+
+# document ids, and names of the files that were not uploaded
+class BulkUploadResult(pydantic.BaseModel):
+    created: List[int] = []
+    duplicates: List[int] = []
+    # unsupported or too large
+    skipped: List[str] = []
+    failed: List[str] = []
+
+    def merge(self, other: "BulkUploadResult"):
+        self.created += other.created
+        self.duplicates += other.duplicates
+        self.skipped += other.skipped
+        self.failed += other.failed
 
 
 class DocDownloadInfo(pydantic.BaseModel):
     mime: str
     name: str
-    content: bytes
+    content: Optional[bytes] = None
+    blob_hash: Optional[str] = None
+    etag: Optional[str] = None
 
 
 class DocPreviewInfo(pydantic.BaseModel):
@@ -62,127 +131,423 @@ class DocPreviewInfo(pydantic.BaseModel):
 
 
 class DocProcessor(ABC):
+    # pages are consumed one at a time, implementations may produce them lazily
     @abstractmethod
-    def extract_pages(
-        self, doc: Document, doc_content: DocumentContent
-    ) -> List[bytes]: ...
+    def extract_pages(self, doc: Document, content: bytes) -> Iterable[bytes]: ...
 
     @abstractmethod
     def chunk_pages(
-        self, pages: List[DocumentPage]
-    ) -> List[Tuple[DocumentPage, bytes]]: ...
+        self, pages: Iterable[Tuple[DocumentPage, bytes]]
+    ) -> Iterable[Tuple[DocumentPage, bytes]]: ...
 
 
 class DocIndexer(ABC):
+    # identifies the embedding model, used to key derived caches
+    @property
+    @abstractmethod
+    def model_id(self) -> str: ...
+
+    @abstractmethod
+    async def index(self, doc: Document): ...
+
+    # ids of the best matching chunk embeddings, see ChunkEmbedding
+    @abstractmethod
+    async def query(self, query: str) -> List[int]: ...
+
+    # heatmap of the query over the image, image_hash finds stored embeddings
+    @abstractmethod
+    async def interpret(
+        self, query: str, image: bytes, image_hash: Optional[str] = None
+    ) -> bytes: ...
+
+    # detaches the chunks of the document within the caller's transaction,
+    # the (embedding id, image hash) returned go to delete_released once
+    # it committed
     @abstractmethod
-    def index(self, doc: Document): ...
+    def release(
+        self, db: Session, doc: Document
+    ) -> List[Tuple[int, Optional[str]]]: ...
 
     @abstractmethod
-    def query(self, query: str) -> List[int]: ...
+    async def delete_released(self, released: List[Tuple[int, Optional[str]]]): ...
 
+    # query relevance maps of the images, see similarity_map,
+    # None for images without stored patch embeddings
     @abstractmethod
-    def interpret(self, query: str, image: bytes) -> bytes: ...
+    async def similarity_maps(
+        self, query: str, image_hashes: List[Optional[str]]
+    ) -> List[Optional[np.ndarray]]: ...
 
+    # counters for the /stats endpoint
     @abstractmethod
-    def delete(self, doc: Document): ...
+    def stats(self) -> Dict[str, Any]: ...
 
 
 class RagService(ABC):
+    @property
     @abstractmethod
-    def question(self, prompt: str, images: List[bytes]) -> str: ...
+    def model_id(self) -> str: ...
 
+    # changes whenever the prompt does, cached answers are keyed by it
+    @property
+    @abstractmethod
+    def prompt_version(self) -> str: ...
 
-scanning_doc_ids = set()
+    @abstractmethod
+    async def question(self, prompt: str, images: List[bytes]) -> str: ...
+
+    # answer deltas as the LLM generates them
+    @abstractmethod
+    def question_stream(
+        self, prompt: str, images: List[bytes]
+    ) -> AsyncIterator[str]: ...
+
+    @abstractmethod
+    async def close(self): ...
 
 
 class ClassifierService:
+    def __init__(self) -> None:
+        self.index_queue = IndexQueue()
+        self.blob_store = create_blob_store()
+        self.renditions = RenditionService(self.blob_store)
+        # (chunk_id, query, model_id) -> jpeg
+        self.interpret_cache = LruCache[Tuple[int, str, str], bytes](
+            max_bytes=INTERPRET_CACHE_MAX_BYTES, sizeof=len
+        )
+        self.interpret_disk_cache = (
+            DiskCache(INTERPRET_CACHE_DIR, max_bytes=INTERPRET_CACHE_DISK_MAX_BYTES)
+            if INTERPRET_CACHE_DIR
+            else None
+        )
+        self.rag_context = RagContextBuilder()
+        # (query, chunk_ids, model_id, prompt_version, context version) -> answer
+        self.rag_cache = LruCache[RagCacheKey, str](
+            max_items=RAG_CACHE_SIZE, ttl=RAG_CACHE_TTL
+        )
+        # embedding_id -> search results of the chunks sharing it
+        self.search_result_cache = LruCache[int, List[SearchResult]](
+            max_items=SEARCH_RESULT_CACHE_SIZE, ttl=SEARCH_RESULT_CACHE_TTL
+        )
 
-    def find_documents_by_query(
+    async def find_documents_by_query(
         self, db: Session, query: str, doc_indexer: DocIndexer
     ) -> List[SearchResult]:
 
-        found_chunk_ids = doc_indexer.query(query)
-        if not found_chunk_ids:
+        embedding_ids = await doc_indexer.query(query)
+        if not embedding_ids:
             return []
 
-        docs = (
-            db.query(Document, DocumentChunk.id)
-            .select_from(DocumentChunk)
-            .join(Document)
-            .filter(DocumentChunk.id.in_(found_chunk_ids))
-            .all()
-        )
-        chunk_doc_map = {chunk_id: doc for doc, chunk_id in docs}
+        return await run_in_threadpool(self.__load_search_results, db, embedding_ids)
 
-        chunk_pages = (
-            db.query(DocumentChunk.id, DocumentChunk.page_id)
-            .filter(DocumentChunk.id.in_(found_chunk_ids))
-            .all()
-        )
-        chunk_page_map = {chunk_id: page_id for (chunk_id, page_id) in chunk_pages}
+    # Chunks sharing an image share its embedding, all of them are results.
+    # Cached per embedding, the missing ones are loaded in one round trip
+    def __load_search_results(
+        self, db: Session, embedding_ids: List[int]
+    ) -> List[SearchResult]:
+        results_by_embedding: Dict[int, List[SearchResult]] = {}
+        missing_embedding_ids = []
+        for embedding_id in embedding_ids:
+            results = self.search_result_cache.get(embedding_id)
+            if results is not None:
+                results_by_embedding[embedding_id] = results
+            else:
+                missing_embedding_ids.append(embedding_id)
+
+        if missing_embedding_ids:
+            loaded = self.__hydrate_search_results(db, missing_embedding_ids)
+            for embedding_id, results in loaded.items():
+                self.search_result_cache.put(embedding_id, results)
+            results_by_embedding.update(loaded)
 
         ret = []
-        for chunk_id in found_chunk_ids:
-            if not chunk_id in chunk_doc_map:
-                logger.error(f"Invalid chunk id in from indeser {chunk_id=}")
+        for embedding_id in embedding_ids:
+            if not embedding_id in results_by_embedding:
+                logger.error(f"Invalid embedding id from indexer {embedding_id=}")
                 continue
-            doc = chunk_doc_map[chunk_id]
-            ret.append(
+            ret.extend(results_by_embedding[embedding_id])
+        return ret
+
+    # only the metadata columns, no blobs
+    def __hydrate_search_results(
+        self, db: Session, embedding_ids: List[int]
+    ) -> Dict[int, List[SearchResult]]:
+        rows = (
+            db.query(
+                DocumentChunk.embedding_id,
+                DocumentChunk.id,
+                DocumentChunk.page_id,
+                Document.id,
+                Document.name,
+                Document.mime,
+                Document.created_at,
+            )
+            .select_from(DocumentChunk)
+            .join(Document, DocumentChunk.doc_id == Document.id)
+            .filter(DocumentChunk.embedding_id.in_(embedding_ids))
+            .order_by(DocumentChunk.id.asc())
+            .all()
+        )
+        results_by_embedding: Dict[int, List[SearchResult]] = {}
+        for embedding_id, chunk_id, page_id, doc_id, name, mime, created_at in rows:
+            results_by_embedding.setdefault(embedding_id, []).append(
                 SearchResult(
-                    doc_id=doc.id,
+                    doc_id=doc_id,
                     chunk_id=chunk_id,
-                    created_at=doc.created_at,
-                    mime=doc.mime,
-                    name=doc.name,
-                    page_id=chunk_page_map[chunk_id],
+                    created_at=created_at,
+                    mime=mime,
+                    name=name,
+                    page_id=page_id,
                 )
             )
+        return results_by_embedding
 
-        return ret
-
-    def rag_query(
+    async def rag_query(
         self,
         db: Session,
         query: str,
         chunk_ids: List[int],
         rag: RagService,
+        doc_indexer: DocIndexer,
     ) -> str:
+        cache_key = self.__rag_cache_key(query, chunk_ids, rag)
+        answer = await self.__get_cached_answer(db, cache_key)
+        if answer is None:
+            images = await self.build_rag_context(db, query, chunk_ids, doc_indexer)
+            answer = await rag.question(query, images=images)
+            self.rag_cache.put(cache_key, answer)
+        return answer
+
+    # answer deltas, a cached answer comes as a single one. Images are loaded
+    # before returning, so a bad request fails before the stream starts
+    async def rag_query_stream(
+        self,
+        db: Session,
+        query: str,
+        chunk_ids: List[int],
+        rag: RagService,
+        doc_indexer: DocIndexer,
+    ) -> AsyncIterator[str]:
+        cache_key = self.__rag_cache_key(query, chunk_ids, rag)
+        answer = await self.__get_cached_answer(db, cache_key)
+        if answer is not None:
+            return self.__stream_answer(answer)
+        images = await self.build_rag_context(db, query, chunk_ids, doc_indexer)
+        return self.__stream_and_cache(
+            cache_key, rag.question_stream(query, images=images)
+        )
+
+    # The caches live in every uvicorn worker, a delete only invalidates those
+    # of the worker serving it. Answers are checked against the DB instead.
+    async def __get_cached_answer(
+        self, db: Session, cache_key: RagCacheKey
+    ) -> Optional[str]:
+        answer = self.rag_cache.get(cache_key)
+        if answer is None:
+            return None
+        chunk_ids = cache_key[1]
+        existing = await run_in_threadpool(self.existing_chunk_ids, db, chunk_ids)
+        if len(existing) < len(set(chunk_ids)):
+            self.__invalidate_chunk_caches(set(chunk_ids) - existing)
+            return None
+        return answer
+
+    async def __stream_answer(self, answer: str) -> AsyncIterator[str]:
+        yield answer
+
+    # only complete answers are cached
+    async def __stream_and_cache(
+        self, cache_key: RagCacheKey, deltas: AsyncIterator[str]
+    ) -> AsyncIterator[str]:
+        answer = []
+        async for delta in deltas:
+            answer.append(delta)
+            yield delta
+        self.rag_cache.put(cache_key, "".join(answer))
+
+    def __rag_cache_key(
+        self, query: str, chunk_ids: List[int], rag: RagService
+    ) -> RagCacheKey:
+        return (
+            normalize_query(query),
+            tuple(chunk_ids[0:MAX_IMAGES]),
+            rag.model_id,
+            rag.prompt_version,
+            self.rag_context.version,
+        )
+
+    # chunk images cropped to the parts relevant to the query and sized
+    # to the token budget
+    async def build_rag_context(
+        self, db: Session, query: str, chunk_ids: List[int], doc_indexer: DocIndexer
+    ) -> List[bytes]:
+        # crops are cut from the original, a crop of the downscaled page
+        # would lose the detail it is meant to keep
+        rendition = Rendition.FULL if self.rag_context.crop else Rendition.MODEL_INPUT
+        chunks = await run_in_threadpool(self.get_rag_images, db, chunk_ids, rendition)
+        sim_maps: List[Optional[np.ndarray]] = [None] * len(chunks)
+        if self.rag_context.crop:
+            sim_maps = await doc_indexer.similarity_maps(
+                query, [image_hash for image_hash, _ in chunks]
+            )
+        return await run_in_threadpool(
+            self.rag_context.build, [image for _, image in chunks], sim_maps
+        )
 
+    # (chunk image hash, rendition of the image) in the order of chunk_ids
+    def get_rag_images(
+        self,
+        db: Session,
+        chunk_ids: List[int],
+        rendition: Rendition = Rendition.MODEL_INPUT,
+    ) -> List[Tuple[Optional[str], bytes]]:
         if not chunk_ids:
             raise ValueError("No chunks")
 
         chunk_ids = chunk_ids[0:MAX_IMAGES]
 
-        chunks = db.query(DocumentChunk).filter(DocumentChunk.id.in_(chunk_ids)).all()
-        chunk_map = {chunk.id: chunk.image for chunk in chunks}
+        chunks = db.query(
+            DocumentChunk.id, DocumentChunk.image_hash, DocumentChunk.image
+        ).filter(DocumentChunk.id.in_(chunk_ids))
+        # downscaled unless cropped, the LLM gains nothing from the full
+        # resolution page
+        chunk_map = {}
+        for chunk_id, image_hash, image in chunks:
+            if rendition == Rendition.FULL:
+                chunk_map[chunk_id] = (
+                    image_hash,
+                    load_blob(self.blob_store, image_hash, image),
+                )
+                continue
+            blob_hash, _ = self.__get_rendition(db, image_hash, image, rendition)
+            chunk_map[chunk_id] = (image_hash, self.blob_store.get(blob_hash))
 
         images = []
         # keep exact order as in original list of ids
         for chunk_id in chunk_ids:
             if chunk_id in chunk_map:
                 images.append(chunk_map[chunk_id])
+        return images
 
-        return rag.question(query, images=images)
+    def get_chunk_render_info(
+        self, db: Session, chunk_id: int, rendition: Rendition = Rendition.FULL
+    ) -> RenderImageInfo:
+        image_hash, image = self.__get_chunk_image_ref(db, chunk_id)
+        return self.__render_info(db, image_hash, image, rendition)
+
+    # checked before answering a conditional request, a deleted chunk
+    # must not be reported as not modified
+    def get_chunk_interpret_etag(
+        self, db: Session, chunk_id: int, query: str, doc_indexer: DocIndexer
+    ) -> str:
+        if not self.existing_chunk_ids(db, [chunk_id]):
+            raise EntityNotFoundError(f"Chunk #{chunk_id} not found")
+        return self.__interpret_etag(chunk_id, query, doc_indexer)
 
-    def get_chunk_render_info(self, db: Session, chunk_id: int) -> RenderImageInfo:
-        chunk = self.get_chunk(db, chunk_id)
-        return RenderImageInfo(image=chunk.image, mime="image/jpeg")
+    def __interpret_etag(
+        self, chunk_id: int, query: str, doc_indexer: DocIndexer
+    ) -> str:
+        # chunk images are immutable, so the heatmap depends on the key only
+        return make_etag(
+            "interpret", doc_indexer.model_id, chunk_id, normalize_query(query)
+        )
 
-    def get_chunk_interpret_info(
+    # the caller checks the chunk exists first with get_chunk_interpret_etag,
+    # that also covers cache hits of chunks deleted by another worker
+    async def get_chunk_interpret_info(
         self, db: Session, chunk_id: int, query: str, doc_indexer: DocIndexer
     ) -> RenderImageInfo:
-        chunk = self.get_chunk(db, chunk_id)
-        interpret_img = doc_indexer.interpret(query=query, image=chunk.image)
-        return RenderImageInfo(image=interpret_img, mime="image/jpeg")
+        query = normalize_query(query)
+        etag = self.__interpret_etag(chunk_id, query, doc_indexer)
+        cache_key = (chunk_id, query, doc_indexer.model_id)
+        disk_group = f"chunk-{chunk_id}"
+        disk_key = f"{doc_indexer.model_id}:{query}"
+
+        interpret_img = self.interpret_cache.get(cache_key)
+        if interpret_img is None and self.interpret_disk_cache:
+            interpret_img = await run_in_threadpool(
+                self.interpret_disk_cache.get, disk_key, disk_group
+            )
+            if interpret_img is not None:
+                self.interpret_cache.put(cache_key, interpret_img)
+
+        if interpret_img is None:
+            image_hash, chunk_image = await run_in_threadpool(
+                self.get_chunk_image, db, chunk_id
+            )
+            interpret_img = await doc_indexer.interpret(
+                query=query, image=chunk_image, image_hash=image_hash
+            )
+            self.interpret_cache.put(cache_key, interpret_img)
+            if self.interpret_disk_cache:
+                await run_in_threadpool(
+                    self.interpret_disk_cache.put, disk_key, interpret_img, disk_group
+                )
+
+        return RenderImageInfo(image=interpret_img, mime="image/jpeg", etag=etag)
+
+    def get_page_render_info(
+        self, db: Session, page_id: int, rendition: Rendition = Rendition.FULL
+    ) -> RenderImageInfo:
+        image_hash, image = self.__get_page_image_ref(db, page_id)
+        return self.__render_info(db, image_hash, image, rendition)
 
-    def get_page_render_info(self, db: Session, page_id: int) -> RenderImageInfo:
-        chunk = self.get_page(db, page_id)
-        return RenderImageInfo(image=chunk.image, mime="image/jpeg")
+    def __render_info(
+        self,
+        db: Session,
+        image_hash: Optional[str],
+        image: Optional[bytes],
+        rendition: Rendition,
+    ) -> RenderImageInfo:
+        if rendition == Rendition.FULL:
+            return RenderImageInfo(
+                image=image,
+                blob_hash=image_hash,
+                mime="image/jpeg",
+                etag=blob_etag(image_hash, image),
+            )
+        blob_hash, mime = self.__get_rendition(db, image_hash, image, rendition)
+        return RenderImageInfo(
+            blob_hash=blob_hash, mime=mime, etag=content_etag(blob_hash)
+        )
+
+    def __get_rendition(
+        self,
+        db: Session,
+        image_hash: Optional[str],
+        image: Optional[bytes],
+        rendition: Rendition,
+    ) -> Tuple[str, str]:
+        return self.renditions.get(
+            db,
+            image_hash or compute_blob_hash(image or b""),
+            lambda: load_blob(self.blob_store, image_hash, image),
+            rendition,
+        )
 
     def get_doc_download_info(self, db: Session, doc_id: int) -> DocDownloadInfo:
-        doc = self.get_document(db, doc_id)
-        content = doc.content
-        return DocDownloadInfo(content=content.content, mime=doc.mime, name=doc.name)
+        ret = (
+            db.query(
+                Document.name,
+                Document.mime,
+                DocumentContent.content_hash,
+                DocumentContent.content,
+            )
+            .select_from(Document)
+            .join(DocumentContent, DocumentContent.doc_id == Document.id)
+            .filter(Document.id == doc_id)
+            .first()
+        )
+        if not ret:
+            raise EntityNotFoundError(f"Document #{doc_id} not found")
+        name, mime, content_hash, content = ret
+        return DocDownloadInfo(
+            content=content,
+            blob_hash=content_hash,
+            mime=mime,
+            name=name,
+            etag=blob_etag(content_hash, content),
+        )
 
     def get_doc_preview_info(self, db: Session, doc_id: int) -> DocPreviewInfo:
         doc = self.get_document(db, doc_id)
@@ -198,15 +563,58 @@ class ClassifierService:
     def get_page(self, db: Session, entity_id: int) -> DocumentPage:
         ret = db.query(DocumentPage).filter(DocumentPage.id == entity_id).first()
         if not ret:
-            raise RuntimeError(f"Page #{entity_id} not found")
+            raise EntityNotFoundError(f"Page #{entity_id} not found")
         return ret
 
     def get_chunk(self, db: Session, entity_id: int) -> DocumentChunk:
         ret = db.query(DocumentChunk).filter(DocumentChunk.id == entity_id).first()
         if not ret:
-            raise RuntimeError(f"Chunk #{entity_id} not found")
+            raise EntityNotFoundError(f"Chunk #{entity_id} not found")
         return ret
 
+    def get_page_image(self, db: Session, entity_id: int) -> bytes:
+        return load_blob(self.blob_store, *self.__get_page_image_ref(db, entity_id))
+
+    def existing_chunk_ids(self, db: Session, chunk_ids: Iterable[int]) -> Set[int]:
+        return {
+            chunk_id
+            for (chunk_id,) in db.query(DocumentChunk.id).filter(
+                DocumentChunk.id.in_(chunk_ids)
+            )
+        }
+
+    # (blob hash, image)
+    def get_chunk_image(
+        self, db: Session, entity_id: int
+    ) -> Tuple[Optional[str], bytes]:
+        image_hash, image = self.__get_chunk_image_ref(db, entity_id)
+        return image_hash, load_blob(self.blob_store, image_hash, image)
+
+    # (blob hash, inline image), the image is only set for rows not migrated yet
+    def __get_page_image_ref(
+        self, db: Session, entity_id: int
+    ) -> Tuple[Optional[str], Optional[bytes]]:
+        ret = (
+            db.query(DocumentPage.image_hash, DocumentPage.image)
+            .filter(DocumentPage.id == entity_id)
+            .first()
+        )
+        if not ret:
+            raise EntityNotFoundError(f"Page #{entity_id} not found")
+        return ret[0], ret[1]
+
+    def __get_chunk_image_ref(
+        self, db: Session, entity_id: int
+    ) -> Tuple[Optional[str], Optional[bytes]]:
+        ret = (
+            db.query(DocumentChunk.image_hash, DocumentChunk.image)
+            .filter(DocumentChunk.id == entity_id)
+            .first()
+        )
+        if not ret:
+            raise EntityNotFoundError(f"Chunk #{entity_id} not found")
+        return ret[0], ret[1]
+
     def get_documents(
         self, db: Session, filtering_query: FilteringQuery
     ) -> FilteringResult[DocInfo]:
@@ -255,68 +663,218 @@ class ClassifierService:
         mime: str,
         content: bytes,
         doc_processor: DocProcessor,
+    ) -> Document:
+        doc, _ = self.__create_document(db, name, mime, content, doc_processor)
+        return doc
+
+    # one file at a time, a file that fails does not stop the others
+    def create_documents(
+        self, db: Session, files: Iterable[ArchiveFile], doc_processor: DocProcessor
+    ) -> BulkUploadResult:
+        ret = BulkUploadResult()
+        for file in files:
+            if file.content is None or not (
+                file.mime and self.is_mime_supported(file.mime)
+            ):
+                ret.skipped.append(file.name)
+                continue
+            try:
+                doc, created = self.__create_document(
+                    db, file.name, file.mime, file.content, doc_processor
+                )
+            except Exception:
+                logger.exception(f"Upload of {file.name=} failed")
+                db.rollback()
+                ret.failed.append(file.name)
+                continue
+            (ret.created if created else ret.duplicates).append(doc.id)
+        logger.info(
+            f"Bulk upload created={len(ret.created)} duplicates={len(ret.duplicates)} "
+            f"skipped={len(ret.skipped)} failed={len(ret.failed)}"
+        )
+        return ret
+
+    # the document and whether it was created by this call
+    def __create_document(
+        self,
+        db: Session,
+        name: str,
+        mime: str,
+        content: bytes,
+        doc_processor: DocProcessor,
+    ) -> Tuple[Document, bool]:
+        # the same bytes uploaded again are neither rasterized nor indexed again
+        content_hash = compute_blob_hash(content)
+        existing = self.__find_document_by_hash(db, content_hash)
+        if existing:
+            logger.info(f"Upload of {name=} is a duplicate of document {existing.id=}")
+            return existing, False
+
+        try:
+            return (
+                self.__add_document(
+                    db, name, mime, content, content_hash, doc_processor
+                ),
+                True,
+            )
+        except IntegrityError:
+            # a concurrent upload of the same bytes won
+            db.rollback()
+            existing = self.__find_document_by_hash(db, content_hash)
+            if not existing:
+                raise
+            return existing, False
+
+    def __find_document_by_hash(
+        self, db: Session, content_hash: str
+    ) -> Optional[Document]:
+        return db.query(Document).filter(Document.content_hash == content_hash).first()
+
+    def __add_document(
+        self,
+        db: Session,
+        name: str,
+        mime: str,
+        content: bytes,
+        content_hash: str,
+        doc_processor: DocProcessor,
     ) -> Document:
         doc = Document(
             name=name,
             mime=mime,
             created_at=timestamp_ms(),
             indexed=False,
+            content_hash=content_hash,
+        )
+        # blobs go to the blob store, rows only keep their hashes
+        doc_content = DocumentContent(
+            document=doc, content_hash=self.blob_store.put(content)
         )
-        doc_content = DocumentContent(document=doc, content=content)
-
-        pages_bytes = doc_processor.extract_pages(doc, doc_content)
-        pages = []
-        for idx, page_bytes in enumerate(pages_bytes):
-            page = DocumentPage(document=doc, number=idx + 1, image=page_bytes)
-            pages.append(page)
-            db.add(page)
-
-        chunks_bytes = doc_processor.chunk_pages(pages)
 
-        for page, chunk_bytes in chunks_bytes:
-            chunk = DocumentChunk(document=doc, page=page, image=chunk_bytes)
+        # streamed, page images are not all held in memory at once
+        pages = self.__add_pages(db, doc, doc_processor.extract_pages(doc, content))
+        for page, chunk_bytes in doc_processor.chunk_pages(pages):
+            chunk = DocumentChunk(
+                document=doc, page=page, image_hash=self.blob_store.put(chunk_bytes)
+            )
+            if chunk.image_hash != page.image_hash:
+                self.renditions.create_at_ingest(db, [(chunk.image_hash, chunk_bytes)])
             db.add(chunk)
 
         db.add(doc)
         db.add(doc_content)
+        db.flush()
+        # same transaction, a document never exists without its indexing job
+        self.index_queue.enqueue(db, doc)
         db.commit()
         db.refresh(doc)
         return doc
 
+    def __add_pages(
+        self, db: Session, doc: Document, pages_bytes: Iterable[bytes]
+    ) -> Iterator[Tuple[DocumentPage, bytes]]:
+        for idx, page_bytes in enumerate(pages_bytes):
+            page = DocumentPage(
+                document=doc,
+                number=idx + 1,
+                image_hash=self.blob_store.put(page_bytes),
+            )
+            self.renditions.create_at_ingest(db, [(page.image_hash, page_bytes)])
+            db.add(page)
+            yield page, page_bytes
+
     def get_document(self, db: Session, entity_id: int):
         ret = db.query(Document).filter(Document.id == entity_id).first()
         if not ret:
-            raise RuntimeError(f"Document #{entity_id} not found")
+            raise EntityNotFoundError(f"Document #{entity_id} not found")
         return ret
 
-    def delete_document(self, db: Session, entity_id: int, doc_indexer: DocIndexer):
-        doc = self.get_document(db, entity_id)
+    async def delete_document(
+        self, db: Session, entity_id: int, doc_indexer: DocIndexer
+    ):
+        doc = await run_in_threadpool(self.get_document, db, entity_id)
 
-        doc_indexer.delete(doc)
+        # before the embeddings are released, no worker indexes it afterwards
+        await run_in_threadpool(self.index_queue.cancel_document_jobs, db, doc)
+        released, blob_hashes = await run_in_threadpool(
+            self.__delete_document_rows, db, doc, doc_indexer
+        )
+        await doc_indexer.delete_released(released)
+        await run_in_threadpool(self.__delete_unreferenced_blobs, db, blob_hashes)
+        return doc
+
+    # Embeddings are released in the transaction deleting the rows. The lock
+    # on the document makes a concurrent assign of its chunks either commit
+    # before, then they are released here, or find the document gone.
+    def __delete_document_rows(
+        self, db: Session, doc: Document, doc_indexer: DocIndexer
+    ) -> Tuple[List[Tuple[int, Optional[str]]], Set[str]]:
+        db.query(Document.id).filter(Document.id == doc.id).with_for_update().first()
+        chunks = (
+            db.query(DocumentChunk.id, DocumentChunk.embedding_id)
+            .filter(DocumentChunk.doc_id == doc.id)
+            .all()
+        )
+        chunk_ids = {chunk_id for chunk_id, _ in chunks}
+        self.__invalidate_chunk_caches(chunk_ids)
+        blob_hashes = self.__load_document_blob_hashes(db, doc)
+        released = doc_indexer.release(db, doc)
 
         db.query(DocumentChunk).filter(DocumentChunk.document == doc).delete()
         db.query(DocumentPage).filter(DocumentPage.document == doc).delete()
         db.query(DocumentContent).filter(DocumentContent.document == doc).delete()
-
-        db.delete(doc)
+        # bulk delete, the ORM would load the relationships of doc first
+        db.query(Document).filter(Document.id == doc.id).delete()
         db.commit()
-        return doc
 
-    def index_documents(self, db: Session, doc_indexer: DocIndexer):
-        docs_for_scanning = db.query(Document).filter(Document.indexed == False).all()
-        for doc in docs_for_scanning:
-            # already scanning
-            if doc.id in scanning_doc_ids:
-                continue
-            scanning_doc_ids.add(doc.id)
-            try:
-                doc_indexer.index(doc)
+        # after the commit, a search meanwhile would cache the chunks again
+        for _, embedding_id in chunks:
+            if embedding_id is not None:
+                self.search_result_cache.delete(embedding_id)
+        return released, blob_hashes
+
+    def __load_document_blob_hashes(self, db: Session, doc: Document) -> Set[str]:
+        ret = set()
+        for model, column in BLOB_HASH_COLUMNS:
+            ret.update(
+                blob_hash
+                for (blob_hash,) in db.query(column).filter(
+                    model.doc_id == doc.id, column.is_not(None)
+                )
+            )
+        return ret
 
-            finally:
-                scanning_doc_ids.remove(doc.id)
-            # if processing was successful
-            doc.indexed = True
-            db.commit()
+    # blobs are content-addressed, other documents may share them.
+    # An upload of the same bytes racing with the delete can lose its blob.
+    def __delete_unreferenced_blobs(self, db: Session, blob_hashes: Set[str]):
+        if not blob_hashes:
+            return
+        referenced = set()
+        for _, column in BLOB_HASH_COLUMNS:
+            referenced.update(
+                blob_hash
+                for (blob_hash,) in db.query(column)
+                .filter(column.in_(blob_hashes))
+                .distinct()
+            )
+        unreferenced = blob_hashes - referenced
+        self.renditions.delete_for_sources(db, unreferenced)
+        for blob_hash in unreferenced:
+            self.blob_store.delete(blob_hash)
+
+    def __invalidate_chunk_caches(self, chunk_ids: Set[int]):
+        self.interpret_cache.delete_where(lambda key: key[0] in chunk_ids)
+        self.rag_cache.delete_where(lambda key: not chunk_ids.isdisjoint(key[1]))
+        if self.interpret_disk_cache:
+            for chunk_id in chunk_ids:
+                self.interpret_disk_cache.delete_group(f"chunk-{chunk_id}")
+
+
+# blobs are immutable, the content hash identifies the representation
+def blob_etag(blob_hash: Optional[str], inline: Optional[bytes]) -> str:
+    if blob_hash is None:
+        blob_hash = compute_blob_hash(inline or b"")
+    return content_etag(blob_hash)
 
 
 def get_classifier_service(state: Any) -> ClassifierService:
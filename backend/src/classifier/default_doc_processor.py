@@ -1,50 +1,132 @@
-from typing import List, Tuple
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+from tempfile import TemporaryDirectory
+import threading
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
 
-from ..utils.doc_converter import convert_to
+from ..utils.doc_converter import OfficeConverterPool
+from ..utils.files import write_binary_file
 from ..utils.images import pil_to_jpeg_bytes
 from .mime_types import MimeType
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path, pdfinfo_from_path
 
-from .classifier_models import Document, DocumentContent, DocumentPage
+from .classifier_models import Document, DocumentPage
 from .classifier_service import DocProcessor
 
 PDF_DPI = 100
+# pages rasterized and encoded by one pool task
+PDF_RASTER_BATCH_PAGES = int(os.environ.get("PDF_RASTER_BATCH_PAGES", "8"))
+PDF_RASTER_PROCESSES = int(
+    os.environ.get("PDF_RASTER_PROCESSES", str(os.cpu_count() or 1))
+)
 
 
 class DefaultDocProcessor(DocProcessor):
+    def __init__(self) -> None:
+        # started on the first PDF, uploads call in from several threads
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pool_lock = threading.Lock()
+        self.office_pool = OfficeConverterPool()
 
-    def extract_pages(self, doc: Document, doc_content: DocumentContent) -> List[bytes]:
-        ret: List[bytes]
+    def close(self):
+        with self.pool_lock:
+            if self.pool:
+                self.pool.shutdown(cancel_futures=True)
+                self.pool = None
+        self.office_pool.close()
+
+    def extract_pages(self, doc: Document, content: bytes) -> Iterator[bytes]:
         if doc.mime == MimeType.PDF:
-            ret = split_pdf(doc_content.content)
+            return self.__split_pdf(content)
         elif doc.mime == MimeType.PPTX:
-            pdf = to_pdf(doc_content.content, format="pptx")
-            ret = split_pdf(pdf)
+            return self.__split_pdf(self.__to_pdf(content, format="pptx"))
         elif doc.mime == MimeType.DOCX:
-            pdf = to_pdf(doc_content.content, format="docx")
-            ret = split_pdf(pdf)
+            return self.__split_pdf(self.__to_pdf(content, format="docx"))
         elif doc.mime == MimeType.XLSX:
-            pdf = to_pdf(doc_content.content, format="xlsx")
-            ret = split_pdf(pdf)
+            return self.__split_pdf(self.__to_pdf(content, format="xlsx"))
         elif doc.mime == MimeType.JPEG or doc.mime == MimeType.PNG:
-            ret = [doc_content.content]
+            return iter([content])
         else:
             raise ValueError(f"No processors for document type {doc.mime}")
-        return ret
 
     def chunk_pages(
-        self, pages: List[DocumentPage]
-    ) -> List[Tuple[DocumentPage, bytes]]:
-        ret = []
-        for page in pages:
-            ret.append((page, page.image))
-        return ret
+        self, pages: Iterable[Tuple[DocumentPage, bytes]]
+    ) -> Iterator[Tuple[DocumentPage, bytes]]:
+        for page, image in pages:
+            yield page, image
+
+    def __to_pdf(self, source: bytes, format: str) -> bytes:
+        return self.office_pool.convert(
+            source=source, from_format=format, to_format="pdf", timeout=30
+        )
+
+    # Rasterizes page ranges in the pool and yields JPEGs in page order. At most
+    # two batches per process are in flight, so memory does not grow with the
+    # page count.
+    def __split_pdf(self, pdf: bytes) -> Iterator[bytes]:
+        pool = self.__get_pool()
+
+        def iter_pages():
+            with TemporaryDirectory() as tmp_dir:
+                # workers read the file instead of receiving the whole PDF per task
+                pdf_path = os.path.join(tmp_dir, "doc.pdf")
+                write_binary_file(pdf_path, pdf)
+                page_count = pdfinfo_from_path(pdf_path)["Pages"]
+
+                batches = iter(range(1, page_count + 1, PDF_RASTER_BATCH_PAGES))
+                pending: Deque[Future[List[bytes]]] = deque()
+                try:
+                    while True:
+                        while len(pending) < 2 * PDF_RASTER_PROCESSES:
+                            first_page = next(batches, None)
+                            if first_page is None:
+                                break
+                            last_page = min(
+                                first_page + PDF_RASTER_BATCH_PAGES - 1, page_count
+                            )
+                            pending.append(
+                                pool.submit(
+                                    rasterize_pdf_pages, pdf_path, first_page, last_page
+                                )
+                            )
+                        if not pending:
+                            break
+                        try:
+                            images = pending.popleft().result()
+                        except BrokenProcessPool:
+                            # e.g. a worker killed for memory, start over next time
+                            with self.pool_lock:
+                                if self.pool is pool:
+                                    self.pool = None
+                            raise
+                        yield from images
+                finally:
+                    # abandoned or failed, don't let workers read a deleted file
+                    for future in pending:
+                        future.cancel()
+                    for future in pending:
+                        if not future.cancelled():
+                            future.exception()
 
+        return iter_pages()
 
-def to_pdf(source: bytes, format: str) -> bytes:
-    return convert_to(source=source, from_format=format, to_format="pdf", timeout=30)
+    def __get_pool(self) -> ProcessPoolExecutor:
+        with self.pool_lock:
+            if self.pool is None:
+                # spawn, forking a process with running threads is unsafe
+                self.pool = ProcessPoolExecutor(
+                    max_workers=PDF_RASTER_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.pool
 
 
-def split_pdf(pdf: bytes) -> List[bytes]:
-    images = convert_from_bytes(pdf, dpi=PDF_DPI)
+# runs in a pool process, rasterizing and JPEG encoding happen there
+def rasterize_pdf_pages(pdf_path: str, first_page: int, last_page: int) -> List[bytes]:
+    images = convert_from_path(
+        pdf_path, dpi=PDF_DPI, first_page=first_page, last_page=last_page
+    )
     return [pil_to_jpeg_bytes(img) for img in images]
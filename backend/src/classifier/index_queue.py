@@ -0,0 +1,203 @@
+import logging
+import os
+from typing import Dict, Optional
+import uuid
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session
+
+from ..utils.dates import timestamp_ms
+from .classifier_models import Document, IndexJob, IndexJobStatus
+
+logger = logging.getLogger(__name__)
+
+LEASE_MS = int(os.environ.get("INDEX_JOB_LEASE_MS", str(60_000)))
+MAX_ATTEMPTS = int(os.environ.get("INDEX_JOB_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_MS = int(os.environ.get("INDEX_JOB_BACKOFF_BASE_MS", str(10_000)))
+BACKOFF_MAX_MS = int(os.environ.get("INDEX_JOB_BACKOFF_MAX_MS", str(600_000)))
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+def backoff_ms(attempts: int) -> int:
+    return min(BACKOFF_BASE_MS * 2 ** (attempts - 1), BACKOFF_MAX_MS)
+
+
+# Durable indexing queue in Postgres. Jobs are claimed with
+# SELECT ... FOR UPDATE SKIP LOCKED and then held by a time based lease,
+# so the row lock is not kept while the document is being indexed.
+# Expired leases (crashed workers) count as failed attempts and are retried
+# after the backoff, a document killing its workers ends up failed.
+class IndexQueue:
+
+    def enqueue(self, db: Session, doc: Document):
+        now = timestamp_ms()
+        db.add(
+            IndexJob(
+                doc_id=doc.id,
+                status=IndexJobStatus.PENDING,
+                attempts=0,
+                run_after=now,
+                created_at=now,
+                updated_at=now,
+            )
+        )
+
+    def claim(self, db: Session, worker_id: str) -> Optional[IndexJob]:
+        while True:
+            now = timestamp_ms()
+            job = (
+                db.query(IndexJob)
+                .filter(
+                    or_(
+                        and_(
+                            IndexJob.status == IndexJobStatus.PENDING,
+                            IndexJob.run_after <= now,
+                        ),
+                        and_(
+                            IndexJob.status == IndexJobStatus.RUNNING,
+                            IndexJob.lease_expires_at < now,
+                        ),
+                    )
+                )
+                .order_by(IndexJob.run_after.asc(), IndexJob.id.asc())
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not job:
+                db.rollback()
+                return None
+            if job.status == IndexJobStatus.PENDING:
+                break
+            self.__expire_lease(db, job, now)
+
+        job.status = IndexJobStatus.RUNNING
+        job.attempts += 1
+        # token of this claim, tasks of one worker share the worker id and a
+        # task still running a job leased again must not pass as its owner
+        job.lease_owner = f"{worker_id}:{uuid.uuid4().hex}"
+        job.lease_expires_at = now + LEASE_MS
+        job.updated_at = now
+        db.commit()
+        # loaded state stays usable after the session is closed
+        db.refresh(job)
+        return job
+
+    def heartbeat(self, db: Session, job: IndexJob):
+        now = timestamp_ms()
+        if not self.__update_owned(
+            db, job, lease_expires_at=now + LEASE_MS, updated_at=now
+        ):
+            raise LeaseLostError(f"Lease of job {job.id=} lost")
+
+    def complete(self, db: Session, job: IndexJob):
+        if not self.__update_owned(
+            db,
+            job,
+            status=IndexJobStatus.DONE,
+            lease_owner=None,
+            lease_expires_at=None,
+            updated_at=timestamp_ms(),
+            commit=False,
+        ):
+            db.rollback()
+            raise LeaseLostError(f"Lease of job {job.id=} lost")
+        db.query(Document).filter(Document.id == job.doc_id).update(
+            {Document.indexed: True}
+        )
+        db.commit()
+
+    def fail(self, db: Session, job: IndexJob, error: str):
+        now = timestamp_ms()
+        if job.attempts >= MAX_ATTEMPTS:
+            logger.error(f"Job {job.id=} failed after {job.attempts} attempts")
+            status = IndexJobStatus.FAILED
+            run_after = job.run_after
+        else:
+            status = IndexJobStatus.PENDING
+            run_after = now + backoff_ms(job.attempts)
+        self.__update_owned(
+            db,
+            job,
+            status=status,
+            run_after=run_after,
+            lease_owner=None,
+            lease_expires_at=None,
+            last_error=error[-4000:],
+            updated_at=now,
+        )
+
+    # gives the job back without counting the attempt, e.g. on shutdown
+    def release(self, db: Session, job: IndexJob):
+        self.__update_owned(
+            db,
+            job,
+            status=IndexJobStatus.PENDING,
+            attempts=IndexJob.attempts - 1,
+            lease_owner=None,
+            lease_expires_at=None,
+            updated_at=timestamp_ms(),
+        )
+
+    # status -> number of jobs, done ones pile up and are not counted
+    def counts(self, db: Session) -> Dict[str, int]:
+        statuses = [
+            IndexJobStatus.PENDING,
+            IndexJobStatus.RUNNING,
+            IndexJobStatus.FAILED,
+        ]
+        rows = (
+            db.query(IndexJob.status, func.count())
+            .filter(IndexJob.status.in_(statuses))
+            .group_by(IndexJob.status)
+            .all()
+        )
+        ret = {str(status): 0 for status in statuses}
+        ret.update({str(status): count for status, count in rows})
+        return ret
+
+    # waits for a claim in progress, a worker running the job then loses the
+    # lease and stops at its next heartbeat
+    def cancel_document_jobs(self, db: Session, doc: Document):
+        job_ids = [
+            job_id
+            for (job_id,) in db.query(IndexJob.id)
+            .filter(IndexJob.doc_id == doc.id)
+            .with_for_update()
+        ]
+        if job_ids:
+            db.query(IndexJob).filter(IndexJob.id.in_(job_ids)).delete()
+        db.commit()
+
+    # the holder died without failing the job, e.g. killed while rasterizing,
+    # the attempt it claimed counts like a failed one
+    def __expire_lease(self, db: Session, job: IndexJob, now: int):
+        logger.warning(f"Lease of job {job.id=} by {job.lease_owner=} expired")
+        if job.attempts >= MAX_ATTEMPTS:
+            logger.error(f"Job {job.id=} failed after {job.attempts} attempts")
+            job.status = IndexJobStatus.FAILED
+        else:
+            job.status = IndexJobStatus.PENDING
+            job.run_after = now + backoff_ms(job.attempts)
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.last_error = f"Lease expired after attempt {job.attempts}"
+        job.updated_at = now
+        db.commit()
+
+    # job holds the lease token of its claim
+    def __update_owned(self, db: Session, job: IndexJob, commit=True, **values) -> bool:
+        res = db.execute(
+            update(IndexJob)
+            .where(
+                IndexJob.id == job.id,
+                IndexJob.lease_owner == job.lease_owner,
+                IndexJob.status == IndexJobStatus.RUNNING,
+            )
+            .values(**values)
+        )
+        if commit:
+            db.commit()
+        return res.rowcount > 0
@@ -0,0 +1,105 @@
+import io
+import math
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ..colpali.similarity_maps import relevant_box
+
+# pages are cropped to the patches relevant to the query
+RAG_CROP = os.environ.get("RAG_CROP", "true") == "true"
+# share of the top relevance a patch needs to be kept
+RAG_CROP_THRESHOLD = float(os.environ.get("RAG_CROP_THRESHOLD", "0.6"))
+RAG_CROP_PADDING = int(os.environ.get("RAG_CROP_PADDING", "1"))
+# a crop keeping more of the page than this is not worth the lost context
+RAG_CROP_MAX_AREA = float(os.environ.get("RAG_CROP_MAX_AREA", "0.8"))
+
+# vision tokens allowed per image, images are downscaled until they fit.
+# Default tiling is the OpenAI high detail one: 170 tokens per 512px tile + 85
+RAG_IMAGE_TOKEN_BUDGET = int(os.environ.get("RAG_IMAGE_TOKEN_BUDGET", "765"))
+RAG_IMAGE_TILE_SIZE = int(os.environ.get("RAG_IMAGE_TILE_SIZE", "512"))
+RAG_IMAGE_TILE_TOKENS = int(os.environ.get("RAG_IMAGE_TILE_TOKENS", "170"))
+RAG_IMAGE_BASE_TOKENS = int(os.environ.get("RAG_IMAGE_BASE_TOKENS", "85"))
+RAG_IMAGE_QUALITY = int(os.environ.get("RAG_IMAGE_QUALITY", "80"))
+RAG_IMAGE_MIN_SIZE = 64
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    tiles = math.ceil(width / RAG_IMAGE_TILE_SIZE) * math.ceil(
+        height / RAG_IMAGE_TILE_SIZE
+    )
+    return RAG_IMAGE_BASE_TOKENS + tiles * RAG_IMAGE_TILE_TOKENS
+
+
+# largest size with the aspect ratio of the image within the budget, never upscaled
+def fit_token_budget(width: int, height: int, budget: int) -> Tuple[int, int]:
+    scale = 1.0
+    while True:
+        size = (max(round(width * scale), 1), max(round(height * scale), 1))
+        if estimate_image_tokens(*size) <= budget or max(size) <= RAG_IMAGE_MIN_SIZE:
+            return size
+        scale *= 0.9
+
+
+# Images sent to the LLM with the question: each chunk is cropped to the region
+# its similarity map marks relevant to the query, then downscaled to the token
+# budget and encoded as JPEG
+class RagContextBuilder:
+    def __init__(
+        self,
+        crop: bool = RAG_CROP,
+        crop_threshold: float = RAG_CROP_THRESHOLD,
+        crop_padding: int = RAG_CROP_PADDING,
+        token_budget: int = RAG_IMAGE_TOKEN_BUDGET,
+    ) -> None:
+        self.crop = crop
+        self.crop_threshold = crop_threshold
+        self.crop_padding = crop_padding
+        self.token_budget = token_budget
+
+    # identifies the parameters, answers depend on them
+    @property
+    def version(self) -> str:
+        crop = (
+            f"{self.crop_threshold}:{self.crop_padding}:{RAG_CROP_MAX_AREA}"
+            if self.crop
+            else "none"
+        )
+        return f"crop={crop}:budget={self.token_budget}:q={RAG_IMAGE_QUALITY}"
+
+    def build(
+        self, images: List[bytes], sim_maps: List[Optional[np.ndarray]]
+    ) -> List[bytes]:
+        return [
+            self.prepare_image(image, sim_map)
+            for image, sim_map in zip(images, sim_maps)
+        ]
+
+    def prepare_image(self, image: bytes, sim_map: Optional[np.ndarray]) -> bytes:
+        with Image.open(io.BytesIO(image)) as img:
+            img = img.convert("RGB")
+            if self.crop and sim_map is not None:
+                img = self.__crop(img, sim_map)
+            size = fit_token_budget(img.width, img.height, self.token_budget)
+            if size != img.size:
+                img = img.resize(size, Image.Resampling.LANCZOS)
+            bytes_io = io.BytesIO()
+            img.save(bytes_io, format="JPEG", quality=RAG_IMAGE_QUALITY)
+            return bytes_io.getvalue()
+
+    def __crop(self, img: Image.Image, sim_map: np.ndarray) -> Image.Image:
+        left, top, right, bottom = relevant_box(
+            sim_map, self.crop_threshold, self.crop_padding
+        )
+        if (right - left) * (bottom - top) > RAG_CROP_MAX_AREA:
+            return img
+        return img.crop(
+            (
+                round(left * img.width),
+                round(top * img.height),
+                round(right * img.width),
+                round(bottom * img.height),
+            )
+        )
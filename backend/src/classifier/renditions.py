@@ -0,0 +1,142 @@
+from enum import StrEnum
+import io
+import logging
+import os
+from typing import Callable, Iterable, Tuple
+
+from PIL import Image
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from ..blobs.blob_store import BlobStore
+from ..utils.cache import LruCache
+from .classifier_models import ImageRendition
+
+logger = logging.getLogger(__name__)
+
+
+class Rendition(StrEnum):
+    THUMBNAIL = "thumbnail"
+    PREVIEW = "preview"
+    FULL = "full"
+    MODEL_INPUT = "model-input"
+
+
+FORMAT_MIMES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+RENDITION_FORMAT = os.environ.get("RENDITION_FORMAT", "webp")
+RENDITION_QUALITY = int(os.environ.get("RENDITION_QUALITY", "80"))
+# longest side in pixels, images are never upscaled and full is the original
+RENDITION_SIZES = {
+    Rendition.THUMBNAIL: int(os.environ.get("RENDITION_THUMBNAIL_SIZE", "480")),
+    Rendition.PREVIEW: int(os.environ.get("RENDITION_PREVIEW_SIZE", "1280")),
+    Rendition.MODEL_INPUT: int(os.environ.get("RENDITION_MODEL_INPUT_SIZE", "1024")),
+}
+# created with the document, the others on first request
+RENDITIONS_AT_INGEST = [
+    Rendition(name)
+    for name in os.environ.get("RENDITIONS_AT_INGEST", Rendition.THUMBNAIL).split(",")
+    if name
+]
+RENDITION_CACHE_SIZE = int(os.environ.get("RENDITION_CACHE_SIZE", "10000"))
+
+
+# identifies the encoding parameters, changing them yields new renditions
+def rendition_variant(rendition: Rendition) -> str:
+    return (
+        f"{rendition}:{RENDITION_SIZES[rendition]}:{RENDITION_FORMAT}:"
+        f"{RENDITION_QUALITY}"
+    )
+
+
+def render_rendition(image: bytes, rendition: Rendition) -> bytes:
+    max_size = RENDITION_SIZES[rendition]
+    with Image.open(io.BytesIO(image)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        bytes_io = io.BytesIO()
+        img.save(bytes_io, format=RENDITION_FORMAT.upper(), quality=RENDITION_QUALITY)
+        return bytes_io.getvalue()
+
+
+# Sized variants of page and chunk images. Renditions are stored in the blob
+# store and found through the image_rendition table by source image hash.
+class RenditionService:
+    def __init__(self, blob_store: BlobStore) -> None:
+        self.blob_store = blob_store
+        # (source_hash, variant) -> (blob_hash, mime)
+        self.cache = LruCache[Tuple[str, str], Tuple[str, str]](
+            max_items=RENDITION_CACHE_SIZE
+        )
+
+    # (blob_hash, mime) of the rendition, rendered from load_source when missing
+    def get(
+        self,
+        db: Session,
+        source_hash: str,
+        load_source: Callable[[], bytes],
+        rendition: Rendition,
+    ) -> Tuple[str, str]:
+        variant = rendition_variant(rendition)
+        ret = self.cache.get((source_hash, variant))
+        if ret is not None:
+            return ret
+
+        row = (
+            db.query(ImageRendition.blob_hash, ImageRendition.mime)
+            .filter(
+                ImageRendition.source_hash == source_hash,
+                ImageRendition.variant == variant,
+            )
+            .first()
+        )
+        if row:
+            ret = (row[0], row[1])
+        else:
+            ret = self.__create(db, source_hash, load_source(), rendition)
+            db.commit()
+        self.cache.put((source_hash, variant), ret)
+        return ret
+
+    # renders the ingest renditions within the caller's transaction
+    def create_at_ingest(self, db: Session, images: Iterable[Tuple[str, bytes]]):
+        for source_hash, image in images:
+            for rendition in RENDITIONS_AT_INGEST:
+                self.__create(db, source_hash, image, rendition)
+
+    # rendition blobs are shared by all images with the same source hash
+    def delete_for_sources(self, db: Session, source_hashes: Iterable[str]):
+        source_hashes = list(source_hashes)
+        if not source_hashes:
+            return
+        rows = (
+            db.query(ImageRendition.source_hash, ImageRendition.blob_hash)
+            .filter(ImageRendition.source_hash.in_(source_hashes))
+            .all()
+        )
+        db.query(ImageRendition).filter(
+            ImageRendition.source_hash.in_(source_hashes)
+        ).delete()
+        db.commit()
+        deleted = set(source_hashes)
+        self.cache.delete_where(lambda key: key[0] in deleted)
+        for _, blob_hash in rows:
+            self.blob_store.delete(blob_hash)
+
+    def __create(
+        self, db: Session, source_hash: str, image: bytes, rendition: Rendition
+    ) -> Tuple[str, str]:
+        blob_hash = self.blob_store.put(render_rendition(image, rendition))
+        mime = FORMAT_MIMES[RENDITION_FORMAT]
+        # concurrent requests may render the same rendition, the result is equal
+        db.execute(
+            insert(ImageRendition)
+            .values(
+                source_hash=source_hash,
+                variant=rendition_variant(rendition),
+                blob_hash=blob_hash,
+                mime=mime,
+            )
+            .on_conflict_do_nothing(index_elements=["source_hash", "variant"])
+        )
+        return blob_hash, mime
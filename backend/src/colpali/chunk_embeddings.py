@@ -0,0 +1,160 @@
+from collections import Counter
+import logging
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from ..classifier.classifier_models import ChunkEmbedding, Document, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+
+# Reference counted embeddings of distinct chunk images. Indexing a document
+# attaches its chunks to the embeddings of their image hashes, creating the
+# missing ones, and only those not in the vector index yet need embedding.
+# Deleting a document detaches its chunks, embeddings left without chunks are
+# removed from the index.
+class ChunkEmbeddings:
+
+    # embedding ids of the document that still need a stored vector, none
+    # once it is deleted. The document stays locked FOR SHARE until the
+    # commit, a delete releases its chunks after them or finds none.
+    def assign(self, db: Session, doc: Document) -> List[int]:
+        exists = (
+            db.query(Document.id)
+            .filter(Document.id == doc.id)
+            .with_for_update(read=True)
+            .first()
+        )
+        if exists is None:
+            db.rollback()
+            logger.info(f"Skipped embeddings of deleted document {doc.id=}")
+            return []
+
+        chunks = (
+            db.query(DocumentChunk.id, DocumentChunk.image_hash)
+            .filter(
+                DocumentChunk.doc_id == doc.id, DocumentChunk.embedding_id.is_(None)
+            )
+            .all()
+        )
+        hash_counts = Counter(
+            image_hash for _, image_hash in chunks if image_hash is not None
+        )
+        if hash_counts:
+            # sorted, concurrent documents lock shared rows in the same order
+            stmt = insert(ChunkEmbedding).values(
+                [
+                    {"image_hash": image_hash, "ref_count": count, "stored": False}
+                    for image_hash, count in sorted(hash_counts.items())
+                ]
+            )
+            rows = db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["image_hash"],
+                    set_={
+                        "ref_count": ChunkEmbedding.ref_count + stmt.excluded.ref_count
+                    },
+                ).returning(ChunkEmbedding.id, ChunkEmbedding.image_hash)
+            ).all()
+            chunk_table = DocumentChunk.__table__
+            db.execute(
+                update(chunk_table)
+                .where(
+                    chunk_table.c.doc_id == doc.id,
+                    chunk_table.c.image_hash == bindparam("b_image_hash"),
+                )
+                .values(embedding_id=bindparam("b_embedding_id")),
+                [
+                    {"b_image_hash": image_hash, "b_embedding_id": embedding_id}
+                    for embedding_id, image_hash in rows
+                ],
+            )
+
+        # legacy inline images have no hash to share
+        for chunk_id, image_hash in chunks:
+            if image_hash is None:
+                embedding = ChunkEmbedding(ref_count=1, stored=False)
+                db.add(embedding)
+                db.flush()
+                db.query(DocumentChunk).filter(DocumentChunk.id == chunk_id).update(
+                    {DocumentChunk.embedding_id: embedding.id}
+                )
+
+        ret = [
+            embedding_id
+            for (embedding_id,) in db.query(ChunkEmbedding.id)
+            .join(DocumentChunk, DocumentChunk.embedding_id == ChunkEmbedding.id)
+            .filter(DocumentChunk.doc_id == doc.id, ChunkEmbedding.stored.is_(False))
+            .distinct()
+            .order_by(ChunkEmbedding.id.asc())
+        ]
+        db.commit()
+        logger.info(
+            f"Assigned embeddings {doc.id=} chunks={len(chunks)} new={len(ret)}"
+        )
+        return ret
+
+    # ids of the embeddings still referenced by chunks of the document. Their
+    # rows stay locked FOR SHARE until the transaction ends, a concurrent
+    # release of the document waits for the vectors stored meanwhile.
+    # Locked in id order like release updates them, so the two never deadlock.
+    def lock_referenced(
+        self, db: Session, doc_id: int, embedding_ids: List[int]
+    ) -> Set[int]:
+        return {
+            embedding_id
+            for (embedding_id,) in db.query(ChunkEmbedding.id)
+            .join(DocumentChunk, DocumentChunk.embedding_id == ChunkEmbedding.id)
+            .filter(
+                DocumentChunk.doc_id == doc_id, ChunkEmbedding.id.in_(embedding_ids)
+            )
+            .order_by(ChunkEmbedding.id.asc())
+            .with_for_update(read=True, of=ChunkEmbedding)
+        }
+
+    def mark_stored(self, db: Session, embedding_ids: List[int], stored=True):
+        db.query(ChunkEmbedding).filter(ChunkEmbedding.id.in_(embedding_ids)).update(
+            {ChunkEmbedding.stored: stored}
+        )
+        db.commit()
+
+    # (id, image_hash) of the embeddings no chunk references anymore, their
+    # rows are deleted within the caller's transaction
+    def release(self, db: Session, doc: Document) -> List[Tuple[int, Optional[str]]]:
+        ref_counts = Counter(
+            embedding_id
+            for (embedding_id,) in db.query(DocumentChunk.embedding_id).filter(
+                DocumentChunk.doc_id == doc.id, DocumentChunk.embedding_id.is_not(None)
+            )
+        )
+        if not ref_counts:
+            return []
+
+        db.query(DocumentChunk).filter(DocumentChunk.doc_id == doc.id).update(
+            {DocumentChunk.embedding_id: None}
+        )
+        embedding_table = ChunkEmbedding.__table__
+        db.execute(
+            update(embedding_table)
+            .where(embedding_table.c.id == bindparam("b_id"))
+            .values(ref_count=embedding_table.c.ref_count - bindparam("b_count")),
+            [
+                {"b_id": embedding_id, "b_count": count}
+                for embedding_id, count in sorted(ref_counts.items())
+            ],
+        )
+        ret = [
+            (embedding_id, image_hash)
+            for embedding_id, image_hash in db.execute(
+                delete(ChunkEmbedding)
+                .where(
+                    ChunkEmbedding.id.in_(ref_counts.keys()),
+                    ChunkEmbedding.ref_count <= 0,
+                )
+                .returning(ChunkEmbedding.id, ChunkEmbedding.image_hash)
+            )
+        ]
+        return ret
@@ -1,64 +1,112 @@
 import logging
-from typing import Any, List
+from typing import Any, Dict, List, Sequence
 import httpx
 import base64
+import numpy as np
+
+from ..utils.metrics import STAGE_COLPALI, timed
+from .colpali_codec import EMBEDDINGS_MIME, decode_embeddings, embeddings_from_json
 
 logger = logging.getLogger(__name__)
 
-BatchEmbeddings = List[List[List[float]]]
+BatchEmbeddings = List[np.ndarray]
+
+WIRE_FORMAT_BINARY = "binary"
+WIRE_FORMAT_JSON = "json"
 
 
 class ColpaliClient:
-    def __init__(self, base_url: str) -> None:
-        self.http = httpx.Client(base_url=base_url, timeout=3600)
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 3600,
+        max_connections: int = 16,
+        max_keepalive_connections: int = 8,
+        wire_format: str = WIRE_FORMAT_BINARY,
+        wire_dtype: str = "float16",
+    ) -> None:
+        self.embeddings_headers: Dict[str, str] = {}
+        if wire_format == WIRE_FORMAT_BINARY:
+            # server falls back to JSON when binary is not supported
+            self.embeddings_headers = {
+                "Accept": f"{EMBEDDINGS_MIME}, application/json;q=0.5",
+                "X-Embeddings-Dtype": wire_dtype,
+            }
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
 
-    def process_queries(self, queries: List[str]):
-        return self.__request(
+    async def close(self):
+        await self.http.aclose()
+
+    async def process_queries(self, queries: List[str]) -> BatchEmbeddings:
+        return await self.__request_embeddings(
             "/process-queries",
             {
                 "queries": queries,
             },
-        )["embedding_batches"]
+        )
 
-    def process_images(self, images: List[bytes]):
-        return self.__request(
+    async def process_images(self, images: List[bytes]) -> BatchEmbeddings:
+        return await self.__request_embeddings(
             "/process-images",
             {
                 "images": [base64.b64encode(img).decode("ascii") for img in images],
             },
-        )["embedding_batches"]
+        )
 
-    def interpret(
+    async def interpret(
         self,
         image: bytes,
         query: str,
     ) -> bytes:
-        res = self.__request(
-            "/interpret",
-            {
-                "query": query,
-                "image": base64.b64encode(image).decode("ascii"),
-            },
-        )["image"]
+        res = (
+            await self.__request(
+                "/interpret",
+                {
+                    "query": query,
+                    "image": base64.b64encode(image).decode("ascii"),
+                },
+            )
+        ).json()["image"]
         return base64.b64decode(res)
 
-    def score(
-        self, heystack_batch: BatchEmbeddings, needle_batch: BatchEmbeddings
+    async def score(
+        self, heystack_batch: Sequence[np.ndarray], needle_batch: Sequence[np.ndarray]
     ) -> List[float]:
-        return self.__request(
-            "/score",
-            {
-                "heystack_batch": heystack_batch,
-                "needle_batch": needle_batch,
-            },
-        )["scores"]
+        return (
+            await self.__request(
+                "/score",
+                {
+                    "heystack_batch": [np.asarray(e).tolist() for e in heystack_batch],
+                    "needle_batch": [np.asarray(e).tolist() for e in needle_batch],
+                },
+            )
+        ).json()["scores"]
+
+    async def __request_embeddings(
+        self, endpoint: str, payload: Any
+    ) -> BatchEmbeddings:
+        res = await self.__request(endpoint, payload, headers=self.embeddings_headers)
+        content_type = res.headers.get("Content-Type", "")
+        if content_type.startswith(EMBEDDINGS_MIME):
+            return decode_embeddings(res.content)
+        return embeddings_from_json(res.json()["embedding_batches"])
 
-    def __request(self, endpoint: str, payload: Any) -> Any:
-        for n in range(3):
-            try:
-                res = self.http.post(endpoint, json=payload)
-                res.raise_for_status()
-                return res.json()
-            except httpx.HTTPError:
-                logger.exception(f"Attempt {n=} failed")
-        raise RuntimeError("Request to ColPali failed in all attempts")
+    async def __request(
+        self, endpoint: str, payload: Any, headers: Dict[str, str] | None = None
+    ) -> httpx.Response:
+        with timed(STAGE_COLPALI, endpoint.lstrip("/")):
+            for n in range(3):
+                try:
+                    res = await self.http.post(endpoint, json=payload, headers=headers)
+                    res.raise_for_status()
+                    return res
+                except httpx.HTTPError:
+                    logger.exception(f"Attempt {n=} failed")
+            raise RuntimeError("Request to ColPali failed in all attempts")
@@ -0,0 +1,78 @@
+import struct
+from typing import List, Sequence
+
+import numpy as np
+
+# Binary multivector transport negotiated with ColPali server through `Accept`.
+# Layout (little-endian):
+#   magic "CPEB" | u8 version | u8 dtype | u16 reserved | u32 count
+#   count * (u32 tokens, u32 dim)
+#   raw row-major arrays in the same order
+# Compression is left to HTTP `Content-Encoding` (zstd when available).
+
+EMBEDDINGS_MIME = "application/x-colpali-embeddings"
+
+MAGIC = b"CPEB"
+VERSION = 1
+
+DTYPE_CODES = {
+    1: np.dtype("<f2"),
+    2: np.dtype("<f4"),
+}
+DTYPE_NAMES = {
+    "float16": 1,
+    "float32": 2,
+}
+
+HEADER = struct.Struct("<4sBBHI")
+SHAPE = struct.Struct("<II")
+
+
+def decode_embeddings(data: bytes) -> List[np.ndarray]:
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated ColPali embeddings payload")
+    magic, version, dtype_code, _, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a ColPali embeddings payload")
+    if version != VERSION:
+        raise ValueError(f"Unsupported ColPali embeddings version {version}")
+    if dtype_code not in DTYPE_CODES:
+        raise ValueError(f"Unsupported ColPali embeddings dtype {dtype_code}")
+    dtype = DTYPE_CODES[dtype_code]
+
+    offset = HEADER.size
+    if len(data) < offset + count * SHAPE.size:
+        raise ValueError("Truncated ColPali embeddings payload")
+    shapes = []
+    for _ in range(count):
+        shapes.append(SHAPE.unpack_from(data, offset))
+        offset += SHAPE.size
+    # checked before reading, a short payload fails the same as a long one
+    if offset + sum(t * d for t, d in shapes) * dtype.itemsize != len(data):
+        raise ValueError("Malformed ColPali embeddings payload")
+
+    ret: List[np.ndarray] = []
+    for tokens, dim in shapes:
+        size = tokens * dim
+        arr = np.frombuffer(data, dtype=dtype, count=size, offset=offset)
+        ret.append(arr.reshape(tokens, dim))
+        offset += size * dtype.itemsize
+    return ret
+
+
+def encode_embeddings(
+    embeddings: Sequence[np.ndarray], dtype: str = "float16"
+) -> bytes:
+    dtype_code = DTYPE_NAMES[dtype]
+    np_dtype = DTYPE_CODES[dtype_code]
+    parts = [HEADER.pack(MAGIC, VERSION, dtype_code, 0, len(embeddings))]
+    arrays = [np.ascontiguousarray(emb, dtype=np_dtype) for emb in embeddings]
+    for arr in arrays:
+        tokens, dim = arr.shape
+        parts.append(SHAPE.pack(tokens, dim))
+    parts.extend(arr.tobytes() for arr in arrays)
+    return b"".join(parts)
+
+
+def embeddings_from_json(embedding_batches: List[List[List[float]]]):
+    return [np.asarray(emb, dtype=np.float32) for emb in embedding_batches]
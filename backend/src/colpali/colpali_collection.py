@@ -0,0 +1,111 @@
+from typing import Any, Dict, NamedTuple, Optional
+
+import numpy as np
+from qdrant_client.http import models
+
+from .pooling import mean_pool
+
+MULTIVECTOR_NAME = "multivector"
+POOLED_VECTOR_NAME = "pooled"
+
+QUANTIZATION_NONE = "none"
+# INT8 scalar quantized copy in RAM, 4x smaller than originals
+QUANTIZATION_INT8 = "int8"
+# 1 bit per dimension in RAM (32x smaller), originals on disk for rescoring
+QUANTIZATION_BINARY = "binary"
+QUANTIZATION_PROFILES = [QUANTIZATION_NONE, QUANTIZATION_INT8, QUANTIZATION_BINARY]
+
+
+class CollectionLayout(NamedTuple):
+    vector_size: int
+    # legacy collections hold a single unnamed multivector
+    named: bool = True
+    pooled: bool = True
+    quantization: str = QUANTIZATION_INT8
+
+
+def detect_layout(info: models.CollectionInfo) -> CollectionLayout:
+    vectors = info.config.params.vectors
+    if isinstance(vectors, models.VectorParams):
+        return CollectionLayout(
+            vector_size=vectors.size,
+            named=False,
+            pooled=False,
+            quantization=detect_quantization(
+                vectors.quantization_config or info.config.quantization_config
+            ),
+        )
+    assert vectors is not None
+    multivector = vectors[MULTIVECTOR_NAME]
+    return CollectionLayout(
+        vector_size=multivector.size,
+        pooled=POOLED_VECTOR_NAME in vectors,
+        quantization=detect_quantization(
+            multivector.quantization_config or info.config.quantization_config
+        ),
+    )
+
+
+def detect_quantization(config: Optional[models.QuantizationConfig]) -> str:
+    if isinstance(config, models.ScalarQuantization):
+        return QUANTIZATION_INT8
+    if isinstance(config, models.BinaryQuantization):
+        return QUANTIZATION_BINARY
+    if config is None:
+        return QUANTIZATION_NONE
+    raise ValueError(f"Unsupported quantization {config}")
+
+
+def quantization_config(profile: str) -> Optional[models.QuantizationConfig]:
+    if profile == QUANTIZATION_INT8:
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True,
+            ),
+        )
+    if profile == QUANTIZATION_BINARY:
+        return models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=True),
+        )
+    if profile == QUANTIZATION_NONE:
+        return None
+    raise ValueError(f"Unknown quantization profile {profile}")
+
+
+def vectors_config(layout: CollectionLayout) -> Dict[str, models.VectorParams]:
+    ret = {
+        MULTIVECTOR_NAME: models.VectorParams(
+            size=layout.vector_size,
+            distance=models.Distance.COSINE,
+            multivector_config=models.MultiVectorConfig(
+                comparator=models.MultiVectorComparator.MAX_SIM
+            ),
+            quantization_config=quantization_config(layout.quantization),
+            # search runs on the quantized copy, originals are read to rescore
+            on_disk=layout.quantization == QUANTIZATION_BINARY,
+        ),
+    }
+    if layout.pooled:
+        # one dense vector per chunk, HNSW shortlists candidates for MaxSim
+        ret[POOLED_VECTOR_NAME] = models.VectorParams(
+            size=layout.vector_size,
+            distance=models.Distance.COSINE,
+        )
+    return ret
+
+
+def point_vector(layout: CollectionLayout, multivector: np.ndarray) -> Any:
+    if not layout.named:
+        return multivector
+    ret = {MULTIVECTOR_NAME: multivector}
+    if layout.pooled:
+        ret[POOLED_VECTOR_NAME] = mean_pool(multivector)
+    return ret
+
+
+def point_multivector(layout: CollectionLayout, vector: Any) -> np.ndarray:
+    if layout.named:
+        vector = vector[MULTIVECTOR_NAME]
+    return np.asarray(vector, dtype=np.float32)
@@ -1,138 +1,637 @@
+from abc import abstractmethod
+from dataclasses import dataclass
 import logging
-from typing import Any, List
+import re
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 from PIL import Image
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from qdrant_client.conversions.common_types import Points
 from qdrant_client.http.exceptions import ApiException
 from qdrant_client.http.models.models import UpdateStatus
+from ..blobs.blob_store import create_blob_store, load_blob
+from ..utils.batching import BatchCoalescer
+from ..utils.cache import DiskCache, LruCache
+from ..utils.dates import timestamp_ms
 from ..utils.images import pil_to_bytes
+from ..utils.metrics import (
+    INDEX_EMBEDDINGS,
+    INDEX_PIPELINE_SECONDS,
+    STAGE_COLPALI,
+    STAGE_QDRANT,
+    request_timed,
+    timed,
+)
+from ..utils.strings import normalize_query
 
-from .colpali_client import ColpaliClient
+from .colpali_client import WIRE_FORMAT_BINARY, ColpaliClient
+from .chunk_embeddings import ChunkEmbeddings
+from .colpali_codec import decode_embeddings, encode_embeddings
+from .embedding_cache import EMBEDDING_CACHE_ENABLED, EmbeddingCache
+from .colpali_collection import (
+    MULTIVECTOR_NAME,
+    POOLED_VECTOR_NAME,
+    QUANTIZATION_BINARY,
+    QUANTIZATION_INT8,
+    QUANTIZATION_NONE,
+    CollectionLayout,
+    detect_layout,
+    point_vector,
+    vectors_config,
+)
+from .pooling import mean_pool, pool_tokens_batch
+from .similarity_maps import PatchGrid, render_similarity_map, similarity_map
 from ..classifier.classifier_service import DocIndexer
-from ..classifier.classifier_models import Document
+from ..classifier.classifier_models import Document, DocumentChunk
+from ..database import SessionLocal
+from .index_pipeline import PipelineStage, run_pipeline
 
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
 import os
 
 logger = logging.getLogger(__name__)
 
 COLLECTION_NAME = "colpali"
+# physical collections behind the COLLECTION_NAME alias, see collection_copy_name
+COLLECTION_COPY_RE = re.compile(rf"{re.escape(COLLECTION_NAME)}_\d+")
 BATCH_SIZE = int(os.environ["COLPALI_BATCH_SIZE"])
 
+# pipelined indexing: batches in flight between stages and workers per stage
+INDEX_QUEUE_SIZE = int(os.environ.get("INDEX_QUEUE_SIZE", "2"))
+INDEX_LOAD_CONCURRENCY = int(os.environ.get("INDEX_LOAD_CONCURRENCY", "1"))
+INDEX_EMBED_CONCURRENCY = int(os.environ.get("INDEX_EMBED_CONCURRENCY", "1"))
+INDEX_UPSERT_CONCURRENCY = int(os.environ.get("INDEX_UPSERT_CONCURRENCY", "2"))
+# images of concurrently indexed documents share ColPali batches, a batch that
+# is not full waits this long for more before it is sent
+INDEX_BATCH_MAX_WAIT_MS = float(os.environ.get("INDEX_BATCH_MAX_WAIT_MS", "100"))
+
+# patch vectors per page are reduced this many times by clustering, 1 keeps all
+POOL_FACTOR = float(os.environ.get("COLPALI_POOL_FACTOR", "1"))
+
 SEARCH_TIMEOUT = 60
 SEARCH_LIMIT = 10
 
+SEARCH_MODE_EXHAUSTIVE = "exhaustive"
+SEARCH_MODE_TWO_STAGE = "two_stage"
+# two_stage: pooled vector HNSW shortlist, then MaxSim rescoring of the shortlist
+SEARCH_MODE = os.environ.get("COLPALI_SEARCH_MODE", SEARCH_MODE_EXHAUSTIVE)
+SEARCH_SHORTLIST = int(os.environ.get("COLPALI_SEARCH_SHORTLIST", "200"))
+
+# quantization profile of new collections, see QUANTIZATION_PROFILES
+QUANTIZATION = os.environ.get("COLPALI_QUANTIZATION", QUANTIZATION_INT8)
+# candidates taken from the quantized index = limit * oversampling,
+# rescored with original vectors when rescore is on
+SEARCH_OVERSAMPLING = float(os.environ.get("COLPALI_SEARCH_OVERSAMPLING", "0")) or None
+SEARCH_RESCORE = os.environ.get("COLPALI_SEARCH_RESCORE", "true") == "true"
+DEFAULT_OVERSAMPLING = {QUANTIZATION_BINARY: 3.0}
+
+HTTP_TIMEOUT = float(os.environ.get("COLPALI_HTTP_TIMEOUT", "3600"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("COLPALI_HTTP_MAX_CONNECTIONS", "16"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("COLPALI_HTTP_MAX_KEEPALIVE", "8"))
+WIRE_FORMAT = os.environ.get("COLPALI_WIRE_FORMAT", WIRE_FORMAT_BINARY)
+WIRE_DTYPE = os.environ.get("COLPALI_WIRE_DTYPE", "float16")
+
+QDRANT_PREFER_GRPC = os.environ.get("VECTOR_DB_PREFER_GRPC", "false") == "true"
+
+# identifies embeddings space, change it when ColPali server switches the model
+MODEL_ID = os.environ.get("COLPALI_MODEL_ID", "colpali")
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "0")) or None
+QUERY_CACHE_DIR = os.environ.get("QUERY_CACHE_DIR")
+QUERY_CACHE_DISK_MAX_BYTES = int(
+    os.environ.get("QUERY_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+# concurrent searches share /process-queries calls, a batch that is not full
+# waits this long for more queries before it is sent
+QUERY_BATCH_SIZE = int(os.environ.get("QUERY_BATCH_SIZE", "16"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.environ.get("QUERY_BATCH_MAX_WAIT_MS", "5"))
+QUERY_BATCH_CONCURRENCY = int(os.environ.get("QUERY_BATCH_CONCURRENCY", "2"))
+
+
+def collection_copy_name() -> str:
+    return f"{COLLECTION_NAME}_{timestamp_ms()}"
+
 
-class ColpaliService(DocIndexer):
+@dataclass
+class EmbeddingInput:
+    embedding_id: int
+    image_hash: Optional[str]
+    # raw multivector from the embedding cache, else the image to embed
+    cached: Optional[np.ndarray] = None
+    image: Optional[bytes] = None
+
+
+# ColPali embeddings, query caching and the indexing pipeline,
+# subclasses only store and search the chunk multivectors
+class BaseColpaliService(DocIndexer):
     def __init__(self) -> None:
         super().__init__()
-        self.qdrant = QdrantClient(host=os.environ["VECTOR_DB_HOST"], port=6333)
-        self.colpali = ColpaliClient(base_url=os.environ["COLPALI_BASE_URL"])
-        self.__init_collection()
+        self.colpali = ColpaliClient(
+            base_url=os.environ["COLPALI_BASE_URL"],
+            timeout=HTTP_TIMEOUT,
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            wire_format=WIRE_FORMAT,
+            wire_dtype=WIRE_DTYPE,
+        )
+        self.blob_store = create_blob_store()
+        self.embeddings = ChunkEmbeddings()
+        self.embedding_cache = EmbeddingCache(self.blob_store)
+        self.image_batcher = BatchCoalescer[bytes, np.ndarray](
+            self.colpali.process_images,
+            max_batch=BATCH_SIZE,
+            max_wait=INDEX_BATCH_MAX_WAIT_MS / 1000,
+            concurrency=INDEX_EMBED_CONCURRENCY,
+            name="image batch",
+        )
+        self.query_batcher = BatchCoalescer[str, np.ndarray](
+            self.colpali.process_queries,
+            max_batch=QUERY_BATCH_SIZE,
+            max_wait=QUERY_BATCH_MAX_WAIT_MS / 1000,
+            concurrency=QUERY_BATCH_CONCURRENCY,
+            name="query batch",
+        )
+        self.query_cache = LruCache[str, np.ndarray](
+            max_items=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL
+        )
+        self.query_disk_cache = (
+            DiskCache(
+                QUERY_CACHE_DIR,
+                max_bytes=QUERY_CACHE_DISK_MAX_BYTES,
+                ttl=QUERY_CACHE_TTL,
+            )
+            if QUERY_CACHE_DIR
+            else None
+        )
 
-    def interpret(self, query: str, image: bytes) -> bytes:
-        return self.colpali.interpret(query=query, image=image)
+    @property
+    def model_id(self) -> str:
+        return MODEL_ID
 
-    def query(self, query: str) -> List[int]:
-        multivector_query = self.colpali.process_queries([query])[0]
+    @abstractmethod
+    async def init(self):
+        pass
 
-        search_result = self.qdrant.query_points(
-            collection_name=COLLECTION_NAME,
-            query=multivector_query,
-            limit=SEARCH_LIMIT,
-            timeout=SEARCH_TIMEOUT,
-        )
+    async def close(self):
+        await self.colpali.close()
 
-        return [int(point.id) for point in search_result.points]
+    # computed locally from the cached patch embeddings when there are some,
+    # then only the query is embedded instead of the whole image
+    async def interpret(
+        self, query: str, image: bytes, image_hash: Optional[str] = None
+    ) -> bytes:
+        if image_hash:
+            sim_map = (await self.similarity_maps(query, [image_hash]))[0]
+            if sim_map is not None:
+                return await run_in_threadpool(render_similarity_map, image, sim_map)
+        return await self.colpali.interpret(query=query, image=image)
 
-    def delete(self, doc: Document):
-        chunk_ids: List[models.ExtendedPointId] = [chunk.id for chunk in doc.chunks]
-        if not chunk_ids:
+    async def index(self, doc: Document):
+        embedding_ids = await run_in_threadpool(self.__assign_embeddings, doc)
+        if not embedding_ids:
+            logger.info(f"Indexed document {doc.id=}, all chunks already embedded")
             return
-        self.qdrant.delete(
-            collection_name=COLLECTION_NAME,
-            points_selector=models.PointIdsList(
-                points=chunk_ids,
+
+        async def load(batch_ids: List[int]):
+            return await run_in_threadpool(self.load_embedding_inputs, batch_ids)
+
+        cache_hits = 0
+
+        async def embed(batch: List[EmbeddingInput]):
+            nonlocal cache_hits
+            cache_hits += sum(1 for item in batch if item.cached is not None)
+            return await self.embed_inputs(batch)
+
+        # Vectors are only stored for the embeddings chunks of the document
+        # still reference, their rows stay locked until the points are sent.
+        # A delete of the document releases them either before, then they are
+        # skipped, or after, then it removes the points.
+        async def store(batch: List[Tuple[int, np.ndarray]]):
+            with SessionLocal() as db:
+                referenced = await run_in_threadpool(
+                    self.embeddings.lock_referenced,
+                    db,
+                    doc.id,
+                    [embedding_id for embedding_id, _ in batch],
+                )
+                batch = [item for item in batch if item[0] in referenced]
+                if batch:
+                    await self.store_embeddings(batch)
+                await run_in_threadpool(db.commit)
+
+        stats = await run_pipeline(
+            (
+                embedding_ids[i : i + BATCH_SIZE]
+                for i in range(0, len(embedding_ids), BATCH_SIZE)
             ),
+            [
+                PipelineStage("load", load, INDEX_LOAD_CONCURRENCY),
+                PipelineStage("embed", embed, INDEX_EMBED_CONCURRENCY),
+                PipelineStage("store", store, INDEX_UPSERT_CONCURRENCY),
+            ],
+            queue_size=INDEX_QUEUE_SIZE,
         )
+        with SessionLocal() as db:
+            referenced = await run_in_threadpool(
+                self.embeddings.lock_referenced, db, doc.id, embedding_ids
+            )
+            if referenced:
+                await self.index_done(doc, sorted(referenced))
+            await run_in_threadpool(self.embeddings.mark_stored, db, sorted(referenced))
+        if len(referenced) < len(embedding_ids):
+            logger.warning(f"Document {doc.id=} was deleted while being indexed")
+        logger.info(f"Indexed document {doc.id=} {cache_hits=} {stats}")
+        INDEX_EMBEDDINGS.labels("cache").inc(cache_hits)
+        INDEX_EMBEDDINGS.labels("colpali").inc(len(embedding_ids) - cache_hits)
+        for stage, busy_time in stats.busy_time.items():
+            INDEX_PIPELINE_SECONDS.labels(stage).observe(busy_time)
 
-    def index(self, doc: Document):
-
-        chunks = doc.chunks
-
-        for i in range(0, len(chunks), BATCH_SIZE):
-            chunks_batch = chunks[i : i + BATCH_SIZE]
-            image_chunk_ids: List[int] = []
-            images: List[bytes] = []
-            for chunk in chunks_batch:
-                image_chunk_ids.append(chunk.id)
-                images.append(chunk.image)
-
-            image_embeddings = self.colpali.process_images(images)
-
-            # prepare points for Qdrant
-            points = []
-            for j, multivector in enumerate(image_embeddings):
-                chunk_id = image_chunk_ids[j]
-                points.append(
-                    models.PointStruct(
-                        id=chunk_id,
-                        vector=multivector,  # This is now a list of vectors
-                        payload={},
-                    )
+    def release(self, db: Session, doc: Document) -> List[Tuple[int, Optional[str]]]:
+        return self.embeddings.release(db, doc)
+
+    async def delete_released(self, released: List[Tuple[int, Optional[str]]]):
+        if released:
+            await self.delete_embeddings([embedding_id for embedding_id, _ in released])
+            await run_in_threadpool(
+                self.__delete_cached,
+                [image_hash for _, image_hash in released if image_hash],
+            )
+
+    # (embedding_id, multivector) of the batch, cached raw embeddings are reused,
+    # the others computed by ColPali, in batches shared with other documents, and cached
+    async def embed_inputs(
+        self, batch: List[EmbeddingInput]
+    ) -> List[Tuple[int, np.ndarray]]:
+        missing = [item for item in batch if item.cached is None]
+        computed = {}
+        if missing:
+            image_embeddings = await self.image_batcher.submit_many(
+                [item.image for item in missing]
+            )
+            computed = {
+                item.embedding_id: multivector
+                for item, multivector in zip(missing, image_embeddings)
+            }
+            if EMBEDDING_CACHE_ENABLED:
+                await run_in_threadpool(
+                    self.__put_cached,
+                    [
+                        (item.image_hash, computed[item.embedding_id])
+                        for item in missing
+                        if item.image_hash
+                    ],
+                )
+        multivectors = [
+            item.cached if item.cached is not None else computed[item.embedding_id]
+            for item in batch
+        ]
+        multivectors = await self.pool_embeddings(multivectors)
+        return [
+            (item.embedding_id, multivector)
+            for item, multivector in zip(batch, multivectors)
+        ]
+
+    async def pool_embeddings(self, embeddings: List[np.ndarray]) -> List[np.ndarray]:
+        if POOL_FACTOR > 1:
+            return await run_in_threadpool(pool_tokens_batch, embeddings, POOL_FACTOR)
+        return embeddings
+
+    # writes (embedding_id, multivector) pairs of one batch,
+    # the embedding id is the id of the vector in the index
+    @abstractmethod
+    async def store_embeddings(self, batch: List[Tuple[int, np.ndarray]]):
+        pass
+
+    # called once all batches of the document went through store
+    async def index_done(self, doc: Document, embedding_ids: List[int]):
+        pass
+
+    # removes embeddings no chunk references anymore
+    @abstractmethod
+    async def delete_embeddings(self, embedding_ids: List[int]):
+        pass
+
+    # cached embedding or else the image of one of the chunks sharing it,
+    # own session per batch, loaders may run in parallel threads
+    def load_embedding_inputs(self, embedding_ids: List[int]) -> List[EmbeddingInput]:
+        with SessionLocal() as db:
+            rows = (
+                db.query(
+                    DocumentChunk.embedding_id,
+                    DocumentChunk.image_hash,
+                    DocumentChunk.image,
+                )
+                .filter(DocumentChunk.embedding_id.in_(embedding_ids))
+                .distinct(DocumentChunk.embedding_id)
+                .order_by(DocumentChunk.embedding_id.asc(), DocumentChunk.id.asc())
+                .all()
+            )
+            cached = (
+                self.embedding_cache.get_many(
+                    db,
+                    (image_hash for _, image_hash, _ in rows if image_hash),
+                    MODEL_ID,
+                )
+                if EMBEDDING_CACHE_ENABLED
+                else {}
+            )
+        ret = []
+        for embedding_id, image_hash, image in rows:
+            item = EmbeddingInput(embedding_id=embedding_id, image_hash=image_hash)
+            if image_hash in cached:
+                item.cached = cached[image_hash]
+            else:
+                item.image = load_blob(self.blob_store, image_hash, image)
+            ret.append(item)
+        return ret
+
+    def __assign_embeddings(self, doc: Document) -> List[int]:
+        with SessionLocal() as db:
+            return self.embeddings.assign(db, doc)
+
+    def __get_patches(
+        self, image_hashes: List[str]
+    ) -> Dict[str, Tuple[np.ndarray, PatchGrid]]:
+        with SessionLocal() as db:
+            return self.embedding_cache.get_patches(db, image_hashes, MODEL_ID)
+
+    def __put_cached(self, items: List[Tuple[str, np.ndarray]]):
+        with SessionLocal() as db:
+            self.embedding_cache.put_many(db, items, MODEL_ID)
+
+    def __delete_cached(self, image_hashes: List[str]):
+        with SessionLocal() as db:
+            self.embedding_cache.delete_for_images(db, image_hashes)
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        query = normalize_query(query)
+        cache_key = f"{MODEL_ID}:{query}"
+
+        ret = self.query_cache.get(cache_key)
+        if ret is not None:
+            return ret
+
+        if self.query_disk_cache:
+            data = await run_in_threadpool(self.query_disk_cache.get, cache_key)
+            if data is not None:
+                ret = decode_embeddings(data)[0]
+                self.query_cache.put(cache_key, ret)
+                return ret
+
+        # the ColPali call itself is timed by the batch shared with others
+        with request_timed(STAGE_COLPALI):
+            ret = await self.query_batcher.submit(query)
+        self.query_cache.put(cache_key, ret)
+        if self.query_disk_cache:
+            await run_in_threadpool(
+                self.query_disk_cache.put,
+                cache_key,
+                encode_embeddings([ret], dtype="float32"),
+            )
+        return ret
+
+    # from the raw embeddings and patch grids in the embedding cache and the
+    # cached query embedding, no image goes through ColPali
+    async def similarity_maps(
+        self, query: str, image_hashes: List[Optional[str]]
+    ) -> List[Optional[np.ndarray]]:
+        hashes = [image_hash for image_hash in image_hashes if image_hash]
+        if not hashes or not EMBEDDING_CACHE_ENABLED:
+            return [None] * len(image_hashes)
+        cached = await run_in_threadpool(self.__get_patches, hashes)
+        if not cached:
+            return [None] * len(image_hashes)
+        query_embedding = await self.embed_query(query)
+        return [
+            (
+                similarity_map(query_embedding, *cached[image_hash])
+                if image_hash in cached
+                else None
+            )
+            for image_hash in image_hashes
+        ]
+
+    def query_cache_stats(self):
+        ret = {"memory": self.query_cache.stats.as_dict()}
+        if self.query_disk_cache:
+            ret["disk"] = self.query_disk_cache.stats.as_dict()
+        return ret
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "query_cache": self.query_cache_stats(),
+            "query_batches": self.query_batcher.stats.as_dict(),
+            "image_batches": self.image_batcher.stats.as_dict(),
+        }
+
+    async def detect_vector_size(self):
+        sample_image = Image.new(mode="RGB", size=(64, 64))
+        sample_embedding = await self.colpali.process_images(
+            [pil_to_bytes(sample_image)]
+        )
+        return sample_embedding[0].shape[1]
+
+
+class ColpaliService(BaseColpaliService):
+    def __init__(self) -> None:
+        super().__init__()
+        # gRPC moves vectors as packed floats instead of JSON arrays
+        self.qdrant = AsyncQdrantClient(
+            host=os.environ["VECTOR_DB_HOST"],
+            port=6333,
+            grpc_port=6334,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+        )
+        # detected on init
+        self.layout: CollectionLayout
+
+    async def init(self):
+        await self.__init_collection()
+
+    async def close(self):
+        await super().close()
+        await self.qdrant.close()
+
+    async def query(self, query: str) -> List[int]:
+        return await self.search(query, mode=SEARCH_MODE)
+
+    async def search(
+        self,
+        query: str,
+        mode: str = SEARCH_MODE_EXHAUSTIVE,
+        limit: int = SEARCH_LIMIT,
+        shortlist: int = SEARCH_SHORTLIST,
+        oversampling: Optional[float] = SEARCH_OVERSAMPLING,
+        rescore: bool = SEARCH_RESCORE,
+    ) -> List[int]:
+        multivector_query = await self.embed_query(query)
+        search_params = self.search_params(oversampling=oversampling, rescore=rescore)
+
+        if mode == SEARCH_MODE_TWO_STAGE and not self.layout.pooled:
+            logger.warning(
+                f"{COLLECTION_NAME=} has no pooled vectors, rebuild it for two stage search"
+            )
+            mode = SEARCH_MODE_EXHAUSTIVE
+
+        if mode == SEARCH_MODE_TWO_STAGE:
+            with timed(STAGE_QDRANT, "query_points"):
+                search_result = await self.qdrant.query_points(
+                    collection_name=COLLECTION_NAME,
+                    prefetch=models.Prefetch(
+                        query=mean_pool(multivector_query).tolist(),
+                        using=POOLED_VECTOR_NAME,
+                        limit=max(shortlist, limit),
+                    ),
+                    query=multivector_query,
+                    using=MULTIVECTOR_NAME,
+                    search_params=search_params,
+                    limit=limit,
+                    timeout=SEARCH_TIMEOUT,
+                )
+        else:
+            with timed(STAGE_QDRANT, "query_points"):
+                search_result = await self.qdrant.query_points(
+                    collection_name=COLLECTION_NAME,
+                    query=multivector_query,
+                    using=MULTIVECTOR_NAME if self.layout.named else None,
+                    search_params=search_params,
+                    limit=limit,
+                    timeout=SEARCH_TIMEOUT,
                 )
 
-            self.__qdrant_upsert(points)
+        return [int(point.id) for point in search_result.points]
+
+    def search_params(
+        self, oversampling: Optional[float], rescore: bool
+    ) -> Optional[models.SearchParams]:
+        if self.layout.quantization == QUANTIZATION_NONE:
+            return None
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(
+                rescore=rescore,
+                oversampling=oversampling
+                or DEFAULT_OVERSAMPLING.get(self.layout.quantization),
+            )
+        )
 
-    def __init_collection(self):
-        if self.qdrant.collection_exists(COLLECTION_NAME):
-            logger.info(f"Found QDrant {COLLECTION_NAME=}")
+    async def delete_embeddings(self, embedding_ids: List[int]):
+        points: List[models.ExtendedPointId] = list(embedding_ids)
+        with timed(STAGE_QDRANT, "delete"):
+            await self.qdrant.delete(
+                collection_name=COLLECTION_NAME,
+                points_selector=models.PointIdsList(points=points),
+            )
+
+    async def store_embeddings(self, batch: List[Tuple[int, np.ndarray]]):
+        await self.__qdrant_upsert(
+            [
+                models.PointStruct(
+                    id=embedding_id,
+                    vector=point_vector(self.layout, multivector),
+                    payload={"pool_factor": POOL_FACTOR},
+                )
+                for embedding_id, multivector in batch
+            ],
+            wait=False,
+        )
+
+    # barrier: returns once all previous updates of these points are applied
+    async def index_done(self, doc: Document, embedding_ids: List[int]):
+        with timed(STAGE_QDRANT, "set_payload"):
+            await self.qdrant.set_payload(
+                collection_name=COLLECTION_NAME,
+                # document that stored the point, later ones may share it
+                payload={"doc_id": doc.id},
+                points=embedding_ids,
+                wait=True,
+            )
+
+    async def __init_collection(self):
+        collection_name = await self.resolve_collection()
+        if collection_name:
+            info = await self.qdrant.get_collection(collection_name)
+            self.layout = detect_layout(info)
+            logger.info(f"Found QDrant {COLLECTION_NAME=} {self.layout=}")
+            if self.layout.quantization != QUANTIZATION:
+                logger.warning(
+                    f"{COLLECTION_NAME=} uses {self.layout.quantization} quantization "
+                    f"instead of {QUANTIZATION=}, run rebuild_collection to migrate"
+                )
             return
 
-        vector_size = self.__detect_vector_size()
+        self.layout = CollectionLayout(
+            vector_size=await self.detect_vector_size(), quantization=QUANTIZATION
+        )
+        # collections are addressed through the alias, so rebuilds can swap them
+        collection_name = collection_copy_name()
+        await self.create_collection(collection_name, self.layout)
+        await self.create_alias(collection_name)
+
+    # physical collection behind COLLECTION_NAME, None when not created yet
+    async def resolve_collection(self) -> Optional[str]:
+        aliases = await self.qdrant.get_aliases()
+        for alias in aliases.aliases:
+            if alias.alias_name == COLLECTION_NAME:
+                return alias.collection_name
+        if await self.qdrant.collection_exists(COLLECTION_NAME):
+            return COLLECTION_NAME
+        # a rebuild dropped the legacy collection, which held the alias name,
+        # and stopped before creating the alias: finish the switch to its copy
+        collections = await self.qdrant.get_collections()
+        copies = [
+            collection.name
+            for collection in collections.collections
+            if COLLECTION_COPY_RE.fullmatch(collection.name)
+        ]
+        if copies:
+            collection_name = max(copies, key=lambda name: int(name.rpartition("_")[2]))
+            logger.warning(f"Recovering {COLLECTION_NAME} alias to {collection_name=}")
+            await self.create_alias(collection_name)
+            return collection_name
+        return None
 
-        logger.info(f"Creating QDrant collection {COLLECTION_NAME=} {vector_size=}")
-        self.qdrant.create_collection(
-            collection_name=COLLECTION_NAME,
+    async def create_alias(self, collection_name: str):
+        await self.qdrant.update_collection_aliases(
+            change_aliases_operations=[
+                models.CreateAliasOperation(
+                    create_alias=models.CreateAlias(
+                        collection_name=collection_name, alias_name=COLLECTION_NAME
+                    )
+                )
+            ]
+        )
+
+    async def create_collection(self, collection_name: str, layout: CollectionLayout):
+        logger.info(f"Creating QDrant collection {collection_name=} {layout=}")
+        await self.qdrant.create_collection(
+            collection_name=collection_name,
             # store the payload on disk
             on_disk_payload=True,
             # it can be useful to swith this off when doing a bulk upload
             # and then manually trigger the indexing once the upload is done
             optimizers_config=models.OptimizersConfigDiff(indexing_threshold=100),
-            vectors_config=models.VectorParams(
-                size=vector_size,
-                distance=models.Distance.COSINE,
-                multivector_config=models.MultiVectorConfig(
-                    comparator=models.MultiVectorComparator.MAX_SIM
-                ),
-                quantization_config=models.ScalarQuantization(
-                    scalar=models.ScalarQuantizationConfig(
-                        type=models.ScalarType.INT8,
-                        quantile=0.99,
-                        always_ram=True,
-                    ),
-                ),
-            ),
+            vectors_config=vectors_config(layout),
         )
 
-    def __detect_vector_size(self):
-        sample_image = Image.new(mode="RGB", size=(64, 64))
-        sample_embedding = self.colpali.process_images([pil_to_bytes(sample_image)])
-        return len(sample_embedding[0][0])
-
-    def __qdrant_upsert(self, points: Points):
-        for n in range(3):
-            try:
-                res = self.qdrant.upsert(
-                    collection_name=COLLECTION_NAME,
-                    points=points,
-                    wait=True,
-                )
-                if res.status != UpdateStatus.COMPLETED:
-                    raise RuntimeError("Qdrant operation not completed")
-                else:
-                    return
-            except ApiException:
-                logger.exception(f"Attempt {n=} failed")
-        raise RuntimeError("Request to Qdrant failed in all attempts")
+    async def __qdrant_upsert(self, points: Points, wait: bool = True):
+        expected_status = UpdateStatus.COMPLETED if wait else UpdateStatus.ACKNOWLEDGED
+        with timed(STAGE_QDRANT, "upsert"):
+            for n in range(3):
+                try:
+                    res = await self.qdrant.upsert(
+                        collection_name=COLLECTION_NAME,
+                        points=points,
+                        wait=wait,
+                    )
+                    if res.status not in (expected_status, UpdateStatus.COMPLETED):
+                        raise RuntimeError("Qdrant operation not completed")
+                    else:
+                        return
+                except ApiException:
+                    logger.exception(f"Attempt {n=} failed")
+            raise RuntimeError("Request to Qdrant failed in all attempts")
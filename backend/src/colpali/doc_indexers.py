@@ -0,0 +1,22 @@
+import os
+
+from .colpali_service import BaseColpaliService, ColpaliService
+from .local_colpali_service import LocalColpaliService
+
+DOC_INDEXER_QDRANT = "qdrant"
+DOC_INDEXER_LOCAL = "local"
+# local runs the whole search path in-process, without Qdrant
+DOC_INDEXER = os.environ.get("DOC_INDEXER", DOC_INDEXER_QDRANT)
+
+DOC_INDEXERS = {
+    DOC_INDEXER_QDRANT: ColpaliService,
+    DOC_INDEXER_LOCAL: LocalColpaliService,
+}
+
+
+def create_doc_indexer() -> BaseColpaliService:
+    if DOC_INDEXER not in DOC_INDEXERS:
+        raise ValueError(
+            f"Unknown {DOC_INDEXER=}, expected one of {', '.join(DOC_INDEXERS)}"
+        )
+    return DOC_INDEXERS[DOC_INDEXER]()
@@ -0,0 +1,129 @@
+import logging
+import os
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from ..blobs.blob_store import BlobNotFoundError, BlobStore
+from ..classifier.classifier_models import ImageEmbedding
+from .colpali_codec import decode_embeddings, encode_embeddings
+from .similarity_maps import PATCH_GRID, PatchGrid
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE", "true") == "true"
+
+
+# Durable cache of ColPali image embeddings keyed by (image hash, model id).
+# Raw model output before pooling, float16 in the blob store, so the vector
+# index can be rebuilt with any layout or pool factor without the GPU,
+# and with the patch grid, so similarity maps need no image forward pass.
+class EmbeddingCache:
+    def __init__(self, blob_store: BlobStore) -> None:
+        self.blob_store = blob_store
+
+    def get_many(
+        self, db: Session, image_hashes: Iterable[str], model_id: str
+    ) -> Dict[str, np.ndarray]:
+        return {
+            image_hash: embedding
+            for image_hash, (embedding, _) in self.get_patches(
+                db, image_hashes, model_id
+            ).items()
+        }
+
+    # embeddings with the layout of their patch tokens
+    def get_patches(
+        self, db: Session, image_hashes: Iterable[str], model_id: str
+    ) -> Dict[str, Tuple[np.ndarray, PatchGrid]]:
+        rows = (
+            db.query(
+                ImageEmbedding.image_hash,
+                ImageEmbedding.blob_hash,
+                ImageEmbedding.patch_rows,
+                ImageEmbedding.patch_cols,
+                ImageEmbedding.patch_offset,
+            )
+            .filter(
+                ImageEmbedding.image_hash.in_(set(image_hashes)),
+                ImageEmbedding.model_id == model_id,
+            )
+            .all()
+        )
+        ret = {}
+        for image_hash, blob_hash, patch_rows, patch_cols, patch_offset in rows:
+            try:
+                embedding = decode_embeddings(self.blob_store.get(blob_hash))[0]
+            except BlobNotFoundError:
+                # embedded again and put back
+                logger.warning(f"Cached embedding of {image_hash=} lost its blob")
+                continue
+            grid = (
+                PatchGrid(rows=patch_rows, cols=patch_cols, offset=patch_offset or 0)
+                if patch_rows and patch_cols
+                else PATCH_GRID
+            )
+            ret[image_hash] = (embedding, grid)
+        return ret
+
+    def put_many(
+        self,
+        db: Session,
+        items: List[Tuple[str, np.ndarray]],
+        model_id: str,
+        grid: PatchGrid = PATCH_GRID,
+    ):
+        if not items:
+            return
+        values = {
+            image_hash: self.blob_store.put(
+                encode_embeddings([multivector], dtype="float16")
+            )
+            for image_hash, multivector in items
+        }
+        stmt = insert(ImageEmbedding).values(
+            [
+                {
+                    "image_hash": image_hash,
+                    "model_id": model_id,
+                    "blob_hash": blob_hash,
+                    "patch_rows": grid.rows,
+                    "patch_cols": grid.cols,
+                    "patch_offset": grid.offset,
+                }
+                for image_hash, blob_hash in sorted(values.items())
+            ]
+        )
+        # replaces entries whose blob was lost
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["image_hash", "model_id"],
+                set_={
+                    "blob_hash": stmt.excluded.blob_hash,
+                    "patch_rows": stmt.excluded.patch_rows,
+                    "patch_cols": stmt.excluded.patch_cols,
+                    "patch_offset": stmt.excluded.patch_offset,
+                },
+            )
+        )
+        db.commit()
+
+    # all models, nothing references the images anymore
+    def delete_for_images(self, db: Session, image_hashes: Iterable[str]):
+        image_hashes = list(image_hashes)
+        if not image_hashes:
+            return
+        blob_hashes = [
+            blob_hash
+            for (blob_hash,) in db.query(ImageEmbedding.blob_hash).filter(
+                ImageEmbedding.image_hash.in_(image_hashes)
+            )
+        ]
+        db.query(ImageEmbedding).filter(
+            ImageEmbedding.image_hash.in_(image_hashes)
+        ).delete()
+        db.commit()
+        for blob_hash in blob_hashes:
+            self.blob_store.delete(blob_hash)
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple
+
+
+class PipelineStage(NamedTuple):
+    name: str
+    handler: Callable[[Any], Awaitable[Any]]
+    concurrency: int = 1
+
+
+class PipelineStats:
+    def __init__(self, stage_names: List[str]) -> None:
+        self.items = 0
+        self.wall_time = 0.0
+        self.busy_time: Dict[str, float] = {name: 0.0 for name in stage_names}
+
+    @property
+    def overlap_ratio(self) -> float:
+        # 1.0 means stages ran strictly one after another,
+        # N means N stages were busy at the same time on average
+        if self.wall_time <= 0:
+            return 0.0
+        return sum(self.busy_time.values()) / self.wall_time
+
+    def __str__(self) -> str:
+        busy = " ".join(f"{name}={t:.2f}s" for name, t in self.busy_time.items())
+        return (
+            f"items={self.items} wall={self.wall_time:.2f}s {busy} "
+            f"overlap={self.overlap_ratio:.2f}"
+        )
+
+
+_DONE = object()
+
+
+# Runs items through stages connected by bounded queues, so slow stages
+# apply backpressure instead of buffering the whole input in memory.
+async def run_pipeline(
+    items: Iterable[Any], stages: List[PipelineStage], queue_size: int = 2
+) -> PipelineStats:
+    stats = PipelineStats([stage.name for stage in stages])
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+            stats.items += 1
+        for _ in range(stages[0].concurrency):
+            await queues[0].put(_DONE)
+
+    async def work(idx: int, stage: PipelineStage):
+        in_queue = queues[idx]
+        out_queue = queues[idx + 1] if idx + 1 < len(stages) else None
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                return
+            started_at = time.perf_counter()
+            result = await stage.handler(item)
+            stats.busy_time[stage.name] += time.perf_counter() - started_at
+            if out_queue is not None:
+                await out_queue.put(result)
+
+    async def run_stage(idx: int, stage: PipelineStage):
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(stage.concurrency):
+                tg.create_task(work(idx, stage))
+        # all workers of the stage are finished, close the next one
+        if idx + 1 < len(stages):
+            for _ in range(stages[idx + 1].concurrency):
+                await queues[idx + 1].put(_DONE)
+
+    started_at = time.perf_counter()
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(feed())
+        for idx, stage in enumerate(stages):
+            tg.create_task(run_stage(idx, stage))
+    stats.wall_time = time.perf_counter() - started_at
+    return stats
@@ -0,0 +1,70 @@
+import logging
+import os
+from typing import List, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from .colpali_service import SEARCH_LIMIT, BaseColpaliService
+from .local_store import MultivectorStore
+
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "data/local-index")
+LOCAL_INDEX_THREADS = int(
+    os.environ.get("LOCAL_INDEX_THREADS", str(os.cpu_count() or 1))
+)
+# arena rows scored by one matmul
+LOCAL_INDEX_BLOCK_ROWS = int(os.environ.get("LOCAL_INDEX_BLOCK_ROWS", "32768"))
+# share of dead rows in the arena that triggers compaction after a delete
+LOCAL_INDEX_COMPACT_RATIO = float(os.environ.get("LOCAL_INDEX_COMPACT_RATIO", "0.5"))
+
+
+# In-process exact MaxSim over a memory-mapped store, no vector database needed.
+# Meant for small single node deployments and as the reference scorer for
+# recall measurements of the Qdrant search modes.
+class LocalColpaliService(BaseColpaliService):
+    def __init__(self) -> None:
+        super().__init__()
+        # opened on init
+        self.store: MultivectorStore
+
+    async def init(self):
+        meta = MultivectorStore.read_meta(LOCAL_INDEX_DIR)
+        dim = meta["dim"] if meta else await self.detect_vector_size()
+        self.store = MultivectorStore(
+            LOCAL_INDEX_DIR,
+            dim=dim,
+            block_rows=LOCAL_INDEX_BLOCK_ROWS,
+            threads=LOCAL_INDEX_THREADS,
+        )
+        logger.info(
+            f"Opened local index {LOCAL_INDEX_DIR=} {dim=} chunks={len(self.store)}"
+        )
+
+    async def close(self):
+        await super().close()
+        self.store.close()
+
+    async def query(self, query: str) -> List[int]:
+        return await self.search(query)
+
+    async def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[int]:
+        multivector_query = await self.embed_query(query)
+        results = await run_in_threadpool(self.store.search, multivector_query, limit)
+        return [embedding_id for embedding_id, _ in results]
+
+    async def delete_embeddings(self, embedding_ids: List[int]):
+        await run_in_threadpool(self.__delete, embedding_ids)
+
+    async def store_embeddings(self, batch: List[Tuple[int, np.ndarray]]):
+        await run_in_threadpool(self.store.append, batch)
+
+    def __delete(self, embedding_ids: List[int]):
+        self.store.delete(embedding_ids)
+        total_rows = self.store.total_rows
+        if (
+            total_rows
+            and 1 - self.store.live_rows / total_rows > LOCAL_INDEX_COMPACT_RATIO
+        ):
+            self.store.compact()
@@ -0,0 +1,352 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .maxsim import maxsim_segments
+from .pooling import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+VECTORS_DTYPE = np.float16
+# offsets index record: chunk id, first arena row, rows (0 marks a delete)
+INDEX_RECORD_DTYPE = np.dtype(
+    [("chunk_id", "<i8"), ("offset", "<i8"), ("tokens", "<i8")]
+)
+# rows of arena segments with no live chunk, i.e. deleted or replaced
+DEAD_CHUNK_ID = -1
+
+
+class StoreEntry(NamedTuple):
+    offset: int
+    tokens: int
+
+
+class ScoreBlock(NamedTuple):
+    start: int
+    end: int
+    # segment starts relative to start
+    starts: np.ndarray
+    chunk_ids: np.ndarray
+
+
+# Chunk multivectors in one append-only float16 arena, memory mapped for search.
+# The offsets index is an append-only log of records, deletes are records with
+# no rows and the last record of a chunk wins. Several processes can share the
+# directory: writers serialize on a file lock, readers pick up appended records
+# on every search. compact() writes a new generation of both files without the
+# dead rows, meta.json points to the current one.
+class MultivectorStore:
+    def __init__(
+        self,
+        path: str,
+        dim: int,
+        block_rows: int = 32768,
+        threads: Optional[int] = None,
+    ) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.block_rows = block_rows
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="maxsim"
+        )
+        self.__lock = threading.RLock()
+
+        with self.__file_lock():
+            meta = self.read_meta(path)
+            if meta is None:
+                meta = {"dim": dim, "generation": 0}
+                self.__vectors_file(0).touch()
+                self.__index_file(0).touch()
+                self.__write_meta(meta)
+        if meta["dim"] != dim:
+            raise ValueError(
+                f"Store {path=} holds {meta['dim']} dim vectors, not {dim}"
+            )
+        self.dim = dim
+
+        self.__generation = -1
+        self.__entries: Dict[int, StoreEntry] = {}
+        self.__index_pos = 0
+        self.__arena_rows = 0
+        self.__vectors: Optional[np.ndarray] = None
+        self.__blocks: Optional[List[ScoreBlock]] = None
+        self.refresh()
+
+    @staticmethod
+    def read_meta(path: str) -> Optional[dict]:
+        try:
+            return json.loads((Path(path) / "meta.json").read_text())
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def total_rows(self) -> int:
+        return self.__arena_rows
+
+    @property
+    def live_rows(self) -> int:
+        return sum(entry.tokens for entry in self.__entries.values())
+
+    def append(self, items: Iterable[Tuple[int, np.ndarray]]):
+        # normalized, so dot products are cosine similarities like in Qdrant
+        items = [
+            (chunk_id, normalize_rows(np.asarray(mv, dtype=np.float32)))
+            for chunk_id, mv in items
+            if len(mv) > 0
+        ]
+        if not items:
+            return
+        with self.__lock, self.__file_lock():
+            generation = self.read_meta(self.path)["generation"]
+            row_bytes = self.dim * np.dtype(VECTORS_DTYPE).itemsize
+            records = np.zeros(len(items), dtype=INDEX_RECORD_DTYPE)
+            with open(self.__vectors_file(generation), "ab") as f:
+                size = os.fstat(f.fileno()).st_size
+                offset = size // row_bytes
+                if size % row_bytes:
+                    # partial rows of an interrupted append
+                    f.truncate(offset * row_bytes)
+                for i, (chunk_id, mv) in enumerate(items):
+                    f.write(mv.astype(VECTORS_DTYPE).tobytes())
+                    records[i] = (chunk_id, offset, len(mv))
+                    offset += len(mv)
+                f.flush()
+                # rows must be durable before the index points to them
+                os.fsync(f.fileno())
+            self.__append_records(generation, records)
+        self.refresh()
+
+    def delete(self, chunk_ids: Sequence[int]):
+        with self.__lock, self.__file_lock():
+            self.refresh()
+            chunk_ids = [
+                chunk_id for chunk_id in chunk_ids if chunk_id in self.__entries
+            ]
+            if not chunk_ids:
+                return
+            records = np.zeros(len(chunk_ids), dtype=INDEX_RECORD_DTYPE)
+            records["chunk_id"] = chunk_ids
+            self.__append_records(self.__generation, records)
+        self.refresh()
+
+    def get(self, chunk_id: int) -> Optional[np.ndarray]:
+        self.refresh()
+        with self.__lock:
+            entry = self.__entries.get(chunk_id)
+            if entry is None or self.__vectors is None:
+                return None
+            return np.asarray(
+                self.__vectors[entry.offset : entry.offset + entry.tokens],
+                dtype=np.float32,
+            )
+
+    # exact MaxSim over all stored chunks, best first
+    def search(self, query: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        self.refresh()
+        with self.__lock:
+            vectors = self.__vectors
+            blocks = self.__score_blocks()
+        if vectors is None or not blocks:
+            return []
+
+        query = normalize_rows(np.asarray(query, dtype=np.float32))
+        # numpy releases the GIL in matmul, blocks are scored in parallel
+        scores = np.concatenate(
+            list(
+                self.executor.map(
+                    lambda block: maxsim_segments(
+                        query, vectors[block.start : block.end], block.starts
+                    ),
+                    blocks,
+                )
+            )
+        )
+        chunk_ids = np.concatenate([block.chunk_ids for block in blocks])
+        scores[chunk_ids == DEAD_CHUNK_ID] = -np.inf
+
+        limit = min(limit, int(np.count_nonzero(chunk_ids != DEAD_CHUNK_ID)))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(chunk_ids[i]), float(scores[i])) for i in top]
+
+    # loads index records appended since the last call, by any process
+    def refresh(self):
+        with self.__lock:
+            while True:
+                generation = self.read_meta(self.path)["generation"]
+                if generation != self.__generation:
+                    self.__generation = generation
+                    self.__entries = {}
+                    self.__index_pos = 0
+                    self.__arena_rows = 0
+                    self.__vectors = None
+                    self.__blocks = None
+                try:
+                    self.__read_records(generation)
+                    break
+                except FileNotFoundError:
+                    # compacted in the meantime, reload the new generation
+                    if self.read_meta(self.path)["generation"] == generation:
+                        raise
+            self.__map_vectors(generation)
+
+    # rewrites the arena without dead rows
+    def compact(self):
+        with self.__lock, self.__file_lock():
+            self.refresh()
+            generation = self.__generation + 1
+            entries = sorted(self.__entries.items(), key=lambda item: item[1].offset)
+            records = np.zeros(len(entries), dtype=INDEX_RECORD_DTYPE)
+            offset = 0
+            with open(self.__vectors_file(generation), "wb") as f:
+                for i, (chunk_id, entry) in enumerate(entries):
+                    assert self.__vectors is not None
+                    f.write(
+                        np.ascontiguousarray(
+                            self.__vectors[entry.offset : entry.offset + entry.tokens]
+                        ).tobytes()
+                    )
+                    records[i] = (chunk_id, offset, entry.tokens)
+                    offset += entry.tokens
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.__index_file(generation), "wb") as f:
+                f.write(records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.__write_meta({"dim": self.dim, "generation": generation})
+            logger.info(
+                f"Compacted {self.path=} {generation=} "
+                f"rows={self.total_rows}->{offset}"
+            )
+            for file in (
+                self.__vectors_file(generation - 1),
+                self.__index_file(generation - 1),
+            ):
+                # readers keep their mappings of the old arena until they refresh
+                file.unlink(missing_ok=True)
+        self.refresh()
+
+    def __read_records(self, generation: int):
+        with open(self.__index_file(generation), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # a record being written by another process is read next time
+            count = (size - self.__index_pos) // INDEX_RECORD_DTYPE.itemsize
+            if count <= 0:
+                return
+            f.seek(self.__index_pos)
+            records = np.frombuffer(
+                f.read(count * INDEX_RECORD_DTYPE.itemsize), dtype=INDEX_RECORD_DTYPE
+            )
+        self.__index_pos += count * INDEX_RECORD_DTYPE.itemsize
+        for chunk_id, offset, tokens in records.tolist():
+            if tokens > 0:
+                self.__entries[chunk_id] = StoreEntry(offset, tokens)
+                self.__arena_rows = max(self.__arena_rows, offset + tokens)
+            else:
+                self.__entries.pop(chunk_id, None)
+        self.__blocks = None
+
+    def __map_vectors(self, generation: int):
+        rows = self.__arena_rows
+        if rows == 0:
+            self.__vectors = None
+        elif self.__vectors is None or self.__vectors.shape[0] < rows:
+            self.__vectors = np.memmap(
+                self.__vectors_file(generation),
+                dtype=VECTORS_DTYPE,
+                mode="r",
+                shape=(rows, self.dim),
+            )
+
+    # Splits the arena into segments of back to back rows, live chunks and the
+    # dead rows between them, grouped into blocks of about block_rows rows
+    def __score_blocks(self) -> List[ScoreBlock]:
+        if self.__blocks is not None:
+            return self.__blocks
+
+        segments: List[Tuple[int, int]] = []
+        position = 0
+        for chunk_id, entry in sorted(
+            self.__entries.items(), key=lambda item: item[1].offset
+        ):
+            if entry.offset > position:
+                segments.append((DEAD_CHUNK_ID, position))
+            segments.append((chunk_id, entry.offset))
+            position = entry.offset + entry.tokens
+
+        blocks = []
+        block_start = 0
+        while block_start < len(segments):
+            start = segments[block_start][1]
+            block_end = block_start + 1
+            while (
+                block_end < len(segments)
+                and segments[block_end][1] - start < self.block_rows
+            ):
+                block_end += 1
+            end = segments[block_end][1] if block_end < len(segments) else position
+            blocks.append(
+                ScoreBlock(
+                    start=start,
+                    end=end,
+                    starts=np.array(
+                        [
+                            offset - start
+                            for _, offset in segments[block_start:block_end]
+                        ],
+                        dtype=np.int64,
+                    ),
+                    chunk_ids=np.array(
+                        [chunk_id for chunk_id, _ in segments[block_start:block_end]],
+                        dtype=np.int64,
+                    ),
+                )
+            )
+            block_start = block_end
+        self.__blocks = blocks
+        return blocks
+
+    def __append_records(self, generation: int, records: np.ndarray):
+        with open(self.__index_file(generation), "ab") as f:
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __write_meta(self, meta: dict):
+        file = self.path / "meta.json"
+        tmp_file = file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(meta))
+        os.replace(tmp_file, file)
+
+    # serializes writers of all processes
+    @contextmanager
+    def __file_lock(self):
+        with open(self.path / "lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __vectors_file(self, generation: int) -> Path:
+        return self.path / f"vectors-{generation}.f16"
+
+    def __index_file(self, generation: int) -> Path:
+        return self.path / f"index-{generation}.bin"
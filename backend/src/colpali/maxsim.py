@@ -0,0 +1,24 @@
+from typing import Sequence
+
+import numpy as np
+
+
+# Late interaction score: for every query token the best matching document
+# token, summed over query tokens. Same as Qdrant MAX_SIM over dot products
+# of normalized vectors.
+def maxsim_score(query: np.ndarray, multivector: np.ndarray) -> float:
+    return float((query @ multivector.T).max(axis=1).sum())
+
+
+def maxsim_scores(query: np.ndarray, multivectors: Sequence[np.ndarray]) -> np.ndarray:
+    return np.array([maxsim_score(query, mv) for mv in multivectors], dtype=np.float32)
+
+
+# MaxSim against many documents stored back to back in one array,
+# document i owns rows starts[i]:starts[i + 1] (the last one up to the end).
+# One matmul for all of them instead of one per document.
+def maxsim_segments(
+    query: np.ndarray, vectors: np.ndarray, starts: np.ndarray
+) -> np.ndarray:
+    similarities = query @ np.asarray(vectors, dtype=np.float32).T
+    return np.maximum.reduceat(similarities, starts, axis=1).sum(axis=0)
@@ -0,0 +1,54 @@
+import math
+from typing import List, Sequence
+
+import numpy as np
+
+KMEANS_ITERATIONS = 10
+
+
+def mean_pool(multivector: np.ndarray) -> np.ndarray:
+    pooled = np.asarray(multivector, dtype=np.float32).mean(axis=0)
+    norm = np.linalg.norm(pooled)
+    return pooled / norm if norm > 0 else pooled
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Reduces patch vectors to ceil(tokens / pool_factor) by spherical k-means,
+# every output vector is the normalized mean of a cluster of similar patches.
+# Deterministic: clusters are seeded with evenly spaced tokens, so neighbouring
+# patches of the page start in different clusters.
+def pool_tokens(multivector: np.ndarray, pool_factor: float) -> np.ndarray:
+    vectors = normalize_rows(np.asarray(multivector, dtype=np.float32))
+    num_tokens = vectors.shape[0]
+    num_clusters = math.ceil(num_tokens / pool_factor)
+    if pool_factor <= 1 or num_clusters >= num_tokens:
+        return vectors
+
+    seeds = np.linspace(0, num_tokens - 1, num_clusters).round().astype(np.int64)
+    centroids = vectors[seeds]
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=num_clusters)
+        # an emptied cluster keeps its previous centroid
+        empty = counts == 0
+        sums[empty] = centroids[empty]
+        new_centroids = normalize_rows(sums)
+        if np.allclose(new_centroids, centroids, atol=1e-5):
+            break
+        centroids = new_centroids
+
+    assignment = np.argmax(vectors @ centroids.T, axis=1)
+    counts = np.bincount(assignment, minlength=num_clusters)
+    return centroids[counts > 0]
+
+
+def pool_tokens_batch(
+    multivectors: Sequence[np.ndarray], pool_factor: float
+) -> List[np.ndarray]:
+    return [pool_tokens(mv, pool_factor) for mv in multivectors]
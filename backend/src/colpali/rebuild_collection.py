@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from qdrant_client.http import models
+
+from .colpali_collection import (
+    QUANTIZATION_PROFILES,
+    CollectionLayout,
+    point_multivector,
+    point_vector,
+)
+from .colpali_service import (
+    COLLECTION_NAME,
+    POOL_FACTOR,
+    QUANTIZATION,
+    ColpaliService,
+    collection_copy_name,
+)
+from .pooling import pool_tokens
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+logger = logging.getLogger(__name__)
+
+SCROLL_BATCH_SIZE = 32
+
+
+# Copies all points into a new collection with the current layout and the given
+# quantization profile and switches the COLLECTION_NAME alias to it. Stop the indexer while it runs, points
+# written to the old collection in the meantime are not copied.
+# Backend and indexer must be restarted afterwards to pick up the new layout.
+# A legacy collection named COLLECTION_NAME must be dropped before the alias
+# can take its name, searches fail between the two calls. When interrupted
+# there, resolve_collection of the next start creates the alias to the copy.
+async def rebuild_collection(service: ColpaliService, quantization: str):
+    src_name = await service.resolve_collection()
+    assert src_name is not None
+    src_layout = service.layout
+    dst_layout = CollectionLayout(
+        vector_size=src_layout.vector_size, quantization=quantization
+    )
+    dst_name = collection_copy_name()
+    await service.create_collection(dst_name, dst_layout)
+
+    copied = 0
+    offset = None
+    while True:
+        points, offset = await service.qdrant.scroll(
+            collection_name=src_name,
+            limit=SCROLL_BATCH_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            await service.qdrant.upsert(
+                collection_name=dst_name,
+                points=[
+                    convert_point(point, src_layout, dst_layout) for point in points
+                ],
+                wait=offset is None,
+            )
+            copied += len(points)
+            logger.info(f"Copied {copied} points to {dst_name=}")
+        if offset is None:
+            break
+
+    # the source is dropped by the switch, never before the copy is complete
+    src_count = await service.qdrant.count(src_name, exact=True)
+    dst_count = await service.qdrant.count(dst_name, exact=True)
+    if src_count.count != dst_count.count:
+        raise RuntimeError(
+            f"Copied {dst_count.count} of {src_count.count} points to {dst_name=}, "
+            f"was the indexer running? {src_name=} is left as it is"
+        )
+
+    await switch_collection(service, src_name, dst_name)
+
+
+# points COLLECTION_NAME to dst_name and drops the collection it pointed to
+async def switch_collection(service: ColpaliService, src_name: str, dst_name: str):
+    if src_name == COLLECTION_NAME:
+        # legacy collection holds the name the alias needs
+        await service.qdrant.delete_collection(src_name)
+        await service.create_alias(dst_name)
+    else:
+        # one atomic alias update, searches never miss the collection
+        await service.qdrant.update_collection_aliases(
+            change_aliases_operations=[
+                models.DeleteAliasOperation(
+                    delete_alias=models.DeleteAlias(alias_name=COLLECTION_NAME)
+                ),
+                models.CreateAliasOperation(
+                    create_alias=models.CreateAlias(
+                        collection_name=dst_name, alias_name=COLLECTION_NAME
+                    )
+                ),
+            ]
+        )
+        await service.qdrant.delete_collection(src_name)
+
+    logger.info(f"{COLLECTION_NAME} now points to {dst_name=}, restart the services")
+
+
+def convert_point(
+    point: models.Record, src_layout: CollectionLayout, dst_layout: CollectionLayout
+) -> models.PointStruct:
+    multivector = point_multivector(src_layout, point.vector)
+    payload = dict(point.payload or {})
+    # stored vectors can be pooled further, never restored
+    pool_factor = payload.get("pool_factor", 1)
+    if POOL_FACTOR > pool_factor:
+        multivector = pool_tokens(multivector, POOL_FACTOR / pool_factor)
+        payload["pool_factor"] = POOL_FACTOR
+    return models.PointStruct(
+        id=point.id,
+        vector=point_vector(dst_layout, multivector),
+        payload=payload,
+    )
+
+
+async def run(quantization: str):
+    service = ColpaliService()
+    await service.init()
+    try:
+        await rebuild_collection(service, quantization)
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--quantization", choices=QUANTIZATION_PROFILES, default=QUANTIZATION
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.quantization))
+
+
+if __name__ == "__main__":
+    main()
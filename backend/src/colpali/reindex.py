@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import logging
+import os
+from typing import Iterator, List, Set, Tuple
+
+import numpy as np
+from qdrant_client.http import models
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..classifier.classifier_models import (
+    ChunkEmbedding,
+    Document,
+    DocumentChunk,
+    IndexJob,
+    IndexJobStatus,
+)
+from ..classifier.index_queue import IndexQueue
+from ..database import SessionLocal
+from .colpali_collection import QUANTIZATION_PROFILES, CollectionLayout, point_vector
+from .colpali_service import (
+    BATCH_SIZE,
+    INDEX_EMBED_CONCURRENCY,
+    INDEX_LOAD_CONCURRENCY,
+    INDEX_QUEUE_SIZE,
+    INDEX_UPSERT_CONCURRENCY,
+    POOL_FACTOR,
+    QUANTIZATION,
+    ColpaliService,
+    EmbeddingInput,
+    collection_copy_name,
+)
+from .index_pipeline import PipelineStage, run_pipeline
+from .rebuild_collection import switch_collection
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+logger = logging.getLogger(__name__)
+
+ID_BATCH_SIZE = 1024
+
+
+# Rebuilds the vector index from the embedding cache into a new collection and
+# switches the COLLECTION_NAME alias to it, e.g. after losing the Qdrant volume.
+# Chunks without a cached embedding are skipped unless embed_missing is set,
+# then they go through ColPali and are cached on the way. Documents of skipped
+# chunks are marked not indexed and queued again, the indexer embeds them.
+# Stop the indexer while it runs, documents indexed meanwhile are not copied.
+# Backend and indexer must be restarted afterwards to pick up the new layout.
+async def reindex(service: ColpaliService, quantization: str, embed_missing: bool):
+    src_name = await service.resolve_collection()
+    assert src_name is not None
+    dst_layout = CollectionLayout(
+        vector_size=service.layout.vector_size, quantization=quantization
+    )
+    dst_name = collection_copy_name()
+    await service.create_collection(dst_name, dst_layout)
+
+    stored: List[int] = []
+    skipped: List[int] = []
+
+    async def load(batch_ids: List[int]):
+        return await run_in_threadpool(service.load_embedding_inputs, batch_ids)
+
+    async def embed(batch: List[EmbeddingInput]):
+        if not embed_missing:
+            skipped.extend(item.embedding_id for item in batch if item.cached is None)
+            batch = [item for item in batch if item.cached is not None]
+        return await service.embed_inputs(batch) if batch else []
+
+    async def store(batch: List[Tuple[int, np.ndarray]]):
+        if batch:
+            await service.qdrant.upsert(
+                collection_name=dst_name,
+                points=[
+                    models.PointStruct(
+                        id=embedding_id,
+                        vector=point_vector(dst_layout, multivector),
+                        payload={"pool_factor": POOL_FACTOR},
+                    )
+                    for embedding_id, multivector in batch
+                ],
+                wait=True,
+            )
+            stored.extend(embedding_id for embedding_id, _ in batch)
+
+    stats = await run_pipeline(
+        iter_embedding_id_batches(),
+        [
+            PipelineStage("load", load, INDEX_LOAD_CONCURRENCY),
+            # only cache misses reach ColPali
+            PipelineStage("embed", embed, INDEX_EMBED_CONCURRENCY),
+            PipelineStage("store", store, INDEX_UPSERT_CONCURRENCY),
+        ],
+        queue_size=INDEX_QUEUE_SIZE,
+    )
+    logger.info(
+        f"Reindexed into {dst_name=} stored={len(stored)} skipped={len(skipped)} {stats}"
+    )
+    with SessionLocal() as db:
+        service.embeddings.mark_stored(db, stored)
+        requeued = requeue_documents(db, skipped)
+        # same commit, the queued jobs embed them again instead of reusing them
+        service.embeddings.mark_stored(db, skipped, stored=False)
+    if skipped:
+        logger.warning(
+            f"{len(skipped)} embeddings are not cached and were left out, "
+            f"{requeued} documents are queued for indexing again, "
+            "run with --embed-missing to include them right away"
+        )
+
+    await switch_collection(service, src_name, dst_name)
+
+
+# number of documents with chunks on the embeddings, they are marked not
+# indexed and get a job unless one is pending already, the caller commits
+def requeue_documents(db: Session, embedding_ids: List[int]) -> int:
+    doc_ids: Set[int] = set()
+    for i in range(0, len(embedding_ids), ID_BATCH_SIZE):
+        doc_ids.update(
+            doc_id
+            for (doc_id,) in db.query(DocumentChunk.doc_id)
+            .filter(
+                DocumentChunk.embedding_id.in_(embedding_ids[i : i + ID_BATCH_SIZE])
+            )
+            .distinct()
+        )
+    if not doc_ids:
+        return 0
+    queued = {
+        doc_id
+        for (doc_id,) in db.query(IndexJob.doc_id).filter(
+            IndexJob.doc_id.in_(doc_ids),
+            IndexJob.status.in_([IndexJobStatus.PENDING, IndexJobStatus.RUNNING]),
+        )
+    }
+    index_queue = IndexQueue()
+    docs = (
+        db.query(Document)
+        .filter(Document.id.in_(doc_ids))
+        .order_by(Document.id.asc())
+        .with_for_update()
+    )
+    for doc in docs:
+        doc.indexed = False
+        if doc.id not in queued:
+            index_queue.enqueue(db, doc)
+    return len(doc_ids)
+
+
+def iter_embedding_id_batches() -> Iterator[List[int]]:
+    last_id = 0
+    while True:
+        with SessionLocal() as db:
+            ids = [
+                embedding_id
+                for (embedding_id,) in db.query(ChunkEmbedding.id)
+                .filter(ChunkEmbedding.id > last_id, ChunkEmbedding.ref_count > 0)
+                .order_by(ChunkEmbedding.id.asc())
+                .limit(ID_BATCH_SIZE)
+            ]
+        if not ids:
+            return
+        last_id = ids[-1]
+        for i in range(0, len(ids), BATCH_SIZE):
+            yield ids[i : i + BATCH_SIZE]
+
+
+async def run(quantization: str, embed_missing: bool):
+    service = ColpaliService()
+    await service.init()
+    try:
+        await reindex(service, quantization, embed_missing)
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--quantization", choices=QUANTIZATION_PROFILES, default=QUANTIZATION
+    )
+    parser.add_argument(
+        "--embed-missing",
+        action="store_true",
+        help="embed chunks missing from the cache with ColPali",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.quantization, args.embed_missing))
+
+
+if __name__ == "__main__":
+    main()
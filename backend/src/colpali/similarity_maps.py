@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+import io
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .pooling import normalize_rows
+
+
+# Layout of the image patch tokens in the raw ColPali output: rows x cols
+# patches in row-major order starting at token offset, covering the whole
+# image stretched to the model input square. PaliGemma based ColPali emits
+# 32x32 patches before the prompt tokens.
+@dataclass(frozen=True)
+class PatchGrid:
+    rows: int
+    cols: int
+    offset: int = 0
+
+    @property
+    def num_patches(self) -> int:
+        return self.rows * self.cols
+
+
+def parse_patch_grid(value: str, offset: int = 0) -> PatchGrid:
+    rows, cols = value.lower().split("x")
+    return PatchGrid(rows=int(rows), cols=int(cols), offset=offset)
+
+
+PATCH_GRID = parse_patch_grid(
+    os.environ.get("COLPALI_PATCH_GRID", "32x32"),
+    offset=int(os.environ.get("COLPALI_PATCH_OFFSET", "0")),
+)
+
+# opacity of the heatmap over the most relevant patches
+HEATMAP_ALPHA = float(os.environ.get("INTERPRET_HEATMAP_ALPHA", "0.6"))
+HEATMAP_QUALITY = 85
+
+
+# rows x cols relevance of the image patches to the query in [0, 1].
+# Every query token spreads its similarities over the patches, min-max
+# scaled so filler tokens with flat maps weigh as much as their contrast.
+# None when the embedding does not hold the grid, e.g. another model.
+def similarity_map(
+    query_embedding: np.ndarray, image_embedding: np.ndarray, grid: PatchGrid
+) -> Optional[np.ndarray]:
+    if image_embedding.shape[0] < grid.offset + grid.num_patches:
+        return None
+    patches = normalize_rows(
+        np.asarray(
+            image_embedding[grid.offset : grid.offset + grid.num_patches],
+            dtype=np.float32,
+        )
+    )
+    query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+    # query tokens x patches
+    scores = query @ patches.T
+    low = scores.min(axis=1, keepdims=True)
+    high = scores.max(axis=1, keepdims=True)
+    scores = (scores - low) / np.maximum(high - low, 1e-6)
+    ret = scores.mean(axis=0)
+    ret = (ret - ret.min()) / max(float(ret.max() - ret.min()), 1e-6)
+    return ret.reshape(grid.rows, grid.cols)
+
+
+# (left, top, right, bottom) fractions of the image around the patches scoring
+# at least threshold, padded by padding patches on every side
+def relevant_box(
+    sim_map: np.ndarray, threshold: float, padding: int = 1
+) -> Tuple[float, float, float, float]:
+    rows, cols = sim_map.shape
+    ys, xs = np.nonzero(sim_map >= threshold)
+    if not len(ys):
+        return 0.0, 0.0, 1.0, 1.0
+    top = max(int(ys.min()) - padding, 0)
+    bottom = min(int(ys.max()) + 1 + padding, rows)
+    left = max(int(xs.min()) - padding, 0)
+    right = min(int(xs.max()) + 1 + padding, cols)
+    return left / cols, top / rows, right / cols, bottom / rows
+
+
+# JPEG of the image with the map upsampled over it, orange turning red and
+# more opaque where the relevance is higher, pages are mostly white
+def render_similarity_map(image: bytes, sim_map: np.ndarray) -> bytes:
+    with Image.open(io.BytesIO(image)) as img:
+        img = img.convert("RGB")
+        heat = Image.fromarray(
+            np.clip(sim_map * 255, 0, 255).astype(np.uint8), mode="L"
+        ).resize(img.size, Image.Resampling.BILINEAR)
+        value = np.asarray(heat, dtype=np.float32)[..., None] / 255
+        colors = np.concatenate(
+            [np.full_like(value, 255), (1 - value) * 160, np.zeros_like(value)],
+            axis=-1,
+        )
+        alpha = value * HEATMAP_ALPHA
+        blended = np.asarray(img, dtype=np.float32) * (1 - alpha) + colors * alpha
+        bytes_io = io.BytesIO()
+        Image.fromarray(blended.astype(np.uint8)).save(
+            bytes_io, format="JPEG", quality=HEATMAP_QUALITY
+        )
+        return bytes_io.getvalue()
@@ -1,10 +1,13 @@
 from contextlib import asynccontextmanager
 import logging
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST
 
+from .database import engine
 from .rag.rag_service import RagService
-from .colpali.colpali_service import ColpaliService
+from .colpali.doc_indexers import create_doc_indexer
 from .classifier.default_doc_processor import DefaultDocProcessor
 
 from .classifier.classifier_service import (
@@ -13,8 +16,10 @@ from .classifier.classifier_service import (
     RAG_SERVICE_NAME,
     DOC_PROCESSOR_SERVICE_NAME,
     ClassifierService,
+    get_doc_indexer_service,
 )
 from .classifier import classifier_router, classifier_models
+from .utils.metrics import ServerTimingMiddleware, generate_metrics, instrument_engine
 
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
 
@@ -26,15 +31,27 @@ async def lifespan(app: FastAPI):
 
     # classifier_models.create_all_tables()
 
+    doc_indexer = create_doc_indexer()
+    await doc_indexer.init()
+    doc_processor = DefaultDocProcessor()
+    rag = RagService()
+
     yield {
         CLASSIFIER_SERVICE_NAME: ClassifierService(),
-        DOC_PROCESSOR_SERVICE_NAME: DefaultDocProcessor(),
-        DOC_INDEXER_SERVICE_NAME: ColpaliService(),
-        RAG_SERVICE_NAME: RagService(),
+        DOC_PROCESSOR_SERVICE_NAME: doc_processor,
+        DOC_INDEXER_SERVICE_NAME: doc_indexer,
+        RAG_SERVICE_NAME: rag,
     }
 
+    await rag.close()
+    doc_processor.close()
+    await doc_indexer.close()
+
+
+instrument_engine(engine)
 
 app = FastAPI(lifespan=lifespan, root_path=os.environ["API_BASE_URI"])
+app.add_middleware(ServerTimingMiddleware)
 
 app.include_router(classifier_router.router)
 
@@ -42,3 +59,13 @@ app.include_router(classifier_router.router)
 @app.get("/")
 def version():
     return {"version": "1.0.0"}
+
+
+@app.get("/stats")
+def stats(request: Request):
+    return get_doc_indexer_service(request.state).stats()
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_metrics(), media_type=CONTENT_TYPE_LATEST)
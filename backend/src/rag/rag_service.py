@@ -1,28 +1,59 @@
 import logging
-from typing import List
-from ..utils.llm import llm_chat_completion
+from typing import AsyncIterator, List
+from openai.types.chat import ChatCompletionMessageParam
+from ..utils.llm import (
+    create_async_llm_client,
+    llm_chat_completion_async,
+    llm_chat_completion_stream,
+)
 from ..classifier.classifier_service import RagService as IRagService
 import os
 import base64
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_ANSWER = "К сожелению, у меня нет ответа"
+# bump when the prompt or the messages change
+PROMPT_VERSION = "1"
+
 
 class RagService(IRagService):
     def __init__(self) -> None:
         super().__init__()
+        self.llm = create_async_llm_client()
+
+    async def close(self):
+        await self.llm.close()
+
+    @property
+    def model_id(self) -> str:
+        return os.environ["LLM_MODEL"]
 
-    def question(self, prompt: str, images: List[bytes]) -> str:
+    @property
+    def prompt_version(self) -> str:
+        return PROMPT_VERSION
+
+    async def question(self, prompt: str, images: List[bytes]) -> str:
         # return f"Dummy answer for '{prompt}' using {len(images)} chunks"
-        return self.__llm_prompt(
-            prompt=prompt,
-            images=images,
-            default_answer="К сожелению, у меня нет ответа",
+        return await llm_chat_completion_async(
+            self.llm,
+            messages=self.__llm_messages(prompt, images, DEFAULT_ANSWER),
+            model=self.model_id,
         )
 
-    def __llm_prompt(
+    async def question_stream(
+        self, prompt: str, images: List[bytes]
+    ) -> AsyncIterator[str]:
+        async for delta in llm_chat_completion_stream(
+            self.llm,
+            messages=self.__llm_messages(prompt, images, DEFAULT_ANSWER),
+            model=self.model_id,
+        ):
+            yield delta
+
+    def __llm_messages(
         self, prompt: str, images: List[bytes], default_answer: str
-    ) -> str:
+    ) -> List[ChatCompletionMessageParam]:
 
         user_prompt = f"""
 Please answer the following question using only the information visible in the provided image.
@@ -34,27 +65,25 @@ Answer in Russian language.
 User's question: {prompt}
 """
 
-        return llm_chat_completion(
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant"},
-                {
-                    "role": "user",
-                    "content": [
-                        *[
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64.b64encode(img).decode('ascii')}"
-                                },
-                            }
-                            for img in images
-                        ],
+        return [
+            {"role": "system", "content": "You are a helpful assistant"},
+            {
+                "role": "user",
+                "content": [
+                    # RagContextBuilder encodes every context image as JPEG
+                    *[
                         {
-                            "type": "text",
-                            "text": user_prompt,
-                        },
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{base64.b64encode(img).decode('ascii')}"
+                            },
+                        }
+                        for img in images
                     ],
-                },
-            ],
-            model=os.environ["LLM_MODEL"],
-        )
+                    {
+                        "type": "text",
+                        "text": user_prompt,
+                    },
+                ],
+            },
+        ]
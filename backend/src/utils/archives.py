@@ -0,0 +1,98 @@
+from dataclasses import dataclass
+import logging
+import mimetypes
+import os
+import tarfile
+from typing import BinaryIO, Iterator, Optional
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# larger files of a directory or archive are skipped, guards against zip bombs
+ARCHIVE_MAX_FILE_BYTES = int(
+    os.environ.get("ARCHIVE_MAX_FILE_BYTES", str(256 * 1024 * 1024))
+)
+
+
+class ArchiveFormatError(Exception):
+    pass
+
+
+@dataclass
+class ArchiveFile:
+    name: str
+    # guessed from the extension
+    mime: Optional[str]
+    # None when the file is too large
+    content: Optional[bytes]
+
+
+# files of a zip or tar archive, read one at a time
+def iter_archive_files(fileobj: BinaryIO) -> Iterator[ArchiveFile]:
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or is_hidden(info.filename):
+                    continue
+                if info.file_size > ARCHIVE_MAX_FILE_BYTES:
+                    yield too_large(info.filename)
+                    continue
+                yield archive_file(info.filename, archive.read(info))
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError as e:
+        raise ArchiveFormatError("Not a zip or tar archive") from e
+    with archive:
+        for member in archive:
+            if not member.isfile() or is_hidden(member.name):
+                continue
+            if member.size > ARCHIVE_MAX_FILE_BYTES:
+                yield too_large(member.name)
+                continue
+            extracted = archive.extractfile(member)
+            assert extracted is not None
+            yield archive_file(member.name, extracted.read())
+
+
+# files of a directory tree, archives inside it are not unpacked
+def iter_directory_files(path: str) -> Iterator[ArchiveFile]:
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(name for name in dirs if not is_hidden(name))
+        for name in sorted(files):
+            if is_hidden(name):
+                continue
+            file_path = os.path.join(root, name)
+            rel_path = os.path.relpath(file_path, path)
+            if os.path.getsize(file_path) > ARCHIVE_MAX_FILE_BYTES:
+                yield too_large(rel_path)
+                continue
+            with open(file_path, "rb") as f:
+                yield archive_file(rel_path, f.read())
+
+
+# a directory or an archive file
+def iter_path_files(path: str) -> Iterator[ArchiveFile]:
+    if os.path.isdir(path):
+        yield from iter_directory_files(path)
+        return
+    with open(path, "rb") as f:
+        yield from iter_archive_files(f)
+
+
+def archive_file(path: str, content: Optional[bytes]) -> ArchiveFile:
+    mime, _ = mimetypes.guess_type(path)
+    return ArchiveFile(name=os.path.basename(path), mime=mime, content=content)
+
+
+def too_large(path: str) -> ArchiveFile:
+    logger.warning(f"Skipping {path=}, larger than {ARCHIVE_MAX_FILE_BYTES=}")
+    return archive_file(path, None)
+
+
+# dot files and macOS resource forks
+def is_hidden(path: str) -> bool:
+    return any(part.startswith(".") or part == "__MACOSX" for part in path.split("/"))
@@ -0,0 +1,164 @@
+import asyncio
+from collections import Counter, deque
+import contextvars
+import logging
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Generic,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+import numpy as np
+
+from .metrics import BATCH_QUEUE_SECONDS, BATCH_SIZE
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+logger = logging.getLogger(__name__)
+
+# queueing delays kept for the percentiles
+STATS_WINDOW = 1024
+
+
+class BatchCancelledError(Exception):
+    pass
+
+
+class BatchStats:
+    def __init__(self) -> None:
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        # batch size -> number of batches sent with it
+        self.batch_sizes: Counter[int] = Counter()
+        # seconds from submit until the batch of the item was sent
+        self.queue_delays: Deque[float] = deque(maxlen=STATS_WINDOW)
+        self.max_queue_delay = 0.0
+
+    def record(self, batch_size: int, queue_delays: List[float]):
+        self.batches += 1
+        self.items += batch_size
+        self.batch_sizes[batch_size] += 1
+        self.queue_delays.extend(queue_delays)
+        self.max_queue_delay = max(self.max_queue_delay, *queue_delays)
+
+    def as_dict(self):
+        delays = np.asarray(self.queue_delays) * 1000
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "mean_batch_size": self.items / self.batches if self.batches else 0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_delay_ms": {
+                "p50": float(np.percentile(delays, 50)) if len(delays) else 0,
+                "p95": float(np.percentile(delays, 95)) if len(delays) else 0,
+                "max": self.max_queue_delay * 1000,
+            },
+        }
+
+
+# Packs items submitted by concurrent callers into batches for process.
+# A batch goes out as soon as max_batch items are pending, or max_wait seconds
+# after the oldest pending item arrived. At most concurrency batches run at once,
+# items arriving meanwhile fill the next batch.
+class BatchCoalescer(Generic[T, R]):
+    def __init__(
+        self,
+        process: Callable[[List[T]], Awaitable[List[R]]],
+        max_batch: int,
+        max_wait: float,
+        concurrency: int = 1,
+        name: str = "batch",
+    ) -> None:
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = BatchStats()
+        # (item, future, submit time)
+        self.pending: List[Tuple[T, asyncio.Future[R], float]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        return (await self.submit_many([item]))[0]
+
+    # results in item order, a failed batch fails all of its callers
+    async def submit_many(self, items: List[T]) -> List[R]:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        futures = [loop.create_future() for _ in items]
+        self.pending.extend((item, future, now) for item, future in zip(items, futures))
+        while len(self.pending) >= self.max_batch:
+            self.__start(self.pending[: self.max_batch])
+            del self.pending[: self.max_batch]
+        if self.pending and self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.__flush)
+        return list(await asyncio.gather(*futures))
+
+    def __flush(self):
+        self.timer = None
+        if self.pending:
+            self.__start(self.pending)
+            self.pending = []
+
+    def __start(self, batch: List[Tuple[T, asyncio.Future[R], float]]):
+        # not in the context of the caller that happened to fill the batch,
+        # its request timings should not get the whole shared batch
+        task = asyncio.create_task(self.__run(batch), context=contextvars.Context())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        # a callback, a task cancelled before it started never runs its body
+        task.add_done_callback(lambda _: self.__fail_unresolved(batch))
+
+    # cancelled, e.g. on shutdown, callers must not wait forever
+    def __fail_unresolved(self, batch: List[Tuple[T, asyncio.Future[R], float]]):
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(BatchCancelledError(f"{self.name} was cancelled"))
+
+    async def __run(self, batch: List[Tuple[T, asyncio.Future[R], float]]):
+        async with self.semaphore:
+            # callers that gave up, e.g. a job whose lease was lost
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                return
+            await self.__process(batch)
+
+    async def __process(self, batch: List[Tuple[T, asyncio.Future[R], float]]):
+        now = asyncio.get_running_loop().time()
+        queue_delays = [now - submitted for _, _, submitted in batch]
+        self.stats.record(len(batch), queue_delays)
+        BATCH_SIZE.labels(self.name).observe(len(batch))
+        queue_seconds = BATCH_QUEUE_SECONDS.labels(self.name)
+        for delay in queue_delays:
+            queue_seconds.observe(delay)
+        logger.debug(
+            f"Sending {self.name} size={len(batch)} "
+            f"max_queue_delay_ms={max(queue_delays) * 1000:.1f}"
+        )
+        try:
+            results = await self.process([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"{self.name} returned {len(results)} results "
+                    f"for {len(batch)} items"
+                )
+        except Exception as e:
+            self.stats.errors += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
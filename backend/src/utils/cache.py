@@ -0,0 +1,206 @@
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# in-process LRU bounded by item count and/or total size, with optional TTL
+class LruCache(Generic[K, V]):
+
+    def __init__(
+        self,
+        max_items: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[V], int] = lambda _: 1,
+    ) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.stats = CacheStats()
+        self.total_bytes = 0
+        self.__items: OrderedDict[K, Tuple[V, float, int]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, key: K) -> Optional[V]:
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is None:
+                self.stats.misses += 1
+                return None
+            value, created_at, _ = item
+            if self.ttl and time.monotonic() - created_at > self.ttl:
+                self.__remove(key)
+                self.stats.misses += 1
+                return None
+            self.__items.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def put(self, key: K, value: V):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.__lock:
+            if key in self.__items:
+                self.__remove(key)
+            self.__items[key] = (value, time.monotonic(), size)
+            self.total_bytes += size
+            self.__evict()
+
+    def delete(self, key: K):
+        with self.__lock:
+            if key in self.__items:
+                self.__remove(key)
+
+    def delete_where(self, predicate: Callable[[K], bool]):
+        with self.__lock:
+            for key in [key for key in self.__items if predicate(key)]:
+                self.__remove(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+            self.total_bytes = 0
+
+    def __remove(self, key: K):
+        _, _, size = self.__items.pop(key)
+        self.total_bytes -= size
+
+    def __evict(self):
+        while self.__items and (
+            (self.max_items is not None and len(self.__items) > self.max_items)
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            _, (_, _, size) = self.__items.popitem(last=False)
+            self.total_bytes -= size
+            self.stats.evictions += 1
+
+
+# file-per-entry byte cache, can be shared between worker processes
+class DiskCache:
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.total_bytes = sum(f.stat().st_size for f in self.__files())
+
+    def get(self, key: str, group: Optional[str] = None) -> Optional[bytes]:
+        file = self.__file(key, group)
+        try:
+            if self.ttl and time.time() - file.stat().st_mtime > self.ttl:
+                self.delete(key, group)
+                self.stats.misses += 1
+                return None
+            data = file.read_bytes()
+            # keep recently used entries away from eviction
+            os.utime(file)
+        except FileNotFoundError:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes, group: Optional[str] = None):
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return
+        file = self.__file(key, group)
+        file.parent.mkdir(exist_ok=True)
+        # atomic replace, readers in other processes never see partial files
+        tmp_file = file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_file.write_bytes(data)
+        os.replace(tmp_file, file)
+        self.total_bytes += len(data)
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            self.__evict()
+
+    def delete(self, key: str, group: Optional[str] = None):
+        file = self.__file(key, group)
+        try:
+            size = file.stat().st_size
+            file.unlink()
+            self.total_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    # groups keep related entries in one directory to drop them at once
+    def delete_group(self, group: str):
+        group_dir = self.__group_dir(group)
+        if not group_dir.is_dir():
+            return
+        for file in group_dir.iterdir():
+            try:
+                size = file.stat().st_size
+                file.unlink()
+                self.total_bytes -= size
+            except FileNotFoundError:
+                pass
+        try:
+            group_dir.rmdir()
+        except OSError:
+            # concurrently written by another process, evicted later
+            pass
+
+    def __file(self, key: str, group: Optional[str]) -> Path:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        if group is not None:
+            return self.__group_dir(group) / digest
+        return self.path / digest[:2] / digest
+
+    def __group_dir(self, group: str) -> Path:
+        return self.path / f"g-{hashlib.sha256(group.encode()).hexdigest()[:32]}"
+
+    def __files(self):
+        return (f for f in self.path.glob("*/*") if f.suffix != ".tmp")
+
+    def __evict(self):
+        assert self.max_bytes is not None
+        entries = []
+        for f in self.__files():
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, f))
+        entries.sort()
+        # other processes write to the same directory, resync the total
+        self.total_bytes = sum(size for _, size, _ in entries)
+        # evict down to 90% to not rescan the directory on every put
+        target = self.max_bytes * 0.9
+        for _, size, f in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            self.stats.evictions += 1
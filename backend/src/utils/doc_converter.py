@@ -1,38 +1,177 @@
+import logging
+import os
+from pathlib import Path
+import queue
+import signal
+import socket
 import subprocess
-import re
-from tempfile import TemporaryDirectory, NamedTemporaryFile
+from tempfile import TemporaryDirectory
+import time
+from typing import Optional
+import xmlrpc.client
 
-from .files import read_binary_file, write_binary_file
+from .metrics import STAGE_LIBREOFFICE, timed
 
+logger = logging.getLogger(__name__)
 
-def convert_to(source: bytes, from_format: str, to_format: str, timeout: int) -> bytes:
+# unoserver runs on the LibreOffice python, which has the uno module
+UNOSERVER_PYTHON = os.environ.get("UNOSERVER_PYTHON", "/usr/bin/python3")
+LIBREOFFICE_WORKERS = int(os.environ.get("LIBREOFFICE_WORKERS", "2"))
+LIBREOFFICE_START_TIMEOUT = float(os.environ.get("LIBREOFFICE_START_TIMEOUT", "60"))
+# restarts a worker after this many jobs, LibreOffice grows over time
+LIBREOFFICE_MAX_JOBS = int(os.environ.get("LIBREOFFICE_MAX_JOBS", "200"))
 
-    with NamedTemporaryFile(
-        suffix=f".{from_format}"
-    ) as src_file, TemporaryDirectory() as out_dir:
 
-        write_binary_file(src_file.name, source)
+class ConvertingError(Exception):
+    def __init__(self, output):
+        self.output = output
+
+
+class OfficeWorker:
+    def __init__(self, idx: int) -> None:
+        self.idx = idx
+        self.process: Optional[subprocess.Popen] = None
+        self.profile_dir: Optional[TemporaryDirectory] = None
+        self.port = 0
+        self.jobs = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
 
-        args = [
-            "libreoffice",
-            "--headless",
-            "--convert-to",
+    def start(self, conversion_timeout: int):
+        self.port = free_port()
+        # own profile per worker, instances sharing one lock each other out
+        self.profile_dir = TemporaryDirectory(prefix=f"libreoffice-{self.idx}-")
+        self.process = subprocess.Popen(
+            [
+                UNOSERVER_PYTHON,
+                "-m",
+                "unoserver.server",
+                "--port",
+                str(self.port),
+                "--uno-port",
+                str(free_port()),
+                "--user-installation",
+                Path(self.profile_dir.name).as_uri(),
+                # the server kills LibreOffice and exits on timeout, we restart it
+                "--conversion-timeout",
+                str(conversion_timeout),
+            ],
+            stdout=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self.jobs = 0
+
+        deadline = time.monotonic() + LIBREOFFICE_START_TIMEOUT
+        while True:
+            try:
+                self.__proxy(timeout=5).info()
+                break
+            except (OSError, xmlrpc.client.ProtocolError):
+                if not self.alive or time.monotonic() > deadline:
+                    self.stop()
+                    raise ConvertingError(
+                        f"LibreOffice worker {self.idx} did not start"
+                    )
+                time.sleep(0.5)
+        logger.info(f"Started LibreOffice worker {self.idx} port={self.port}")
+
+    def stop(self):
+        if self.process is not None:
+            # whole session, unoserver and the soffice it spawned
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+            self.process = None
+        if self.profile_dir is not None:
+            self.profile_dir.cleanup()
+            self.profile_dir = None
+
+    def convert(
+        self, source: bytes, from_format: str, to_format: str, timeout: int
+    ) -> bytes:
+        self.jobs += 1
+        # a little longer than the server side timeout, which recovers cleaner
+        ret = self.__proxy(timeout=timeout + 5).convert(
+            None,
+            xmlrpc.client.Binary(source),
+            None,
             to_format,
-            "--outdir",
-            out_dir,
-            src_file.name,
-        ]
-        process = subprocess.run(
-            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout
+            None,
+            [],
+            True,
+            None,
         )
-        out_file_gr = re.search("-> (.*?) using filter", process.stdout.decode())
+        return ret.data
 
-        if out_file_gr is None:
-            raise ConvertingError(process.stdout.decode())
-        else:
-            return read_binary_file(out_file_gr.group(1))
+    def __proxy(self, timeout: float) -> xmlrpc.client.ServerProxy:
+        return xmlrpc.client.ServerProxy(
+            f"http://127.0.0.1:{self.port}",
+            transport=TimeoutTransport(timeout),
+            allow_none=True,
+        )
 
 
-class ConvertingError(Exception):
-    def __init__(self, output):
-        self.output = output
+# Long-lived LibreOffice instances serving conversions, avoids the cold start of
+# a soffice process per document. Jobs wait in line for a free worker, so at
+# most LIBREOFFICE_WORKERS conversions run at once. Workers are started on first
+# use and restarted after crashes and timeouts.
+class OfficeConverterPool:
+    def __init__(self, workers: int = LIBREOFFICE_WORKERS) -> None:
+        self.idle: queue.Queue[OfficeWorker] = queue.Queue()
+        for idx in range(workers):
+            self.idle.put(OfficeWorker(idx))
+        self.workers = workers
+
+    def convert(
+        self, source: bytes, from_format: str, to_format: str, timeout: int
+    ) -> bytes:
+        # waiting for a free worker, a busy pool shows here first
+        with timed(STAGE_LIBREOFFICE, "wait"):
+            worker = self.idle.get()
+        try:
+            if worker.alive and worker.jobs >= LIBREOFFICE_MAX_JOBS:
+                worker.stop()
+            if not worker.alive:
+                worker.stop()
+                with timed(STAGE_LIBREOFFICE, "start"):
+                    worker.start(conversion_timeout=timeout)
+            try:
+                with timed(STAGE_LIBREOFFICE, "convert"):
+                    return worker.convert(source, from_format, to_format, timeout)
+            except xmlrpc.client.Fault as e:
+                # unoserver exits after a timeout, other faults are bad documents
+                if not worker.alive or "TimeoutError" in e.faultString:
+                    worker.stop()
+                raise ConvertingError(e.faultString)
+            except (OSError, xmlrpc.client.ProtocolError) as e:
+                # timed out or crashed, the next job gets a fresh instance
+                logger.warning(f"Restarting LibreOffice worker {worker.idx}: {e!r}")
+                worker.stop()
+                raise ConvertingError(str(e))
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        for _ in range(self.workers):
+            self.idle.get().stop()
+
+
+class TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
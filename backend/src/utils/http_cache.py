@@ -0,0 +1,83 @@
+import hashlib
+from typing import NamedTuple, Optional
+
+from fastapi import Request
+
+
+def make_etag(*parts: str | int) -> str:
+    digest = hashlib.sha256(":".join(str(p) for p in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison as required for If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+# content-addressed resources never change, caches may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+# strong ETag from a sha256 hex digest of the content
+def content_etag(content_hash: str) -> str:
+    return f'"{content_hash}"'
+
+
+class ByteRange(NamedTuple):
+    start: int
+    # inclusive, like in Content-Range
+    end: int
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+# Single "bytes=" range of the request, None when the whole content should
+# be sent: no or unsupported Range header, or If-Range does not match.
+# Multiple ranges are answered with the whole content, which RFC 9110 allows.
+def requested_range(
+    request: Request, size: int, etag: Optional[str] = None
+) -> Optional[ByteRange]:
+    range_header = request.headers.get("Range")
+    if not range_header:
+        return None
+    if_range = request.headers.get("If-Range")
+    if if_range and if_range.strip() != etag:
+        return None
+
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first or last):
+        return None
+    # digits only, int() would also take signs, spaces and underscores
+    if not all(part.isascii() and part.isdigit() for part in (first, last) if part):
+        return None
+    if first:
+        start = int(first)
+        end = int(last) if last else max(start, size - 1)
+        if end < start:
+            return None
+    else:
+        # suffix range, the last N bytes
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        start = max(size - suffix, 0)
+        end = size - 1
+
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return ByteRange(start, min(end, size - 1))
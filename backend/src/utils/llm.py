@@ -1,61 +1,151 @@
+import asyncio
 import json
 import logging
-from typing import Iterable, List, Optional, TypeVar
+import os
+import random
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    TypeVar,
+)
 
-from openai.types.chat import ChatCompletionMessageParam
+import httpx
+from openai.types.chat import ChatCompletionChunk, ChatCompletionMessageParam
 from pydantic import BaseModel
 import openai
 import time
 
+from .metrics import LLM_FIRST_TOKEN_SECONDS, STAGE_LLM, timed
+
 logger = logging.getLogger(__name__)
 BM = TypeVar("BM", bound=BaseModel)
+T = TypeVar("T")
+
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "300"))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", "16"))
+LLM_ATTEMPTS = 5
+# exponential backoff between attempts, with jitter
+LLM_RETRY_BASE_DELAY = 0.5
+LLM_RETRY_MAX_DELAY = 8.0
+
+
+# one pooled client per service, retries are ours
+def create_async_llm_client() -> openai.AsyncOpenAI:
+    return openai.AsyncOpenAI(
+        timeout=LLM_TIMEOUT,
+        max_retries=0,
+        http_client=openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+        ),
+    )
+
+
+def retry_delay(attempt: int) -> float:
+    delay = min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2**attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+# timeouts, connection errors, rate limits and server errors may pass on
+# another attempt, other errors would fail the same way again
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return (
+            error.status_code == httpx.codes.TOO_MANY_REQUESTS
+            or error.status_code >= httpx.codes.INTERNAL_SERVER_ERROR
+        )
+    return False
+
+
+async def with_llm_retries(request: Callable[[], Awaitable[T]]) -> T:
+    attempt = 0
+    while True:
+        try:
+            return await request()
+        except Exception as e:
+            attempt += 1
+            if not is_retryable(e):
+                raise
+            if attempt == LLM_ATTEMPTS:
+                raise RuntimeError(
+                    f"Request to LLM failed after {LLM_ATTEMPTS} attempts"
+                ) from e
+            logger.warning(f"Request to LLM attempt {attempt} failed: {e!r}")
+            await asyncio.sleep(retry_delay(attempt - 1))
 
 
-def llm_chat_completion(
+async def llm_chat_completion_async(
+    client: openai.AsyncOpenAI,
     *,
     messages: Iterable[ChatCompletionMessageParam],
     model: str,
     temperature: Optional[float] | openai.NotGiven = openai.NOT_GIVEN,
 ) -> str:
-    client = openai.OpenAI()
-    attempts = 5
-    for attempt in range(attempts):
-        try:
-            response = client.beta.chat.completions.parse(
+    async def request():
+        with timed(STAGE_LLM, "chat_completion"):
+            return await client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=temperature,
             )
-            return response.choices[0].message.content or ""
-        except:
-            logger.exception(f"Request to LLM attept {attempt+1} failed")
-            time.sleep(1.0)
-    raise RuntimeError(f"Request to LLM failed after {attempts} attempts")
+
+    response = await with_llm_retries(request)
+    return response.choices[0].message.content or ""
 
 
-def llm_chat_request(
+# content deltas as they are generated. Attempts are retried until the first
+# delta, a stream failing after that raises, the caller already has a part
+async def llm_chat_completion_stream(
+    client: openai.AsyncOpenAI,
     *,
     messages: Iterable[ChatCompletionMessageParam],
     model: str,
-    output_class: type[BM],
     temperature: Optional[float] | openai.NotGiven = openai.NOT_GIVEN,
-) -> BM:
-    client = openai.OpenAI()
-    attempts = 5
-    for attempt in range(attempts):
+) -> AsyncIterator[str]:
+    # (stream, its chunk iterator, first delta or None for an empty answer)
+    async def open_stream():
+        started_at = time.perf_counter()
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+        )
+        chunks = aiter(stream)
         try:
-            response = client.beta.chat.completions.parse(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-            )
-            return parse_llm_response_json(
-                response.choices[0].message.content, output_class
-            )
-        except:
-            logger.exception(f"Request to LLM attept {attempt+1} failed")
-            time.sleep(1.0)
-    raise RuntimeError(f"Request to LLM failed after {attempts} attempts")
+            async for chunk in chunks:
+                content = delta_content(chunk)
+                if content:
+                    LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started_at)
+                    return stream, chunks, content
+        except BaseException:
+            await stream.close()
+            raise
+        return stream, chunks, None
+
+    with timed(STAGE_LLM, "chat_completion_stream"):
+        stream, chunks, first = await with_llm_retries(open_stream)
+        async with stream:
+            if first is None:
+                return
+            yield first
+            async for chunk in chunks:
+                content = delta_content(chunk)
+                if content:
+                    yield content
+
+
+def delta_content(chunk: ChatCompletionChunk) -> Optional[str]:
+    return chunk.choices[0].delta.content if chunk.choices else None
 
 
 def extract_json_from_text(text: str) -> List[str]:
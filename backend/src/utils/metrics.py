@@ -0,0 +1,219 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import time
+from typing import Dict, Optional
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# uvicorn runs several worker processes, with this set they write their
+# metrics to files there and /metrics merges them. Must be empty on start.
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+STAGE_COLPALI = "colpali"
+STAGE_QDRANT = "qdrant"
+STAGE_LLM = "llm"
+STAGE_LIBREOFFICE = "libreoffice"
+STAGE_DB = "db"
+
+# 1ms (a DB lookup) up to minutes (indexing a large document)
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "stage_call_seconds",
+    "Duration of calls to ColPali, Qdrant, the LLM, LibreOffice and the DB",
+    ["stage", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "stage_call_errors",
+    "Calls to ColPali, Qdrant, the LLM, LibreOffice and the DB that raised",
+    ["stage", "operation"],
+)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_first_token_seconds",
+    "Time from a streamed LLM request until its first content delta",
+    buckets=LATENCY_BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    "batch_size",
+    "Items per batch sent by the batch coalescers",
+    ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+BATCH_QUEUE_SECONDS = Histogram(
+    "batch_queue_seconds",
+    "Time items wait in a batch coalescer until their batch is sent",
+    ["batcher"],
+    buckets=LATENCY_BUCKETS,
+)
+
+INDEX_QUEUE_JOBS = Gauge(
+    "index_queue_jobs",
+    "Indexing jobs by status",
+    ["status"],
+)
+INDEX_JOBS = Counter(
+    "index_jobs",
+    "Indexing jobs processed by the worker by outcome",
+    ["result"],
+)
+INDEX_JOB_SECONDS = Histogram(
+    "index_job_seconds",
+    "Duration of indexing jobs",
+    buckets=LATENCY_BUCKETS,
+)
+INDEX_EMBEDDINGS = Counter(
+    "index_embeddings",
+    "Chunk embeddings stored by the indexer, by where the embedding came from",
+    ["source"],
+)
+INDEX_PIPELINE_SECONDS = Histogram(
+    "index_pipeline_busy_seconds",
+    "Busy time of the indexing pipeline stages per document",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# stage -> seconds spent in it by the current request, for Server-Timing.
+# Set per request, run_in_threadpool copies the context so DB calls in
+# threads add to the same dict.
+request_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "request_stages", default=None
+)
+
+
+def add_request_time(stage: str, seconds: float):
+    stages = request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str, operation: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage, operation).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started_at
+        STAGE_SECONDS.labels(stage, operation).observe(elapsed)
+        add_request_time(stage, elapsed)
+
+
+# Server-Timing only, for waits whose call is measured elsewhere,
+# e.g. a query in a ColPali batch shared with other requests
+@contextmanager
+def request_timed(stage: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_request_time(stage, time.perf_counter() - started_at)
+
+
+def server_timing_header(stages: Dict[str, float], total: float) -> str:
+    return ", ".join(
+        [
+            *(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items()),
+            f"total;dur={total * 1000:.1f}",
+        ]
+    )
+
+
+# Adds Server-Timing with the time spent per stage to every response.
+# Streamed responses only carry the stages done before the first byte.
+class ServerTimingMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages: Dict[str, float] = {}
+        token = request_stages.set(stages)
+        started_at = time.perf_counter()
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    server_timing_header(stages, time.perf_counter() - started_at),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stages.reset(token)
+
+
+# times every statement run on the engine, labelled by its SQL verb
+def instrument_engine(engine: Engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+        STAGE_SECONDS.labels(STAGE_DB, sql_operation(statement)).observe(elapsed)
+        add_request_time(STAGE_DB, elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None:
+            started_at = context.connection.info.get("query_started_at")
+            if started_at:
+                started_at.pop()
+        STAGE_ERRORS.labels(STAGE_DB, sql_operation(context.statement or "")).inc()
+
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def sql_operation(statement: str) -> str:
+    verb = statement.lstrip()[:6].upper()
+    return verb.lower() if verb in SQL_OPERATIONS else "other"
+
+
+def generate_metrics() -> bytes:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
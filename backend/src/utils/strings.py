@@ -1,8 +1,10 @@
 import base64
 from io import BytesIO
 import re
+import unicodedata
 
 snake_case_regex = re.compile(r"(?!^)([A-Z]+)")
+whitespace_regex = re.compile(r"\s+")
 
 
 def base64_encode(b: bytes) -> str:
@@ -18,3 +20,7 @@ def base64_decode(s: str) -> bytes:
 
 def to_snake_case(camel_str):
     return snake_case_regex.sub(r"_\1", camel_str).lower()
+
+
+def normalize_query(query: str) -> str:
+    return whitespace_regex.sub(" ", unicodedata.normalize("NFKC", query)).strip()
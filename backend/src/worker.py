@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import traceback
+
+from prometheus_client import start_http_server
+from starlette.concurrency import run_in_threadpool
+
+from .classifier.classifier_models import Document, IndexJob
+from .classifier.classifier_service import DocIndexer
+from .classifier.index_queue import LEASE_MS, IndexQueue, LeaseLostError
+from .colpali.doc_indexers import create_doc_indexer
+from .database import SessionLocal, engine
+from .utils.metrics import (
+    INDEX_JOB_SECONDS,
+    INDEX_JOBS,
+    INDEX_QUEUE_JOBS,
+    instrument_engine,
+)
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+
+logger = logging.getLogger(__name__)
+
+# documents indexed at once, their images are packed into shared ColPali batches
+CONCURRENCY = int(os.environ.get("INDEX_WORKER_CONCURRENCY", "4"))
+POLL_INTERVAL = float(os.environ.get("INDEX_WORKER_POLL_INTERVAL", "2"))
+HEARTBEAT_INTERVAL = LEASE_MS / 1000 / 3
+# Prometheus metrics of the worker are served on this port, 0 turns it off
+METRICS_PORT = int(os.environ.get("INDEX_WORKER_METRICS_PORT", "9100"))
+# how often the queue depth is read from Postgres
+QUEUE_METRICS_INTERVAL = float(os.environ.get("INDEX_QUEUE_METRICS_INTERVAL", "15"))
+
+
+class IndexWorker:
+    def __init__(self, doc_indexer: DocIndexer, worker_id: str) -> None:
+        self.doc_indexer = doc_indexer
+        self.worker_id = worker_id
+        self.queue = IndexQueue()
+
+    async def run(self, concurrency: int):
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(concurrency):
+                tg.create_task(self.__loop())
+            if METRICS_PORT:
+                tg.create_task(self.__report_queue())
+
+    async def __loop(self):
+        while True:
+            job = await run_in_threadpool(self.__claim)
+            if not job:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            await self.__process(job)
+
+    async def __process(self, job: IndexJob):
+        started_at = time.perf_counter()
+        result = await self.__run_job(job)
+        INDEX_JOBS.labels(result).inc()
+        INDEX_JOB_SECONDS.observe(time.perf_counter() - started_at)
+
+    # outcome of the job for the metrics
+    async def __run_job(self, job: IndexJob) -> str:
+        logger.info(f"Processing job {job.id=} {job.doc_id=} {job.attempts=}")
+        heartbeat = asyncio.create_task(self.__heartbeat(job))
+        index = asyncio.create_task(self.__index(job))
+        try:
+            done, _ = await asyncio.wait(
+                [heartbeat, index], return_when=asyncio.FIRST_COMPLETED
+            )
+            if heartbeat in done:
+                # lease lost, someone else owns the job now
+                index.cancel()
+                logger.error(f"Abandoning job {job.id=}: {heartbeat.exception()}")
+                return "abandoned"
+            index.result()
+        except asyncio.CancelledError:
+            index.cancel()
+            await run_in_threadpool(self.__with_db, self.queue.release, job)
+            raise
+        except Exception:
+            logger.exception(f"Job {job.id=} failed")
+            await run_in_threadpool(
+                self.__with_db, self.queue.fail, job, traceback.format_exc()
+            )
+            return "failed"
+        finally:
+            heartbeat.cancel()
+
+        try:
+            await run_in_threadpool(self.__with_db, self.queue.complete, job)
+        except LeaseLostError:
+            logger.error(f"Job {job.id=} finished after its lease was lost")
+            return "lease_lost"
+        return "done"
+
+    async def __index(self, job: IndexJob):
+        doc = await run_in_threadpool(self.__load_document, job.doc_id)
+        if not doc:
+            logger.warning(f"Document of job {job.id=} is gone")
+            return
+        await self.doc_indexer.index(doc)
+
+    async def __heartbeat(self, job: IndexJob):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            await run_in_threadpool(self.__with_db, self.queue.heartbeat, job)
+
+    async def __report_queue(self):
+        while True:
+            try:
+                counts = await run_in_threadpool(self.__queue_counts)
+                for status, count in counts.items():
+                    INDEX_QUEUE_JOBS.labels(status).set(count)
+            except Exception:
+                logger.exception("Reading the queue depth failed")
+            await asyncio.sleep(QUEUE_METRICS_INTERVAL)
+
+    def __queue_counts(self):
+        with SessionLocal() as db:
+            return self.queue.counts(db)
+
+    def __load_document(self, doc_id: int):
+        with SessionLocal() as db:
+            return db.query(Document).filter(Document.id == doc_id).first()
+
+    def __claim(self):
+        with SessionLocal() as db:
+            return self.queue.claim(db, self.worker_id)
+
+    def __with_db(self, fn, job: IndexJob, *args):
+        with SessionLocal() as db:
+            return fn(db, job, *args)
+
+
+async def main():
+    instrument_engine(engine)
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    doc_indexer = create_doc_indexer()
+    await doc_indexer.init()
+    worker = IndexWorker(doc_indexer, worker_id=f"{socket.gethostname()}:{os.getpid()}")
+
+    task = asyncio.create_task(worker.run(CONCURRENCY))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        logger.info("Worker stopped")
+    finally:
+        await doc_indexer.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
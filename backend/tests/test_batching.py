@@ -0,0 +1,128 @@
+import asyncio
+from typing import List
+import unittest
+
+from src.utils.batching import BatchCancelledError, BatchCoalescer
+
+
+class BatchCoalescerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.batches: List[List[int]] = []
+
+    async def double(self, items: List[int]) -> List[int]:
+        self.batches.append(items)
+        return [item * 2 for item in items]
+
+    async def test_concurrent_submits_share_a_batch(self):
+        batcher = BatchCoalescer(self.double, max_batch=8, max_wait=0.01)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertEqual(self.batches, [[0, 1, 2, 3, 4]])
+        self.assertEqual(batcher.stats.batches, 1)
+        self.assertEqual(batcher.stats.items, 5)
+
+    async def test_full_batches_go_out_without_waiting(self):
+        # would time out if the full batches waited for max_wait
+        batcher = BatchCoalescer(self.double, max_batch=2, max_wait=60)
+        results = await asyncio.wait_for(batcher.submit_many([1, 2, 3, 4]), 1)
+        self.assertEqual(results, [2, 4, 6, 8])
+        self.assertEqual(self.batches, [[1, 2], [3, 4]])
+
+    async def test_submit_many_spans_batches_in_order(self):
+        batcher = BatchCoalescer(self.double, max_batch=3, max_wait=0.01)
+        first, second = await asyncio.gather(
+            batcher.submit_many([1, 2]), batcher.submit_many([3, 4, 5])
+        )
+        self.assertEqual(first, [2, 4])
+        self.assertEqual(second, [6, 8, 10])
+        self.assertEqual(self.batches, [[1, 2, 3], [4, 5]])
+
+    async def test_failure_fails_every_caller_of_the_batch(self):
+        async def fail(items: List[int]) -> List[int]:
+            raise ValueError("ColPali down")
+
+        batcher = BatchCoalescer(fail, max_batch=8, max_wait=0.01)
+        results = await asyncio.gather(
+            *(batcher.submit(i) for i in range(3)), return_exceptions=True
+        )
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(batcher.stats.errors, 1)
+
+    async def test_failure_does_not_affect_other_batches(self):
+        async def fail_odd(items: List[int]) -> List[int]:
+            if items[0] % 2:
+                raise ValueError("odd")
+            return items
+
+        batcher = BatchCoalescer(fail_odd, max_batch=1, max_wait=0.01)
+        results = await asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True
+        )
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(results[1], 2)
+
+    async def test_missing_results_fail_the_batch(self):
+        async def drop_one(items: List[int]) -> List[int]:
+            return items[1:]
+
+        batcher = BatchCoalescer(drop_one, max_batch=8, max_wait=0.01)
+        with self.assertRaises(RuntimeError):
+            await asyncio.gather(batcher.submit(1), batcher.submit(2))
+
+    async def test_cancelled_batch_fails_its_callers(self):
+        started = asyncio.Event()
+
+        async def hang(items: List[int]) -> List[int]:
+            started.set()
+            await asyncio.Event().wait()
+            return items
+
+        batcher = BatchCoalescer(hang, max_batch=2, max_wait=0.01)
+        callers = asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True
+        )
+        await started.wait()
+        for task in list(batcher.tasks):
+            task.cancel()
+        results = await asyncio.wait_for(callers, 1)
+        for result in results:
+            self.assertIsInstance(result, BatchCancelledError)
+
+    async def test_batch_cancelled_while_queued_fails_its_callers(self):
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def wait_for_release(items: List[int]) -> List[int]:
+            started.set()
+            await release.wait()
+            return items
+
+        batcher = BatchCoalescer(
+            wait_for_release, max_batch=1, max_wait=0.01, concurrency=1
+        )
+        first = asyncio.ensure_future(batcher.submit(1))
+        await started.wait()
+        running = set(batcher.tasks)
+        second = asyncio.ensure_future(batcher.submit(2))
+        await asyncio.sleep(0)
+        # waits for the semaphore held by the first batch
+        (queued,) = batcher.tasks - running
+        queued.cancel()
+        with self.assertRaises(BatchCancelledError):
+            await asyncio.wait_for(second, 1)
+        release.set()
+        self.assertEqual(await first, 1)
+
+    async def test_caller_giving_up_is_skipped(self):
+        batcher = BatchCoalescer(self.double, max_batch=8, max_wait=0.01)
+        gave_up = asyncio.ensure_future(batcher.submit(1))
+        await asyncio.sleep(0)
+        gave_up.cancel()
+        self.assertEqual(await batcher.submit(2), 4)
+        self.assertEqual(self.batches, [[2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import unittest
+
+import httpx
+import numpy as np
+import zstandard
+
+from src.colpali.colpali_client import ColpaliClient
+from src.colpali.colpali_codec import (
+    EMBEDDINGS_MIME,
+    HEADER,
+    MAGIC,
+    decode_embeddings,
+    encode_embeddings,
+)
+
+
+def random_embeddings(shapes, dtype=np.float32):
+    rng = np.random.default_rng(0)
+    return [rng.standard_normal(shape).astype(dtype) for shape in shapes]
+
+
+class ColpaliCodecTest(unittest.TestCase):
+    def test_round_trip_float32(self):
+        embeddings = random_embeddings([(3, 128), (1, 128), (0, 128)])
+        decoded = decode_embeddings(encode_embeddings(embeddings, dtype="float32"))
+        self.assertEqual(len(decoded), 3)
+        for original, result in zip(embeddings, decoded):
+            self.assertEqual(result.dtype, np.float32)
+            np.testing.assert_array_equal(result, original)
+
+    def test_round_trip_float16(self):
+        embeddings = random_embeddings([(5, 64), (2, 64)])
+        decoded = decode_embeddings(encode_embeddings(embeddings, dtype="float16"))
+        for original, result in zip(embeddings, decoded):
+            self.assertEqual(result.dtype, np.float16)
+            self.assertEqual(result.shape, original.shape)
+            np.testing.assert_allclose(result, original, rtol=1e-3, atol=1e-3)
+
+    def test_float16_halves_the_payload(self):
+        embeddings = random_embeddings([(10, 128)])
+        float16 = encode_embeddings(embeddings, dtype="float16")
+        float32 = encode_embeddings(embeddings, dtype="float32")
+        self.assertEqual(len(float32) - len(float16), 10 * 128 * 2)
+
+    def test_empty_batch(self):
+        self.assertEqual(decode_embeddings(encode_embeddings([])), [])
+
+    def test_truncated_payload(self):
+        data = encode_embeddings(random_embeddings([(3, 16), (2, 16)]))
+        for length in [0, HEADER.size - 1, HEADER.size + 4, len(data) - 1]:
+            with self.subTest(length=length):
+                with self.assertRaises(ValueError):
+                    decode_embeddings(data[:length])
+
+    def test_trailing_bytes(self):
+        data = encode_embeddings(random_embeddings([(3, 16)]))
+        with self.assertRaises(ValueError):
+            decode_embeddings(data + b"\0\0")
+
+    def test_bad_magic(self):
+        data = encode_embeddings(random_embeddings([(1, 8)]))
+        with self.assertRaisesRegex(ValueError, "Not a ColPali"):
+            decode_embeddings(b"XXXX" + data[len(MAGIC) :])
+
+    def test_bad_version(self):
+        data = bytearray(encode_embeddings(random_embeddings([(1, 8)])))
+        data[4] = 99
+        with self.assertRaisesRegex(ValueError, "version 99"):
+            decode_embeddings(bytes(data))
+
+    def test_bad_dtype(self):
+        data = bytearray(encode_embeddings(random_embeddings([(1, 8)])))
+        data[5] = 99
+        with self.assertRaisesRegex(ValueError, "dtype 99"):
+            decode_embeddings(bytes(data))
+
+
+class ColpaliClientWireFormatTest(unittest.TestCase):
+    def request_embeddings(self, handler, **kwargs):
+        async def run():
+            client = ColpaliClient("http://colpali", **kwargs)
+            client.http = httpx.AsyncClient(
+                base_url="http://colpali", transport=httpx.MockTransport(handler)
+            )
+            try:
+                return await client.process_queries(["query"])
+            finally:
+                await client.close()
+
+        return asyncio.run(run())
+
+    def test_zstd_binary_response(self):
+        embeddings = random_embeddings([(4, 32)])
+        requests = []
+
+        def handler(request: httpx.Request):
+            requests.append(request)
+            body = encode_embeddings(embeddings, dtype="float16")
+            return httpx.Response(
+                200,
+                headers={
+                    "Content-Type": EMBEDDINGS_MIME,
+                    "Content-Encoding": "zstd",
+                },
+                content=zstandard.ZstdCompressor().compress(body),
+            )
+
+        result = self.request_embeddings(handler)
+        self.assertIn(EMBEDDINGS_MIME, requests[0].headers["Accept"])
+        self.assertEqual(requests[0].headers["X-Embeddings-Dtype"], "float16")
+        np.testing.assert_allclose(result[0], embeddings[0], rtol=1e-3, atol=1e-3)
+
+    def test_json_fallback(self):
+        embeddings = random_embeddings([(2, 8)])
+
+        def handler(request: httpx.Request):
+            body = {"embedding_batches": [e.tolist() for e in embeddings]}
+            return httpx.Response(
+                200,
+                headers={"Content-Type": "application/json"},
+                content=json.dumps(body).encode(),
+            )
+
+        result = self.request_embeddings(handler)
+        self.assertEqual(result[0].dtype, np.float32)
+        np.testing.assert_allclose(result[0], embeddings[0], rtol=1e-6)
+
+    def test_json_wire_format_does_not_negotiate(self):
+        requests = []
+
+        def handler(request: httpx.Request):
+            requests.append(request)
+            return httpx.Response(200, json={"embedding_batches": [[[0.0]]]})
+
+        self.request_embeddings(handler, wire_format="json")
+        self.assertNotIn(EMBEDDINGS_MIME, requests[0].headers.get("Accept", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
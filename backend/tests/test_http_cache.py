@@ -0,0 +1,173 @@
+import asyncio
+import tempfile
+import unittest
+from typing import Dict
+
+from fastapi import Request
+import httpx
+
+from src.blobs.blob_responses import blob_response, bytes_response
+from src.blobs.blob_store import LocalBlobStore
+from src.utils.http_cache import (
+    ByteRange,
+    RangeNotSatisfiable,
+    content_etag,
+    etag_matches,
+    requested_range,
+)
+
+CONTENT = bytes(range(100))
+ETAG = content_etag("abc")
+
+
+def make_request(headers: Dict[str, str]) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [
+                (name.lower().encode(), value.encode())
+                for name, value in headers.items()
+            ],
+        }
+    )
+
+
+def read_body(res) -> bytes:
+    async def read():
+        return b"".join([chunk async for chunk in res.body_iterator])
+
+    return asyncio.run(read())
+
+
+def byte_range(range_header: str, size: int = len(CONTENT), **headers: str):
+    return requested_range(make_request({"Range": range_header, **headers}), size, ETAG)
+
+
+class RequestedRangeTest(unittest.TestCase):
+    def test_no_range(self):
+        self.assertIsNone(requested_range(make_request({}), 100, ETAG))
+
+    def test_closed_range(self):
+        self.assertEqual(byte_range("bytes=10-19"), ByteRange(10, 19))
+        self.assertEqual(byte_range("bytes=10-19").length, 10)
+
+    def test_end_past_size_is_clamped(self):
+        self.assertEqual(byte_range("bytes=90-500"), ByteRange(90, 99))
+
+    def test_open_ended_range(self):
+        self.assertEqual(byte_range("bytes=40-"), ByteRange(40, 99))
+        self.assertEqual(byte_range("bytes=99-"), ByteRange(99, 99))
+
+    def test_suffix_range(self):
+        self.assertEqual(byte_range("bytes=-10"), ByteRange(90, 99))
+        # longer than the content, all of it
+        self.assertEqual(byte_range("bytes=-500"), ByteRange(0, 99))
+
+    def test_multiple_ranges_send_everything(self):
+        self.assertIsNone(byte_range("bytes=0-9,20-29"))
+        self.assertIsNone(byte_range("bytes=-5, 0-1"))
+
+    def test_unsatisfiable(self):
+        for header in ["bytes=100-", "bytes=100-200", "bytes=-0"]:
+            with self.subTest(header=header):
+                with self.assertRaises(RangeNotSatisfiable):
+                    byte_range(header)
+        with self.assertRaises(RangeNotSatisfiable):
+            byte_range("bytes=0-", size=0)
+
+    def test_invalid_ranges_are_ignored(self):
+        for header in [
+            "bytes=20-10",
+            "bytes=-",
+            "bytes=abc",
+            "bytes=1_0-20",
+            "bytes=+5-10",
+            "bytes=5--10",
+            "items=0-10",
+        ]:
+            with self.subTest(header=header):
+                self.assertIsNone(byte_range(header))
+
+    def test_if_range(self):
+        self.assertEqual(byte_range("bytes=0-9", **{"If-Range": ETAG}), ByteRange(0, 9))
+        self.assertIsNone(byte_range("bytes=0-9", **{"If-Range": '"other"'}))
+
+
+class EtagMatchesTest(unittest.TestCase):
+    def test_matches(self):
+        for header in [ETAG, f'"x", {ETAG}', f"W/{ETAG}", "*"]:
+            with self.subTest(header=header):
+                self.assertTrue(
+                    etag_matches(make_request({"If-None-Match": header}), ETAG)
+                )
+
+    def test_does_not_match(self):
+        self.assertFalse(etag_matches(make_request({}), ETAG))
+        self.assertFalse(etag_matches(make_request({"If-None-Match": '"x"'}), ETAG))
+
+
+class RangeResponseTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.blob_store = LocalBlobStore(tmp_dir.name)
+        self.hash = self.blob_store.put(CONTENT)
+
+    def responses(self, headers: Dict[str, str]):
+        request_headers = {"ETag": ETAG}
+        yield "bytes", bytes_response(
+            CONTENT, "image/png", request_headers, make_request(headers)
+        )
+        yield "blob", blob_response(
+            self.blob_store,
+            self.hash,
+            "image/png",
+            request_headers,
+            make_request(headers),
+        )
+
+    def test_partial_content(self):
+        for name, res in self.responses({"Range": "bytes=-10"}):
+            with self.subTest(name):
+                self.assertEqual(res.status_code, httpx.codes.PARTIAL_CONTENT)
+                self.assertEqual(res.headers["Content-Range"], "bytes 90-99/100")
+                self.assertEqual(res.headers["Content-Length"], "10")
+                self.assertEqual(read_body(res), CONTENT[90:])
+
+    def test_range_not_satisfiable(self):
+        for name, res in self.responses({"Range": "bytes=200-"}):
+            with self.subTest(name):
+                self.assertEqual(
+                    res.status_code, httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE
+                )
+                self.assertEqual(res.headers["Content-Range"], "bytes */100")
+
+    def test_if_none_match_wins_over_range(self):
+        for name, res in self.responses({"Range": "bytes=0-9", "If-None-Match": ETAG}):
+            with self.subTest(name):
+                self.assertEqual(res.status_code, httpx.codes.NOT_MODIFIED)
+                self.assertEqual(res.headers["ETag"], ETAG)
+
+    def test_if_none_match_wins_over_unsatisfiable_range(self):
+        for name, res in self.responses({"Range": "bytes=200-", "If-None-Match": ETAG}):
+            with self.subTest(name):
+                self.assertEqual(res.status_code, httpx.codes.NOT_MODIFIED)
+
+    def test_stale_etag_gets_the_range(self):
+        for name, res in self.responses(
+            {"Range": "bytes=0-9", "If-None-Match": '"old"'}
+        ):
+            with self.subTest(name):
+                self.assertEqual(res.status_code, httpx.codes.PARTIAL_CONTENT)
+
+    def test_no_etag_is_never_not_modified(self):
+        res = bytes_response(
+            CONTENT, "image/png", {}, make_request({"If-None-Match": "*"})
+        )
+        self.assertEqual(res.status_code, httpx.codes.OK)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import unittest
+from unittest import mock
+
+import boto3
+from moto import mock_aws
+
+from src.blobs.blob_store import BlobNotFoundError, blob_hash
+from src.blobs.s3_blob_store import S3BlobStore
+
+BUCKET = "blobs"
+
+
+@mock_aws
+class S3BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        env = mock.patch.dict(
+            os.environ,
+            {
+                "AWS_ACCESS_KEY_ID": "test",
+                "AWS_SECRET_ACCESS_KEY": "test",
+                "AWS_DEFAULT_REGION": "us-east-1",
+            },
+        )
+        env.start()
+        self.addCleanup(env.stop)
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        self.store = S3BlobStore(BUCKET, prefix="test/")
+
+    def test_put_get(self):
+        hash = self.store.put(b"page image")
+        self.assertEqual(hash, blob_hash(b"page image"))
+        self.assertEqual(self.store.get(hash), b"page image")
+        self.assertEqual(self.store.size(hash), len(b"page image"))
+
+    def test_keys_use_prefix_and_fan_out(self):
+        hash = self.store.put(b"data")
+        keys = [
+            obj["Key"]
+            for obj in boto3.client("s3").list_objects_v2(Bucket=BUCKET)["Contents"]
+        ]
+        self.assertEqual(keys, [f"test/{hash[:2]}/{hash[2:4]}/{hash}"])
+
+    def test_exists(self):
+        hash = blob_hash(b"data")
+        self.assertFalse(self.store.exists(hash))
+        self.store.put(b"data")
+        self.assertTrue(self.store.exists(hash))
+
+    def test_delete(self):
+        hash = self.store.put(b"data")
+        self.store.delete(hash)
+        self.assertFalse(self.store.exists(hash))
+        with self.assertRaises(BlobNotFoundError):
+            self.store.get(hash)
+        # deleting a missing blob is not an error
+        self.store.delete(hash)
+
+    def test_put_same_bytes_is_idempotent(self):
+        s3 = boto3.client("s3")
+        first = self.store.put(b"data")
+        with mock.patch.object(
+            self.store.s3, "put_object", wraps=self.store.s3.put_object
+        ) as put_object:
+            second = self.store.put(b"data")
+        self.assertEqual(first, second)
+        put_object.assert_not_called()
+        self.assertEqual(s3.list_objects_v2(Bucket=BUCKET)["KeyCount"], 1)
+
+    def test_missing_blob(self):
+        hash = blob_hash(b"missing")
+        with self.assertRaises(BlobNotFoundError):
+            self.store.get(hash)
+        with self.assertRaises(BlobNotFoundError):
+            self.store.size(hash)
+
+    def test_chunks_and_range(self):
+        data = bytes(range(256)) * 1024
+        hash = self.store.put(data)
+        self.assertEqual(b"".join(self.store.iter_chunks(hash)), data)
+        self.assertEqual(b"".join(self.store.iter_range(hash, 100, 50)), data[100:150])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+-- migrate:up
+
+CREATE TABLE public.index_job (
+    doc_id integer NOT NULL,
+    status character varying NOT NULL,
+    attempts integer NOT NULL DEFAULT 0,
+    run_after bigint NOT NULL,
+    lease_owner character varying,
+    lease_expires_at bigint,
+    last_error character varying,
+    created_at bigint NOT NULL,
+    updated_at bigint NOT NULL,
+    id integer NOT NULL
+);
+
+CREATE SEQUENCE public.index_job_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER SEQUENCE public.index_job_id_seq OWNED BY public.index_job.id;
+
+ALTER TABLE ONLY public.index_job ALTER COLUMN id SET DEFAULT nextval('public.index_job_id_seq'::regclass);
+
+ALTER TABLE ONLY public.index_job
+    ADD CONSTRAINT index_job_pkey PRIMARY KEY (id);
+
+ALTER TABLE ONLY public.index_job
+    ADD CONSTRAINT index_job_doc_id_fkey FOREIGN KEY (doc_id) REFERENCES public.document(id);
+
+-- at most one active job per document
+CREATE UNIQUE INDEX index_job_active_doc_id_idx ON public.index_job USING btree (doc_id)
+    WHERE ((status)::text = ANY ((ARRAY['pending'::character varying, 'running'::character varying])::text[]));
+
+CREATE INDEX index_job_status_run_after_idx ON public.index_job USING btree (status, run_after);
+
+-- documents uploaded before the queue existed
+INSERT INTO public.index_job (doc_id, status, run_after, created_at, updated_at)
+SELECT id, 'pending', 0, created_at, created_at FROM public.document WHERE NOT indexed;
+
+-- migrate:down
+
+DROP TABLE IF EXISTS public.index_job;
@@ -0,0 +1,29 @@
+-- migrate:up
+
+-- blobs move to the blob store, rows keep their sha256,
+-- the bytea columns are emptied by `python -m src.blobs.migrate_blobs`,
+-- run it once all migrations are applied
+ALTER TABLE public.document_content ADD COLUMN content_hash character varying;
+ALTER TABLE public.document_content ALTER COLUMN content DROP NOT NULL;
+
+ALTER TABLE public.document_page ADD COLUMN image_hash character varying;
+ALTER TABLE public.document_page ALTER COLUMN image DROP NOT NULL;
+
+ALTER TABLE public.document_chunk ADD COLUMN image_hash character varying;
+ALTER TABLE public.document_chunk ALTER COLUMN image DROP NOT NULL;
+
+CREATE INDEX document_content_content_hash_idx ON public.document_content USING btree (content_hash);
+CREATE INDEX document_page_image_hash_idx ON public.document_page USING btree (image_hash);
+CREATE INDEX document_chunk_image_hash_idx ON public.document_chunk USING btree (image_hash);
+
+-- migrate:down
+
+-- blobs must be moved back with `python -m src.blobs.migrate_blobs --restore` first
+ALTER TABLE public.document_chunk ALTER COLUMN image SET NOT NULL;
+ALTER TABLE public.document_chunk DROP COLUMN image_hash;
+
+ALTER TABLE public.document_page ALTER COLUMN image SET NOT NULL;
+ALTER TABLE public.document_page DROP COLUMN image_hash;
+
+ALTER TABLE public.document_content ALTER COLUMN content SET NOT NULL;
+ALTER TABLE public.document_content DROP COLUMN content_hash;
@@ -0,0 +1,32 @@
+-- migrate:up
+
+-- resized / re-encoded variants of page and chunk images, the blobs
+-- live in the blob store, variant identifies size, format and quality
+CREATE TABLE public.image_rendition (
+    source_hash character varying NOT NULL,
+    variant character varying NOT NULL,
+    blob_hash character varying NOT NULL,
+    mime character varying NOT NULL,
+    id integer NOT NULL
+);
+
+CREATE SEQUENCE public.image_rendition_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER SEQUENCE public.image_rendition_id_seq OWNED BY public.image_rendition.id;
+
+ALTER TABLE ONLY public.image_rendition ALTER COLUMN id SET DEFAULT nextval('public.image_rendition_id_seq'::regclass);
+
+ALTER TABLE ONLY public.image_rendition
+    ADD CONSTRAINT image_rendition_pkey PRIMARY KEY (id);
+
+CREATE UNIQUE INDEX image_rendition_source_hash_variant_idx ON public.image_rendition USING btree (source_hash, variant);
+
+-- migrate:down
+
+DROP TABLE IF EXISTS public.image_rendition;
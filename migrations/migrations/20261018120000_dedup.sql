@@ -0,0 +1,81 @@
+-- migrate:up
+
+-- sha256 of the uploaded bytes, identical uploads return the existing document.
+-- Earlier duplicates keep NULL, only the oldest copy is matched.
+-- Rows whose blobs are still inline have no hash yet, run
+-- `python -m src.blobs.migrate_blobs` after this migration, it moves the
+-- blobs and backfills document.content_hash and chunk_embedding.image_hash
+ALTER TABLE public.document ADD COLUMN content_hash character varying;
+
+UPDATE public.document d SET content_hash = c.content_hash
+FROM (
+    SELECT doc_id, content_hash,
+        row_number() OVER (PARTITION BY content_hash ORDER BY doc_id) AS n
+    FROM public.document_content
+    WHERE content_hash IS NOT NULL
+) c
+WHERE c.doc_id = d.id AND c.n = 1;
+
+CREATE UNIQUE INDEX document_content_hash_idx ON public.document USING btree (content_hash);
+
+-- one vector index point per distinct chunk image, shared by all chunks with
+-- that image. ref_count counts the chunks, the point goes with the last one
+CREATE TABLE public.chunk_embedding (
+    image_hash character varying,
+    ref_count integer NOT NULL,
+    stored boolean NOT NULL,
+    id integer NOT NULL
+);
+
+CREATE SEQUENCE public.chunk_embedding_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER SEQUENCE public.chunk_embedding_id_seq OWNED BY public.chunk_embedding.id;
+
+ALTER TABLE ONLY public.chunk_embedding ALTER COLUMN id SET DEFAULT nextval('public.chunk_embedding_id_seq'::regclass);
+
+ALTER TABLE ONLY public.chunk_embedding
+    ADD CONSTRAINT chunk_embedding_pkey PRIMARY KEY (id);
+
+CREATE UNIQUE INDEX chunk_embedding_image_hash_idx ON public.chunk_embedding USING btree (image_hash);
+
+ALTER TABLE public.document_chunk ADD COLUMN embedding_id integer;
+
+ALTER TABLE ONLY public.document_chunk
+    ADD CONSTRAINT document_chunk_embedding_id_fkey FOREIGN KEY (embedding_id) REFERENCES public.chunk_embedding(id);
+
+CREATE INDEX document_chunk_embedding_id_idx ON public.document_chunk USING btree (embedding_id);
+
+-- points of indexed chunks were stored under the chunk id, keep them as they are.
+-- Only the oldest chunk of an image takes the hash and is shared from now on
+INSERT INTO public.chunk_embedding (id, image_hash, ref_count, stored)
+SELECT c.id, CASE WHEN c.n = 1 THEN c.image_hash END, 1, true
+FROM (
+    SELECT dc.id, dc.image_hash,
+        row_number() OVER (PARTITION BY dc.image_hash ORDER BY dc.id) AS n
+    FROM public.document_chunk dc
+    JOIN public.document d ON d.id = dc.doc_id
+    WHERE d.indexed
+) c;
+
+UPDATE public.document_chunk SET embedding_id = id
+WHERE id IN (SELECT id FROM public.chunk_embedding);
+
+-- new point ids must not collide with the chunk ids used so far
+SELECT setval(
+    'public.chunk_embedding_id_seq',
+    GREATEST((SELECT max(id) FROM public.document_chunk), 1)
+);
+
+-- migrate:down
+
+-- points stored since the migration are keyed by embedding id, rebuild the index
+ALTER TABLE public.document_chunk DROP COLUMN IF EXISTS embedding_id;
+DROP TABLE IF EXISTS public.chunk_embedding;
+DROP INDEX IF EXISTS public.document_content_hash_idx;
+ALTER TABLE public.document DROP COLUMN IF EXISTS content_hash;
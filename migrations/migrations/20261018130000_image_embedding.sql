@@ -0,0 +1,31 @@
+-- migrate:up
+
+-- raw ColPali output per chunk image and model, float16 in the blob store,
+-- lets the vector index be rebuilt without the GPU
+CREATE TABLE public.image_embedding (
+    image_hash character varying NOT NULL,
+    model_id character varying NOT NULL,
+    blob_hash character varying NOT NULL,
+    id integer NOT NULL
+);
+
+CREATE SEQUENCE public.image_embedding_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER SEQUENCE public.image_embedding_id_seq OWNED BY public.image_embedding.id;
+
+ALTER TABLE ONLY public.image_embedding ALTER COLUMN id SET DEFAULT nextval('public.image_embedding_id_seq'::regclass);
+
+ALTER TABLE ONLY public.image_embedding
+    ADD CONSTRAINT image_embedding_pkey PRIMARY KEY (id);
+
+CREATE UNIQUE INDEX image_embedding_image_hash_model_id_idx ON public.image_embedding USING btree (image_hash, model_id);
+
+-- migrate:down
+
+DROP TABLE IF EXISTS public.image_embedding;
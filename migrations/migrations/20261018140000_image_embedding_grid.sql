@@ -0,0 +1,13 @@
+-- migrate:up
+
+-- layout of the image patch tokens in the cached embedding, lets similarity
+-- maps be computed locally. NULL for rows cached before, the configured grid
+ALTER TABLE public.image_embedding ADD COLUMN patch_rows integer;
+ALTER TABLE public.image_embedding ADD COLUMN patch_cols integer;
+ALTER TABLE public.image_embedding ADD COLUMN patch_offset integer;
+
+-- migrate:down
+
+ALTER TABLE public.image_embedding DROP COLUMN IF EXISTS patch_offset;
+ALTER TABLE public.image_embedding DROP COLUMN IF EXISTS patch_cols;
+ALTER TABLE public.image_embedding DROP COLUMN IF EXISTS patch_rows;
@@ -13,6 +13,38 @@ SET default_tablespace = '';
 
 SET default_table_access_method = heap;
 
+--
+-- Name: chunk_embedding; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.chunk_embedding (
+    image_hash character varying,
+    ref_count integer NOT NULL,
+    stored boolean NOT NULL,
+    id integer NOT NULL
+);
+
+
+--
+-- Name: chunk_embedding_id_seq; Type: SEQUENCE; Schema: public; Owner: -
+--
+
+CREATE SEQUENCE public.chunk_embedding_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+--
+-- Name: chunk_embedding_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: -
+--
+
+ALTER SEQUENCE public.chunk_embedding_id_seq OWNED BY public.chunk_embedding.id;
+
+
 --
 -- Name: document; Type: TABLE; Schema: public; Owner: -
 --
@@ -22,7 +54,8 @@ CREATE TABLE public.document (
     mime character varying NOT NULL,
     created_at bigint NOT NULL,
     indexed boolean NOT NULL,
-    id integer NOT NULL
+    id integer NOT NULL,
+    content_hash character varying
 );
 
 
@@ -33,8 +66,10 @@ CREATE TABLE public.document (
 CREATE TABLE public.document_chunk (
     doc_id integer NOT NULL,
     page_id integer NOT NULL,
-    image bytea NOT NULL,
-    id integer NOT NULL
+    image bytea,
+    id integer NOT NULL,
+    image_hash character varying,
+    embedding_id integer
 );
 
 
@@ -64,8 +99,9 @@ ALTER SEQUENCE public.document_chunk_id_seq OWNED BY public.document_chunk.id;
 
 CREATE TABLE public.document_content (
     doc_id integer NOT NULL,
-    content bytea NOT NULL,
-    id integer NOT NULL
+    content bytea,
+    id integer NOT NULL,
+    content_hash character varying
 );
 
 
@@ -116,8 +152,9 @@ ALTER SEQUENCE public.document_id_seq OWNED BY public.document.id;
 CREATE TABLE public.document_page (
     doc_id integer NOT NULL,
     number integer NOT NULL,
-    image bytea NOT NULL,
-    id integer NOT NULL
+    image bytea,
+    id integer NOT NULL,
+    image_hash character varying
 );
 
 
@@ -141,6 +178,112 @@ CREATE SEQUENCE public.document_page_id_seq
 ALTER SEQUENCE public.document_page_id_seq OWNED BY public.document_page.id;
 
 
+--
+-- Name: image_embedding; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.image_embedding (
+    image_hash character varying NOT NULL,
+    model_id character varying NOT NULL,
+    blob_hash character varying NOT NULL,
+    id integer NOT NULL,
+    patch_rows integer,
+    patch_cols integer,
+    patch_offset integer
+);
+
+
+--
+-- Name: image_embedding_id_seq; Type: SEQUENCE; Schema: public; Owner: -
+--
+
+CREATE SEQUENCE public.image_embedding_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+--
+-- Name: image_embedding_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: -
+--
+
+ALTER SEQUENCE public.image_embedding_id_seq OWNED BY public.image_embedding.id;
+
+
+--
+-- Name: image_rendition; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.image_rendition (
+    source_hash character varying NOT NULL,
+    variant character varying NOT NULL,
+    blob_hash character varying NOT NULL,
+    mime character varying NOT NULL,
+    id integer NOT NULL
+);
+
+
+--
+-- Name: image_rendition_id_seq; Type: SEQUENCE; Schema: public; Owner: -
+--
+
+CREATE SEQUENCE public.image_rendition_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+--
+-- Name: image_rendition_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: -
+--
+
+ALTER SEQUENCE public.image_rendition_id_seq OWNED BY public.image_rendition.id;
+
+
+--
+-- Name: index_job; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.index_job (
+    doc_id integer NOT NULL,
+    status character varying NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    run_after bigint NOT NULL,
+    lease_owner character varying,
+    lease_expires_at bigint,
+    last_error character varying,
+    created_at bigint NOT NULL,
+    updated_at bigint NOT NULL,
+    id integer NOT NULL
+);
+
+
+--
+-- Name: index_job_id_seq; Type: SEQUENCE; Schema: public; Owner: -
+--
+
+CREATE SEQUENCE public.index_job_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+--
+-- Name: index_job_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: -
+--
+
+ALTER SEQUENCE public.index_job_id_seq OWNED BY public.index_job.id;
+
+
 --
 -- Name: schema_migrations; Type: TABLE; Schema: public; Owner: -
 --
@@ -150,6 +293,13 @@ CREATE TABLE public.schema_migrations (
 );
 
 
+--
+-- Name: chunk_embedding id; Type: DEFAULT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.chunk_embedding ALTER COLUMN id SET DEFAULT nextval('public.chunk_embedding_id_seq'::regclass);
+
+
 --
 -- Name: document id; Type: DEFAULT; Schema: public; Owner: -
 --
@@ -178,6 +328,35 @@ ALTER TABLE ONLY public.document_content ALTER COLUMN id SET DEFAULT nextval('pu
 ALTER TABLE ONLY public.document_page ALTER COLUMN id SET DEFAULT nextval('public.document_page_id_seq'::regclass);
 
 
+--
+-- Name: image_embedding id; Type: DEFAULT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.image_embedding ALTER COLUMN id SET DEFAULT nextval('public.image_embedding_id_seq'::regclass);
+
+
+--
+-- Name: image_rendition id; Type: DEFAULT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.image_rendition ALTER COLUMN id SET DEFAULT nextval('public.image_rendition_id_seq'::regclass);
+
+
+--
+-- Name: index_job id; Type: DEFAULT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.index_job ALTER COLUMN id SET DEFAULT nextval('public.index_job_id_seq'::regclass);
+
+
+--
+-- Name: chunk_embedding chunk_embedding_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.chunk_embedding
+    ADD CONSTRAINT chunk_embedding_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: document_chunk document_chunk_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -210,6 +389,30 @@ ALTER TABLE ONLY public.document
     ADD CONSTRAINT document_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: image_embedding image_embedding_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.image_embedding
+    ADD CONSTRAINT image_embedding_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: image_rendition image_rendition_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.image_rendition
+    ADD CONSTRAINT image_rendition_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: index_job index_job_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.index_job
+    ADD CONSTRAINT index_job_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: schema_migrations schema_migrations_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -218,6 +421,76 @@ ALTER TABLE ONLY public.schema_migrations
     ADD CONSTRAINT schema_migrations_pkey PRIMARY KEY (version);
 
 
+--
+-- Name: chunk_embedding_image_hash_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX chunk_embedding_image_hash_idx ON public.chunk_embedding USING btree (image_hash);
+
+
+--
+-- Name: document_chunk_embedding_id_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX document_chunk_embedding_id_idx ON public.document_chunk USING btree (embedding_id);
+
+
+--
+-- Name: document_chunk_image_hash_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX document_chunk_image_hash_idx ON public.document_chunk USING btree (image_hash);
+
+
+--
+-- Name: document_content_content_hash_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX document_content_content_hash_idx ON public.document_content USING btree (content_hash);
+
+
+--
+-- Name: document_content_hash_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX document_content_hash_idx ON public.document USING btree (content_hash);
+
+
+--
+-- Name: document_page_image_hash_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX document_page_image_hash_idx ON public.document_page USING btree (image_hash);
+
+
+--
+-- Name: image_embedding_image_hash_model_id_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX image_embedding_image_hash_model_id_idx ON public.image_embedding USING btree (image_hash, model_id);
+
+
+--
+-- Name: image_rendition_source_hash_variant_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX image_rendition_source_hash_variant_idx ON public.image_rendition USING btree (source_hash, variant);
+
+
+--
+-- Name: index_job_active_doc_id_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX index_job_active_doc_id_idx ON public.index_job USING btree (doc_id) WHERE ((status)::text = ANY ((ARRAY['pending'::character varying, 'running'::character varying])::text[]));
+
+
+--
+-- Name: index_job_status_run_after_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX index_job_status_run_after_idx ON public.index_job USING btree (status, run_after);
+
+
 --
 -- Name: document_chunk document_chunk_doc_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -226,6 +499,14 @@ ALTER TABLE ONLY public.document_chunk
     ADD CONSTRAINT document_chunk_doc_id_fkey FOREIGN KEY (doc_id) REFERENCES public.document(id);
 
 
+--
+-- Name: document_chunk document_chunk_embedding_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.document_chunk
+    ADD CONSTRAINT document_chunk_embedding_id_fkey FOREIGN KEY (embedding_id) REFERENCES public.chunk_embedding(id);
+
+
 --
 -- Name: document_chunk document_chunk_page_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -250,6 +531,14 @@ ALTER TABLE ONLY public.document_page
     ADD CONSTRAINT document_page_doc_id_fkey FOREIGN KEY (doc_id) REFERENCES public.document(id);
 
 
+--
+-- Name: index_job index_job_doc_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.index_job
+    ADD CONSTRAINT index_job_doc_id_fkey FOREIGN KEY (doc_id) REFERENCES public.document(id);
+
+
 --
 -- PostgreSQL database dump complete
 --
@@ -260,4 +549,10 @@ ALTER TABLE ONLY public.document_page
 --
 
 INSERT INTO public.schema_migrations (version) VALUES
-    ('19990101000000');
+    ('19990101000000'),
+    ('20261018090000'),
+    ('20261018100000'),
+    ('20261018110000'),
+    ('20261018120000'),
+    ('20261018130000'),
+    ('20261018140000');
@@ -3,7 +3,9 @@ import { ApiService, type FilteringQuery, type FilteringResult } from '@/core/Ap
 import type {
   DocPreviewDto,
   DocumentDto,
+  ImageRendition,
   RagResponseDto,
+  RagStreamEvent,
   SearchResponseDto,
 } from './classifier-dto';
 
@@ -21,12 +23,12 @@ export class ClassifierApiService {
     );
   }
 
-  public getChunkImageUrl(id: number) {
-    return this.apiService.makeUrl(`documents/chunk/${id}/image`);
+  public getChunkImageUrl(id: number, rendition: ImageRendition = 'full') {
+    return this.apiService.makeUrl(`documents/chunk/${id}/image?rendition=${rendition}`);
   }
 
-  public getPageImageUrl(id: number) {
-    return this.apiService.makeUrl(`documents/page/${id}/image`);
+  public getPageImageUrl(id: number, rendition: ImageRendition = 'full') {
+    return this.apiService.makeUrl(`documents/page/${id}/image?rendition=${rendition}`);
   }
 
   public getDocDownloadUrl(id: number) {
@@ -61,6 +63,21 @@ export class ClassifierApiService {
     });
   }
 
+  // answer parts as the LLM writes them, ends with the whole answer
+  public async *ragStream(data: {
+    query: string;
+    chunks: number[];
+    requestId: number;
+  }): AsyncGenerator<RagStreamEvent> {
+    for await (const { event, data: json } of this.apiService.fetchEvents({
+      method: 'POST',
+      endpoint: 'documents/rag/stream',
+      data,
+    })) {
+      yield { event, data: JSON.parse(json) } as RagStreamEvent;
+    }
+  }
+
   public async search(query: string): Promise<SearchResponseDto> {
     // console.log(`Searching for ${data}`);
     return this.apiService.fetch({ method: 'POST', endpoint: 'documents/search', data: { query } });
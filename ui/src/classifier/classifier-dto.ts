@@ -28,8 +28,19 @@ export interface RagResponseDto {
   answer: string;
 }
 
+export interface RagDeltaDto {
+  delta: string;
+}
+
+export type RagStreamEvent =
+  | { event: 'delta'; data: RagDeltaDto }
+  | { event: 'done'; data: RagResponseDto }
+  | { event: 'error'; data: { detail: string } };
+
 export interface DocPreviewDto {
   id: number;
   name: string;
   pages: number[];
 }
+
+export type ImageRendition = 'thumbnail' | 'preview' | 'full' | 'model-input';
@@ -22,6 +22,11 @@ type FetchOpts<R, TTL extends boolean> = {
   headers?: Record<string, string>;
 };
 
+export interface ServerSentEvent {
+  event: string;
+  data: string;
+}
+
 type FetchReturnCondType<T, TTL extends boolean> = TTL extends true ? FilteringResult<T> : T;
 
 @injectable()
@@ -75,6 +80,56 @@ export class ApiService {
     }
   }
 
+  // server-sent events of a POST request, yielded as they arrive
+  public async *fetchEvents<R>({
+    method,
+    endpoint,
+    data,
+  }: {
+    method: string;
+    endpoint: string;
+    data?: R;
+  }): AsyncGenerator<ServerSentEvent> {
+    const res = await fetch(this.makeUrl(endpoint), {
+      method,
+      headers: {
+        Accept: 'text/event-stream',
+        'Content-Type': 'application/json',
+      },
+      body: data ? JSON.stringify(data) : undefined,
+    });
+    if (res.status < 200 || 299 < res.status || !res.body) {
+      throw new Error(`API error ${res.status}`);
+    }
+    const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    try {
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) {
+          return;
+        }
+        buffer += value;
+        let end: number;
+        while ((end = buffer.indexOf('\n\n')) >= 0) {
+          const block = buffer.slice(0, end);
+          buffer = buffer.slice(end + 2);
+          const event: ServerSentEvent = { event: 'message', data: '' };
+          for (const line of block.split('\n')) {
+            if (line.startsWith('event: ')) {
+              event.event = line.slice(7);
+            } else if (line.startsWith('data: ')) {
+              event.data += line.slice(6);
+            }
+          }
+          yield event;
+        }
+      }
+    } finally {
+      reader.cancel();
+    }
+  }
+
   public makeUrl(endpoint: string) {
     return this.appConfig.getApiBaseUrl() + '/' + endpoint;
   }